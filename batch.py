@@ -0,0 +1,506 @@
+"""
+Phân tích lại hàng loạt video đã ghi (headless, không cần Tk/webcam).
+
+Ví dụ:
+    python batch.py recordings/ --exercise Squat --workers 4
+    python batch.py a.avi b.avi --exercise "Bicep Curl" --manifest redo.json
+
+Mỗi worker process giữ 1 RehabDetector riêng. Kết quả được ghi qua
+utils.log_session (cùng schema với GUI) và vào manifest JSON, nên job bị
+ngắt giữa chừng có thể chạy lại và tiếp tục từ video chưa xong.
+
+Video dài (> 1.5 x --chunk-seconds) được chia thành các chunk chạy pose song
+song. Mỗi chunk bắt đầu decode sớm hơn --warmup-seconds để tracking của
+MediaPipe hội tụ; landmark của vùng warm-up bị bỏ. Sau khi đủ chunk, landmark
+được ghép theo thứ tự frame và chạy lại tuần tự qua RehabDetector.update
+(One-Euro, angle_window, stage machine, auto-calib) -> kết quả giống hệt
+chạy tuần tự trên cùng chuỗi landmark, phần tốn kém (decode + pose) vẫn song song.
+Chunk (.npy trong <manifest>.chunks) chỉ được giữ khi video còn dở để
+resume; video xong thì xóa, hết video dở thì xóa cả thư mục.
+
+Landmark của mỗi video được lưu vào cache (landmark_cache.py, khóa = hash nội
+dung video + tham số pose, video chia chunk thêm tham số chia chunk). Lần chạy sau (đổi threshold / filter / code state
+machine) gặp cache thì bỏ qua decode + pose, chỉ replay state machine.
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing as mp
+import os
+import re
+import shutil
+import time
+
+import cv2
+import numpy as np
+
+from exercises import exercise_names
+from landmark_cache import LandmarkCache, video_digest
+from replay import LandmarkRecorder, replay_landmarks
+
+VIDEO_EXTS = (".avi", ".mp4", ".mov", ".mkv")
+FRAME_SIZE = (800, 600)  # giống kích thước xử lý của GUI
+# Tham số PoseModel của worker (cũng là một phần khóa cache landmark)
+POSE_PARAMS = {
+    "model_complexity": 1,
+    "min_detection_confidence": 0.7,
+    "min_tracking_confidence": 0.7,
+}
+
+# Detector riêng cho mỗi worker process (tạo trong _init_worker)
+_detector = None
+
+
+def _init_worker():
+    global _detector
+    from pose_module import PoseModel, RehabDetector
+
+    _detector = RehabDetector(pose_model=PoseModel(**POSE_PARAMS))
+    _detector.sound_enabled = False
+
+
+def cache_params():
+    """Mọi thứ ngoài nội dung video quyết định output pose."""
+    from importlib import metadata
+
+    try:
+        mp_version = metadata.version("mediapipe")
+    except metadata.PackageNotFoundError:
+        mp_version = None
+    return dict(POSE_PARAMS, frame_size=list(FRAME_SIZE), mediapipe=mp_version)
+
+
+def patient_from_filename(path):
+    """'recordings/Patient_001_20240101_093000.avi' -> 'Patient_001'."""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return re.sub(r"_\d{8}_\d{6}$", "", stem)
+
+
+def collect_videos(inputs):
+    """Nhận danh sách file/thư mục, trả về list video đã sắp xếp."""
+    videos = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for name in sorted(os.listdir(item)):
+                if name.lower().endswith(VIDEO_EXTS):
+                    videos.append(os.path.join(item, name))
+        elif os.path.isfile(item):
+            videos.append(item)
+        else:
+            print(f"Skip (not found): {item}")
+    return videos
+
+
+def analyze_video(job):
+    """
+    Chạy detector trên toàn bộ 1 video (trong worker process).
+    cache = (thư mục, max_bytes, khóa) -> ghi landmark vào cache khi xong.
+    """
+    path, exercise, cache = job
+    detector = _detector
+    detector.reset_session()
+    detector.pose_model.reset()  # không mang tracking từ video trước
+    recorder = LandmarkRecorder(None, exercise) if cache else None
+    detector.recorder = recorder
+
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        return path, {"status": "error", "error": "Cannot open video"}
+
+    fps = cap.get(cv2.CAP_PROP_FPS) or 20.0
+    t0 = time.time()
+    frames = 0
+    try:
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frame = cv2.resize(frame, FRAME_SIZE)
+            # Thời gian theo video (không theo tốc độ xử lý) cho filter
+            detector.process_frame(frame, exercise, draw=False, timestamp=frames / fps)
+            frames += 1
+    except Exception as e:
+        return path, {"status": "error", "error": str(e)}
+    finally:
+        cap.release()
+        detector.recorder = None
+
+    if recorder is not None:
+        root, max_bytes, key = cache
+        try:
+            LandmarkCache(root, max_bytes).put(key, recorder.landmarks, fps, video=path)
+        except OSError as e:
+            print(f"Landmark cache write failed ({path}): {e}")
+
+    data = detector.session_data
+    rom_score, fatigue_flag = detector.compute_rom_and_fatigue(exercise)
+    calib_min, calib_max = detector.calibrated_range(exercise)
+    return path, {
+        "status": "done",
+        "patient": patient_from_filename(path),
+        "exercise": exercise,
+        "frames": frames,
+        "reps": data["reps"],
+        "min_angle": data["min_angle"],
+        "max_angle": data["max_angle"],
+        "rom_score": rom_score,
+        "fatigue_flag": fatigue_flag,
+        "calib_min": calib_min,
+        "calib_max": calib_max,
+        "duration_s": detector.series.duration,
+        "rep_records": detector.rep_records,
+        "elapsed_s": round(time.time() - t0, 2),
+    }
+
+
+# ===================== CHUNKING =====================
+
+def video_info(path):
+    """(frame_count, fps) theo metadata của container."""
+    cap = cv2.VideoCapture(path)
+    try:
+        count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        fps = cap.get(cv2.CAP_PROP_FPS) or 20.0
+    finally:
+        cap.release()
+    return count, fps
+
+
+def plan_chunks(frame_count, chunk_frames):
+    """Chia [0, frame_count) thành các đoạn; đoạn cuối đọc tới hết file (end=None)."""
+    starts = list(range(0, frame_count, chunk_frames))
+    # Gộp đoạn cuối quá ngắn vào đoạn trước
+    if len(starts) > 1 and frame_count - starts[-1] < chunk_frames // 2:
+        starts.pop()
+    ends = starts[1:] + [None]
+    return list(zip(starts, ends))
+
+
+def estimate_chunk(job):
+    """
+    Chạy pose trên [start, end) (bắt đầu decode từ start - warmup),
+    lưu landmark (n, 33, 4) ra .npy; frame không có người = NaN.
+    """
+    path, start, end, warmup, out_file = job
+    if os.path.isfile(out_file):  # đã xong ở lần chạy trước
+        return path, start, out_file
+
+    detector = _detector
+    detector.pose_model.reset()
+
+    first = max(0, start - warmup)
+    cap = cv2.VideoCapture(path)
+    cap.set(cv2.CAP_PROP_POS_FRAMES, first)
+
+    empty = np.full((33, 4), np.nan, dtype=np.float32)
+    rows = []
+    idx = first
+    try:
+        while end is None or idx < end:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frame = cv2.resize(frame, FRAME_SIZE)
+            landmarks = detector.estimate(frame)
+            if idx >= start:
+                rows.append(landmarks if landmarks is not None else empty)
+            idx += 1
+    except Exception as e:
+        print(f"Chunk Error ({path} @ {start}): {e}")
+        return path, start, None
+    finally:
+        cap.release()
+
+    series = np.stack(rows) if rows else np.empty((0, 33, 4), dtype=np.float32)
+    tmp = out_file + ".tmp.npy"
+    np.save(tmp, series)
+    os.replace(tmp, out_file)
+    return path, start, out_file
+
+
+def replay_series(detector, series, exercise, fps=30.0):
+    """Chạy tuần tự state machine trên chuỗi landmark đã ghép (không chạy model)."""
+    detector.reset_session()
+    replay_landmarks(detector, series, np.arange(len(series)) / fps, exercise)
+
+    data = detector.session_data
+    rom_score, fatigue_flag = detector.compute_rom_and_fatigue(exercise)
+    calib_min, calib_max = detector.calibrated_range(exercise)
+    return {
+        "reps": data["reps"],
+        "min_angle": data["min_angle"],
+        "max_angle": data["max_angle"],
+        "rom_score": rom_score,
+        "fatigue_flag": fatigue_flag,
+        "calib_min": calib_min,
+        "calib_max": calib_max,
+        "duration_s": detector.series.duration,
+        "rep_records": detector.rep_records,
+    }
+
+
+def merge_chunks(chunk_files):
+    """Ghép chunk theo thứ tự start frame (deterministic, không phụ thuộc thứ tự xong)."""
+    ordered = [chunk_files[start] for start in sorted(chunk_files)]
+    return np.concatenate([np.load(f) for f in ordered], axis=0)
+
+
+def _chunk_dir(manifest_path):
+    d = manifest_path + ".chunks"
+    os.makedirs(d, exist_ok=True)
+    return d
+
+
+def _chunk_prefix(path):
+    key = json.dumps([os.path.abspath(path), _file_key(path)])
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+def _chunk_file(chunk_dir, path, start):
+    return os.path.join(chunk_dir, f"{_chunk_prefix(path)}_{start:08d}.npy")
+
+
+def _clean_chunks(manifest_path, incomplete):
+    """
+    Chỉ giữ chunk của video chưa xong (để resume); chunk của video đã xong,
+    đã đổi nội dung hoặc không còn trong batch bị xóa. Không còn video dở
+    -> xóa cả thư mục <manifest>.chunks.
+    """
+    d = manifest_path + ".chunks"
+    if not os.path.isdir(d):
+        return
+    if not incomplete:
+        shutil.rmtree(d, ignore_errors=True)
+        return
+    keep = {_chunk_prefix(v) for v in incomplete}
+    for name in os.listdir(d):
+        if name.split("_", 1)[0] not in keep:
+            os.remove(os.path.join(d, name))
+
+
+# ===================== MANIFEST =====================
+
+def _file_key(path):
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime": int(st.st_mtime)}
+
+
+def load_manifest(path):
+    if not os.path.isfile(path):
+        return {"videos": {}}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Manifest Error: {e} -> starting fresh")
+        return {"videos": {}}
+
+
+def save_manifest(manifest, path):
+    """Ghi atomic (tmp + replace) để không hỏng manifest khi bị kill."""
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, path)
+
+
+def is_done(manifest, path, exercise):
+    entry = manifest["videos"].get(os.path.abspath(path))
+    if not entry or entry.get("status") != "done":
+        return False
+    return entry.get("exercise") == exercise and entry.get("file") == _file_key(path)
+
+
+# ===================== MAIN =====================
+
+def run_batch(
+    inputs,
+    exercise,
+    workers=None,
+    manifest_path="batch_manifest.json",
+    chunk_seconds=120.0,
+    warmup_seconds=3.0,
+    cache_dir="landmark_cache",
+    cache_max_bytes=2 * 1024**3,
+):
+    """cache_dir=None: tắt cache landmark (luôn decode + chạy pose)."""
+    import utils
+
+    videos = collect_videos(inputs)
+    manifest = load_manifest(manifest_path)
+    pending = [v for v in videos if not is_done(manifest, v, exercise)]
+    print(f"{len(videos)} videos, {len(videos) - len(pending)} already done, "
+          f"{len(pending)} to process")
+    if not pending:
+        _clean_chunks(manifest_path, [])
+        return manifest
+
+    workers = workers or max(1, (os.cpu_count() or 2) - 1)
+    cache = LandmarkCache(cache_dir, cache_max_bytes) if cache_dir else None
+    params = cache_params() if cache else None
+
+    # Lập kế hoạch: cache hit = replay ngay, video ngắn = 1 job,
+    # video dài = nhiều chunk job
+    cached = {}        # path -> (landmarks, meta)
+    cache_keys = {}    # path -> khóa cache
+    video_jobs = []
+    chunk_jobs = []
+    chunks_left = {}   # path -> số chunk chưa xong
+    chunk_files = {}   # path -> {start: file}
+    video_fps = {}     # path -> fps (timestamp khi replay)
+    chunk_failed = set()
+    for v in pending:
+        count, fps = video_info(v)
+        chunk_frames = int(chunk_seconds * fps) if chunk_seconds else 0
+        chunked = bool(chunk_frames) and count > 1.5 * chunk_frames
+        if cache is not None:
+            # Landmark ghép từ chunk khác bản chạy tuần tự (tracking reset ở
+            # mỗi chunk) -> khóa riêng theo cách chia
+            key_params = params
+            if chunked:
+                key_params = dict(params, chunked=True, chunk_seconds=chunk_seconds,
+                                  warmup_seconds=warmup_seconds)
+            cache_keys[v] = cache.key(video_digest(v, cache_dir), key_params)
+            hit = cache.get(cache_keys[v])
+            if hit is not None:
+                cached[v] = hit
+                continue
+        if chunked:
+            chunk_dir = _chunk_dir(manifest_path)
+            plan = plan_chunks(count, chunk_frames)
+            warmup = int(warmup_seconds * fps)
+            for start, end in plan:
+                out_file = _chunk_file(chunk_dir, v, start)
+                chunk_jobs.append((v, start, end, warmup, out_file))
+            chunks_left[v] = len(plan)
+            video_fps[v] = fps
+            chunk_files[v] = {}
+        else:
+            job_cache = (cache_dir, cache_max_bytes, cache_keys[v]) if cache else None
+            video_jobs.append((v, exercise, job_cache))
+    if cache is not None:
+        print(f"Landmark cache: {len(cached)} hit, {len(pending) - len(cached)} miss")
+
+    def finish(path, result):
+        result["file"] = _file_key(path)
+        rep_records = result.pop("rep_records", None)  # vào DB, không vào manifest
+        if result["status"] == "done" and result["reps"] > 0:
+            utils.log_session(
+                result["patient"],
+                exercise,
+                result["reps"],
+                result["min_angle"],
+                result["max_angle"],
+                rom_score=result["rom_score"],
+                fatigue_flag=result["fatigue_flag"],
+                rep_records=rep_records,
+                calib_min=result["calib_min"],
+                calib_max=result["calib_max"],
+                duration_s=result["duration_s"],
+            )
+        # Ghi manifest ngay sau mỗi video -> resume được
+        manifest["videos"][os.path.abspath(path)] = result
+        save_manifest(manifest, manifest_path)
+        print(f"[{result['status']}] {path}: "
+              f"{result.get('reps', '-')} reps ({result.get('elapsed_s', '-')}s)")
+
+    replay_detector = None
+
+    def replay(path, series, fps):
+        nonlocal replay_detector
+        if replay_detector is None:
+            from pose_module import RehabSession
+
+            # Replay chỉ cần state machine, không cần load model
+            replay_detector = RehabSession()
+            replay_detector.sound_enabled = False
+        result = replay_series(replay_detector, series, exercise, fps)
+        result.update(
+            status="done",
+            patient=patient_from_filename(path),
+            exercise=exercise,
+            frames=len(series),
+        )
+        return result
+
+    for path, (series, meta) in cached.items():
+        t0 = time.time()
+        result = replay(path, series, meta["fps"])
+        result.update(cache="hit", elapsed_s=round(time.time() - t0, 2))
+        finish(path, result)
+    cached.clear()  # đóng memmap
+
+    if not video_jobs and not chunk_jobs:
+        _clean_chunks(manifest_path, [v for v in pending if not is_done(manifest, v, exercise)])
+        return manifest
+    t_start = {v: time.time() for v in chunks_left}
+
+    with mp.Pool(processes=workers, initializer=_init_worker) as pool:
+        # Chunk job trước (dài nhất), video ngắn lấp chỗ trống sau
+        chunk_results = pool.imap_unordered(estimate_chunk, chunk_jobs)
+        video_results = pool.imap_unordered(analyze_video, video_jobs)
+
+        for path, start, out_file in chunk_results:
+            if out_file is None:
+                chunk_failed.add(path)
+            else:
+                chunk_files[path][start] = out_file
+            chunks_left[path] -= 1
+            if chunks_left[path]:
+                continue
+            if path in chunk_failed:
+                finish(path, {"status": "error", "error": "Chunk failed"})
+                continue
+
+            series = merge_chunks(chunk_files[path])
+            if cache is not None:
+                cache.put(cache_keys[path], series, video_fps[path], video=path)
+            result = replay(path, series, video_fps[path])
+            result.update(
+                chunks=len(chunk_files[path]),
+                elapsed_s=round(time.time() - t_start[path], 2),
+            )
+            finish(path, result)
+            for f in chunk_files[path].values():
+                os.remove(f)
+
+        for path, result in video_results:
+            finish(path, result)
+
+    _clean_chunks(manifest_path, [v for v in pending if not is_done(manifest, v, exercise)])
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless batch analysis of session videos")
+    parser.add_argument("inputs", nargs="+", help="Video files or directories")
+    parser.add_argument("--exercise", default="Bicep Curl",
+                        choices=exercise_names())
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--manifest", default="batch_manifest.json")
+    parser.add_argument("--chunk-seconds", type=float, default=120.0,
+                        help="Split longer videos into chunks of this length (0 = off)")
+    parser.add_argument("--warmup-seconds", type=float, default=3.0,
+                        help="Overlap decoded before each chunk so tracking converges")
+    parser.add_argument("--cache-dir", default="landmark_cache",
+                        help="Landmark cache directory (reused across runs)")
+    parser.add_argument("--cache-max-gb", type=float, default=2.0,
+                        help="Evict least recently used cache entries above this size")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Always decode and run pose (do not read or write the cache)")
+    args = parser.parse_args()
+
+    run_batch(
+        args.inputs,
+        args.exercise,
+        args.workers,
+        args.manifest,
+        chunk_seconds=args.chunk_seconds,
+        warmup_seconds=args.warmup_seconds,
+        cache_dir=None if args.no_cache else args.cache_dir,
+        cache_max_bytes=int(args.cache_max_gb * 1024**3),
+    )
+
+
+if __name__ == "__main__":
+    main()
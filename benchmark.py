@@ -0,0 +1,657 @@
+"""
+Benchmark headless cho đường xử lý frame (không cần webcam / Tk).
+
+Ví dụ:
+    python benchmark.py color --frames 500 --size 800x600
+    python benchmark.py stages --sizes 640x480,1280x720 --complexities 0,1 --out bench.json
+    python benchmark.py stages --video clip.avi --landmarks clip_landmarks.npz --baseline base.json
+    python benchmark.py compare base.json bench.json --tolerance 0.15
+    python benchmark.py db --sessions 300 --reps 12 --writers 4 --out db.json
+
+Không có --video thì frame là nhiễu: MediaPipe không thấy người nên chỉ chạy
+detector, không chạy landmark model. Stage đó được ghi là "pose_no_person"
+(không so với "pose" của baseline); đo chi phí pose thật cần --video có người.
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import platform
+import sqlite3
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from pipeline import FrameBufferPool
+
+
+def synthetic_frames(n, size=(1280, 720), seed=0):
+    """Frame camera giả (BGR, kích thước gốc của webcam)."""
+    rng = np.random.default_rng(seed)
+    w, h = size
+    base = rng.integers(0, 255, (h, w, 3), dtype=np.uint8)
+    return [np.roll(base, i * 3, axis=1) for i in range(min(n, 8))]
+
+
+def _ms_per_frame(fn, frames, n, repeat=5):
+    """ms/frame tốt nhất trong `repeat` lượt (ít bị nhiễu bởi scheduler)."""
+    for i in range(min(n, 10)):  # warm-up
+        fn(frames[i % len(frames)])
+    best = float("inf")
+    per_block = max(1, n // repeat)
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for i in range(per_block):
+            fn(frames[i % len(frames)])
+        best = min(best, (time.perf_counter() - t0) / per_block)
+    return 1000.0 * best
+
+
+# ===================== COLOR PATH =====================
+
+def bench_color_path(n=300, size=(800, 600), src_size=(1280, 720)):
+    """
+    So sánh đường màu cũ (resize + BGR->RGB + RGB->BGR + BGR->RGB, cấp phát
+    mới mỗi bước) với đường 1 buffer RGB (resize vào scratch + 1 lần đổi màu
+    vào buffer của pool).
+    """
+    frames = synthetic_frames(n, src_size)
+    w, h = size
+
+    def legacy(frame):
+        frame = cv2.resize(frame, size)
+        image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)    # trước Pose.process
+        image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)    # sau Pose.process
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)     # trước Image.fromarray
+
+    pool = FrameBufferPool((h, w, 3))
+    scratch = np.empty((h, w, 3), dtype=np.uint8)
+
+    def single_buffer(frame):
+        cv2.resize(frame, size, dst=scratch)
+        buf = pool.acquire()
+        cv2.cvtColor(scratch, cv2.COLOR_BGR2RGB, dst=buf)
+        pool.release(buf)
+        return buf
+
+    legacy_ms = _ms_per_frame(legacy, frames, n)
+    single_ms = _ms_per_frame(single_buffer, frames, n)
+    return {
+        "size": f"{w}x{h}",
+        "legacy_ms": round(legacy_ms, 3),
+        "single_buffer_ms": round(single_ms, 3),
+        "saved_ms_per_frame": round(legacy_ms - single_ms, 3),
+        "pool_allocations": pool.allocated,
+    }
+
+
+# ===================== PER-STAGE =====================
+
+STAGES = (
+    "decode", "resize", "color", "pose", "smoothing", "state_machine", "hud", "tk",
+)
+
+
+def _time_calls(fn, items, n, warmup=10):
+    """Thời gian (ms) của từng lần gọi fn(item) -> mảng để lấy percentile."""
+    for i in range(min(warmup, n)):
+        fn(items[i % len(items)])
+    out = np.empty(n, dtype=np.float64)
+    for i in range(n):
+        item = items[i % len(items)]
+        t0 = time.perf_counter()
+        fn(item)
+        out[i] = time.perf_counter() - t0
+    return 1000.0 * out
+
+
+def _summarize(ms):
+    mean = float(ms.mean())
+    return {
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "mean_ms": round(mean, 3),
+        "fps": round(1000.0 / mean, 1) if mean > 0 else None,
+    }
+
+
+def synthetic_landmarks(n, fps=30.0, period=3.0, seed=0):
+    """Chuỗi landmark squat giả (33, 4): gối dao động 80..170 độ, có nhiễu."""
+    rng = np.random.default_rng(seed)
+    out = np.zeros((n, 33, 4), dtype=np.float32)
+    out[:, :, 3] = 0.9
+    for i in range(n):
+        knee = np.deg2rad(170 - 90 * (0.5 - 0.5 * np.cos(2 * np.pi * i / fps / period)))
+        hip = np.array([0.5, 0.45])
+        kp = hip + [0.0, 0.18]
+        ank = kp + 0.18 * np.array([np.sin(knee), -np.cos(knee)])
+        for (l_idx, r_idx), p in (((11, 12), hip + [0.0, -0.3]), ((23, 24), hip),
+                                  ((25, 26), kp), ((27, 28), ank)):
+            out[i, [l_idx, r_idx], :2] = p + rng.normal(0, 0.003, 2)
+    return out
+
+
+def _landmark_list(arr):
+    from mediapipe.framework.formats import landmark_pb2
+
+    lms = landmark_pb2.NormalizedLandmarkList()
+    for x, y, z, v in arr:
+        lms.landmark.add(x=float(x), y=float(y), z=float(z), visibility=float(v))
+    return lms
+
+
+def _video_frames(path, n):
+    cap = cv2.VideoCapture(path)
+    frames = []
+    while len(frames) < n:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def _write_temp_video(frames, fps=30.0):
+    """Ghi frame ra file MJPG tạm để đo decode như đọc từ camera/file."""
+    h, w = frames[0].shape[:2]
+    fd, path = tempfile.mkstemp(suffix=".avi")
+    os.close(fd)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps, (w, h))
+    for frame in frames:
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+def _bench_decode(path, n):
+    cap = cv2.VideoCapture(path)
+
+    def read(_):
+        ret, _frame = cap.read()
+        if not ret:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            cap.read()
+
+    try:
+        return _time_calls(read, [None], n)
+    finally:
+        cap.release()
+
+
+class _TkTarget:
+    """PhotoImage thật nếu có display, không thì chỉ đo phần PIL (frombuffer + paste)."""
+    def __init__(self, size):
+        from PIL import Image
+
+        self.Image = Image
+        self.mode = "pil"
+        self.root = None
+        try:
+            import tkinter as tk
+            from PIL import ImageTk
+
+            self.root = tk.Tk()
+            self.root.withdraw()
+            self.target = ImageTk.PhotoImage("RGB", size)
+            self.mode = "tk"
+        except Exception:
+            self.target = Image.new("RGB", size)
+
+    def __call__(self, frame):
+        h, w = frame.shape[:2]
+        img = self.Image.frombuffer("RGB", (w, h), frame, "raw", "RGB", 0, 1)
+        self.target.paste(img)
+
+    def close(self):
+        if self.root is not None:
+            self.root.destroy()
+
+
+def bench_stages(sizes=((640, 480), (1280, 720)), complexities=(0, 1), n=200,
+                 display_size=(800, 600), video=None, landmarks=None):
+    """
+    Đo riêng từng stage của pipeline thật (không webcam, không Tk mainloop).
+    sizes: độ phân giải camera giả lập; frame được resize về display_size
+    như CaptureThread. video: frame thật (resize về từng size); landmarks:
+    bản ghi .npz (replay.py) cho smoothing / state machine / HUD.
+    Stage pose tên "pose" nếu phần lớn frame có người, "pose_no_person" nếu
+    không (chỉ đo detector); `pose_detected` = tỉ lệ frame có landmark.
+    """
+    from exercises import get_exercise
+    from pose_module import PoseModel, RehabSession, joint_angles
+
+    if video:
+        source = _video_frames(video, n)
+        frames_kind = os.path.basename(video)
+    else:
+        source = synthetic_frames(n, sizes[0])
+        frames_kind = "synthetic"
+    if landmarks:
+        from replay import load_recording
+
+        rec = load_recording(landmarks)
+        series = rec["landmarks"][~np.isnan(rec["landmarks"][:, 0, 0])]
+        exercise = rec["exercise"]
+    else:
+        series = synthetic_landmarks(max(n, 300))
+        exercise = "Squat"
+    spec = get_exercise(exercise)
+
+    dw, dh = display_size
+    scratch = np.empty((dh, dw, 3), dtype=np.uint8)
+    rgb = np.empty((dh, dw, 3), dtype=np.uint8)
+    results = []
+    skipped = set()
+
+    # Stage không phụ thuộc độ phân giải: dùng chung cho mọi size
+    session = RehabSession()
+    session.sound_enabled = False
+    angle_sets = [joint_angles(lm) for lm in series]
+    clock = {"t": 0.0}
+
+    def smoothing(item):
+        clock["t"] += 1 / 30.0
+        session._smooth_angles(item[0], item[1], clock["t"])
+
+    smoothing_ms = _time_calls(smoothing, angle_sets, n)
+
+    def state_machine(lm):
+        angles, valid = joint_angles(lm)
+        angle = int(angles[spec.angle_index["L"]])
+        down_th, up_th = session._get_thresholds(exercise)
+        session._step_stage(spec, angle, down_th, up_th)
+        session._check_form(spec, "L", lm, angles, valid)
+
+    state_ms = _time_calls(state_machine, list(series), n)
+
+    hud_items = [(_landmark_list(lm), lm) for lm in series[: min(len(series), 50)]]
+    hud_frame = np.zeros((dh, dw, 3), dtype=np.uint8)
+
+    def hud(item):
+        pose_landmarks, lm = item
+        joint = (int(lm[25, 0] * dw), int(lm[25, 1] * dh))
+        session._draw_hud(hud_frame, joint, 123, pose_landmarks, rgb=True)
+        cv2.putText(hud_frame, "FPS: 30 | UI 1.0 ms", (20, 40),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
+        cv2.putText(hud_frame, "REPS: 10", (20, 80),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.9, (255, 255, 0), 2)
+
+    hud_ms = _time_calls(hud, hud_items, n)
+
+    tk_target = _TkTarget(display_size)
+    try:
+        tk_ms = _time_calls(tk_target, [hud_frame], n)
+    finally:
+        tk_target.close()
+
+    for size in sizes:
+        frames = [cv2.resize(f, size) for f in source[:8]] if video else synthetic_frames(n, size)
+        video_path = _write_temp_video(frames)
+        try:
+            decode_ms = _bench_decode(video_path, n)
+        finally:
+            os.remove(video_path)
+
+        resize_ms = _time_calls(lambda f: cv2.resize(f, display_size, dst=scratch), frames, n)
+        cv2.resize(frames[0], display_size, dst=scratch)
+        color_ms = _time_calls(
+            lambda f: cv2.cvtColor(f, cv2.COLOR_BGR2RGB, dst=rgb), [scratch], n
+        )
+        display_frames = [cv2.cvtColor(cv2.resize(f, display_size), cv2.COLOR_BGR2RGB)
+                          for f in frames]
+
+        for complexity in complexities:
+            try:
+                model = PoseModel(model_complexity=complexity)
+            except Exception as e:
+                # Model chưa có sẵn (vd. chưa tải được) -> bỏ qua mức này
+                print(f"[stages] model_complexity={complexity} unavailable: {e}")
+                skipped.add(complexity)
+                continue
+            detected = []
+
+            def pose(f):
+                detected.append(model.process(f).pose_landmarks is not None)
+
+            try:
+                pose_ms = _time_calls(pose, display_frames, n)
+            finally:
+                model.close()
+            detect_rate = float(np.mean(detected))
+
+            stages = {
+                "decode": _summarize(decode_ms),
+                "resize": _summarize(resize_ms),
+                "color": _summarize(color_ms),
+                "pose" if detect_rate >= 0.5 else "pose_no_person": _summarize(pose_ms),
+                "smoothing": _summarize(smoothing_ms),
+                "state_machine": _summarize(state_ms),
+                "hud": _summarize(hud_ms),
+                "tk": _summarize(tk_ms),
+            }
+            # Các stage chạy tuần tự trên 1 frame -> tổng mean là chi phí / frame
+            total_ms = sum(v["mean_ms"] for v in stages.values())
+            results.append(
+                {
+                    "size": f"{size[0]}x{size[1]}",
+                    "complexity": complexity,
+                    "stages": stages,
+                    "pose_detected": round(detect_rate, 3),
+                    "frame_ms": round(total_ms, 3),
+                    "pipeline_fps": round(1000.0 / total_ms, 1),
+                }
+            )
+
+    import mediapipe
+
+    return {
+        "meta": {
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "platform": platform.platform(),
+            "processor": platform.processor() or platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "python": sys.version.split()[0],
+            "opencv": cv2.__version__,
+            "mediapipe": getattr(mediapipe, "__version__", "?"),
+            "frames": frames_kind,
+            "landmarks": os.path.basename(landmarks) if landmarks else "synthetic",
+            "display_size": f"{dw}x{dh}",
+            "tk": tk_target.mode,
+            "n": n,
+            "skipped_complexities": sorted(skipped),
+        },
+        "results": results,
+    }
+
+
+# ===================== SESSION LOGGING =====================
+
+def _session_job(i, reps):
+    """Session giả (record + rep_records) cho benchmark ghi DB."""
+    import utils
+
+    record = utils.session_record(f"Patient_{i % 20:03d}", "Squat", reps, 85, 170, 87.5, "Low")
+    rep_records = [
+        {
+            "rep": k + 1, "start": 2.0 * k, "duration": 2.0, "eccentric_s": 1.0,
+            "concentric_s": 0.8, "peak_velocity": 210.0, "min_angle": 85.0,
+            "max_angle": 170.0, "rom": 85.0,
+        }
+        for k in range(reps)
+    ]
+    return record, rep_records
+
+
+def _legacy_log(path, record, rep_records):
+    """
+    Đường ghi cũ: 1 connection lo schema (trước là CREATE TABLE IF NOT EXISTS,
+    nay là migrate - cùng schema với writer), 1 connection nữa để insert.
+    """
+    import db
+    import utils
+
+    conn = sqlite3.connect(path)
+    db.migrate(conn)
+    conn.close()
+    conn = sqlite3.connect(path)
+    utils.insert_session(conn, record, rep_records=rep_records)
+    conn.commit()
+    conn.close()
+
+
+def _log_sessions(mode, path, n, reps, start_at=None):
+    """
+    Ghi n session theo `mode` ("legacy" / "writer"), trả về thời gian phía
+    thread gọi (ms), thời gian tới khi commit xong (ms), số lỗi, tổng thời gian.
+    """
+    import db
+    import utils
+
+    jobs = [_session_job(i, reps) for i in range(n)]
+    caller = np.empty(n)
+    done = np.full(n, np.nan)
+    errors = 0
+    writer = None
+    if mode == "writer":
+        writer = db.DatabaseWriter(db.Database(path))
+        writer.start()
+        writer.flush()  # mở connection + migrate trước khi đo
+    if start_at is not None:
+        time.sleep(max(0.0, start_at - time.time()))
+
+    t_start = time.perf_counter()
+    futures = []
+    for i, (record, rep_records) in enumerate(jobs):
+        t0 = time.perf_counter()
+        if writer is None:
+            try:
+                _legacy_log(path, record, rep_records)
+                done[i] = time.perf_counter() - t0
+            except sqlite3.OperationalError:
+                errors += 1
+            caller[i] = time.perf_counter() - t0
+        else:
+            future = writer.submit(utils.insert_session, record, None, rep_records)
+            caller[i] = time.perf_counter() - t0
+            future.add_done_callback(
+                lambda f, i=i, t0=t0: done.__setitem__(i, time.perf_counter() - t0)
+            )
+            futures.append(future)
+    for future in futures:
+        if future.exception() is not None:
+            errors += 1
+    elapsed = time.perf_counter() - t_start
+    if writer is not None:
+        writer.close()
+    return {
+        "caller_ms": (1000.0 * caller).tolist(),
+        "commit_ms": (1000.0 * done[~np.isnan(done)]).tolist(),
+        "errors": errors,
+        "elapsed_s": elapsed,
+    }
+
+
+def _log_sessions_job(args):
+    return _log_sessions(*args)
+
+
+def bench_db(sessions=300, reps=12, writers=4):
+    """
+    Chi phí ghi session: đường cũ (mở / đóng connection, CREATE TABLE mỗi lần,
+    chặn thread gọi) so với db.DatabaseWriter (connection WAL sống lâu, batch
+    transaction, thread gọi chỉ submit). Phần contention: `writers` process
+    cùng ghi 1 file DB.
+    """
+    report = {"sessions": sessions, "reps": reps, "writers": writers}
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ("legacy", "writer"):
+            r = _log_sessions(mode, os.path.join(tmp, f"single_{mode}.db"), sessions, reps)
+            report[f"single_{mode}"] = {
+                "caller": _summarize(np.array(r["caller_ms"])),
+                "commit": _summarize(np.array(r["commit_ms"])),
+                "sessions_per_s": round(sessions / r["elapsed_s"], 1),
+                "errors": r["errors"],
+            }
+
+        per_writer = max(1, sessions // writers)
+        for mode in ("legacy", "writer"):
+            path = os.path.join(tmp, f"shared_{mode}.db")
+            if mode == "writer":
+                import db
+
+                db.Database(path).connection().close()  # migrate 1 lần trước
+            start_at = time.time() + 1.0
+            jobs = [(mode, path, per_writer, reps, start_at) for _ in range(writers)]
+            with mp.Pool(writers) as pool:
+                parts = pool.map(_log_sessions_job, jobs)
+            caller = np.concatenate([p["caller_ms"] for p in parts])
+            commit = np.concatenate([p["commit_ms"] for p in parts])
+            elapsed = max(p["elapsed_s"] for p in parts)
+            report[f"contention_{mode}"] = {
+                "caller": _summarize(caller),
+                "commit": _summarize(commit) if len(commit) else None,
+                "sessions_per_s": round(writers * per_writer / elapsed, 1),
+                "errors": sum(p["errors"] for p in parts),
+            }
+    return report
+
+
+def print_db_report(report):
+    print(f"[db] {report['sessions']} sessions x {report['reps']} reps, "
+          f"contention with {report['writers']} processes")
+    for key in ("single_legacy", "single_writer", "contention_legacy", "contention_writer"):
+        r = report[key]
+        commit = r["commit"]
+        commit_text = "-" if commit is None else \
+            f"p50 {commit['p50_ms']:.2f} / p95 {commit['p95_ms']:.2f} ms"
+        print(f"  {key:18s} caller p50 {r['caller']['p50_ms']:.3f} / "
+              f"p95 {r['caller']['p95_ms']:.3f} ms | commit {commit_text} | "
+              f"{r['sessions_per_s']:.0f} sessions/s | errors {r['errors']}")
+
+
+def compare_reports(baseline, current, tolerance=0.15, metric="p95_ms"):
+    """
+    So sánh 2 report theo (size, complexity, stage). Trả về danh sách dòng
+    so sánh; `regression` = chậm hơn baseline quá `tolerance` (tỉ lệ).
+    """
+    base = {(r["size"], r["complexity"]): r for r in baseline["results"]}
+    rows = []
+    for r in current["results"]:
+        b = base.get((r["size"], r["complexity"]))
+        if b is None:
+            continue
+        for stage, stats in r["stages"].items():
+            old = b["stages"].get(stage, {}).get(metric)
+            new = stats.get(metric)
+            if not old or new is None:
+                continue
+            change = new / old - 1.0
+            rows.append(
+                {
+                    "size": r["size"],
+                    "complexity": r["complexity"],
+                    "stage": stage,
+                    "baseline": old,
+                    "current": new,
+                    "change": round(change, 3),
+                    "regression": change > tolerance,
+                }
+            )
+    return rows
+
+
+def print_stage_report(report):
+    meta = report["meta"]
+    print(f"[stages] frames={meta['frames']} landmarks={meta['landmarks']} "
+          f"display={meta['display_size']} tk={meta['tk']} n={meta['n']}")
+    for r in report["results"]:
+        print(f"  {r['size']} complexity {r['complexity']}: "
+              f"{r['frame_ms']} ms/frame -> {r['pipeline_fps']} FPS")
+        if "pose_no_person" in r["stages"]:
+            print(f"    (person in {r.get('pose_detected', 0):.0%} of frames: "
+                  "pose = detector only, use --video with a person)")
+        for stage, s in r["stages"].items():
+            print(f"    {stage:14s} p50 {s['p50_ms']:8.3f}  p95 {s['p95_ms']:8.3f}  "
+                  f"p99 {s['p99_ms']:8.3f} ms")
+
+
+def print_comparison(rows):
+    regressions = [r for r in rows if r["regression"]]
+    for r in rows:
+        mark = "REGRESSION" if r["regression"] else ""
+        print(f"  {r['size']} c{r['complexity']} {r['stage']:14s} "
+              f"{r['baseline']:8.3f} -> {r['current']:8.3f} ms ({r['change']:+.0%}) {mark}")
+    print(f"{len(regressions)} regression(s) in {len(rows)} comparisons")
+    return regressions
+
+
+def _parse_size(text):
+    w, h = text.lower().split("x")
+    return int(w), int(h)
+
+
+def _parse_sizes(text):
+    return [_parse_size(t) for t in text.split(",") if t]
+
+
+def _load_json(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Frame pipeline benchmarks")
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    p_color = sub.add_parser("color", help="Color conversion / copy cost per frame")
+    p_color.add_argument("--frames", type=int, default=300)
+    p_color.add_argument("--size", type=_parse_size, default=(800, 600))
+
+    p_stages = sub.add_parser("stages", help="Per-stage latency percentiles")
+    p_stages.add_argument("--frames", type=int, default=200)
+    p_stages.add_argument("--sizes", type=_parse_sizes, default=[(640, 480), (1280, 720)])
+    p_stages.add_argument("--complexities", default="0,1",
+                          help="Comma separated model_complexity values")
+    p_stages.add_argument("--display-size", type=_parse_size, default=(800, 600))
+    p_stages.add_argument("--video", help="Use frames from this video instead of noise")
+    p_stages.add_argument("--landmarks", help="Landmark recording (.npz) for the analysis stages")
+    p_stages.add_argument("--out", help="Write the JSON report here")
+    p_stages.add_argument("--baseline", help="Compare against this JSON report")
+    p_stages.add_argument("--tolerance", type=float, default=0.15)
+
+    p_cmp = sub.add_parser("compare", help="Compare two saved stage reports")
+    p_cmp.add_argument("baseline")
+    p_cmp.add_argument("current")
+    p_cmp.add_argument("--tolerance", type=float, default=0.15)
+
+    p_db = sub.add_parser("db", help="Session logging cost and write lock contention")
+    p_db.add_argument("--sessions", type=int, default=300)
+    p_db.add_argument("--reps", type=int, default=12, help="Rep rows per session")
+    p_db.add_argument("--writers", type=int, default=4, help="Concurrent writer processes")
+    p_db.add_argument("--out", help="Write the JSON report here")
+
+    args = parser.parse_args()
+
+    if args.bench == "color":
+        r = bench_color_path(args.frames, args.size)
+        print(f"[color] {r['size']}: legacy {r['legacy_ms']} ms/frame, "
+              f"single RGB buffer {r['single_buffer_ms']} ms/frame "
+              f"-> saved {r['saved_ms_per_frame']} ms/frame "
+              f"({r['pool_allocations']} buffer allocations)")
+
+    elif args.bench == "stages":
+        complexities = [int(c) for c in args.complexities.split(",") if c]
+        report = bench_stages(
+            args.sizes, complexities, args.frames, args.display_size,
+            video=args.video, landmarks=args.landmarks,
+        )
+        print_stage_report(report)
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+        if args.baseline:
+            rows = compare_reports(_load_json(args.baseline), report, args.tolerance)
+            if print_comparison(rows):
+                sys.exit(1)
+
+    elif args.bench == "db":
+        report = bench_db(args.sessions, args.reps, args.writers)
+        print_db_report(report)
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+
+    elif args.bench == "compare":
+        rows = compare_reports(_load_json(args.baseline), _load_json(args.current),
+                               args.tolerance)
+        if print_comparison(rows):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
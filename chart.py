@@ -0,0 +1,163 @@
+"""
+Biểu đồ góc khớp của 1 session, vẽ ngoài màn hình để nhúng vào Tk.
+
+- Chuỗi dài được rút gọn bằng LTTB (Largest-Triangle-Three-Buckets): mỗi
+  bucket giữ điểm tạo tam giác lớn nhất với điểm đã chọn trước và trung bình
+  bucket sau -> giữ đỉnh / đáy của từng rep với ~2000 điểm thay vì mọi frame.
+- Vẽ bằng matplotlib Figure + canvas Agg (không import pyplot, không có
+  event loop / state toàn cục) ở 1 thread nền -> PIL Image; Tk không bị đứng.
+- Ảnh đã vẽ được cache theo session id (LRU nhỏ) -> xem lại là tức thì.
+- Đường ngưỡng là ngưỡng thực tế sau auto-calib + vùng biên độ đã calib.
+
+    future = render_cached(session_id, t, angle, "Squat", "P1", thresholds=(95, 160))
+    image = future.result()  # PIL.Image RGBA
+"""
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+CHART_SIZE = (1000, 500)
+MAX_POINTS = 2000
+
+
+def lttb(x, y, n_out):
+    """Chỉ số các điểm giữ lại (tăng dần, gồm điểm đầu / cuối) khi rút còn n_out."""
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # n_out - 2 bucket chia đều [1, n - 1); trung bình bucket tính bằng cumsum
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    cx = np.concatenate(([0.0], np.cumsum(x)))
+    cy = np.concatenate(([0.0], np.cumsum(y)))
+
+    out = np.empty(n_out, dtype=np.int64)
+    out[0] = 0
+    out[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            nlo, nhi = hi, edges[i + 2]
+        else:
+            nlo, nhi = n - 1, n  # bucket cuối: điểm cuối cùng
+        avg_x = (cx[nhi] - cx[nlo]) / (nhi - nlo)
+        avg_y = (cy[nhi] - cy[nlo]) / (nhi - nlo)
+        # 2 lần diện tích tam giác (a, điểm trong bucket, trung bình bucket sau)
+        area = np.abs(
+            (x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a])
+        )
+        a = lo + int(np.argmax(area))
+        out[i + 1] = a
+    return out
+
+
+def render_chart(t, angle, exercise_name, patient_name, thresholds=None, calib=None,
+                 size=CHART_SIZE, max_points=MAX_POINTS, dpi=100):
+    """
+    t (giây), angle -> PIL Image RGBA kích thước `size`.
+    thresholds: (DOWN_TH, UP_TH) đang dùng; calib: (min, max) góc đã calib.
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    t = np.asarray(t, dtype=np.float64)
+    angle = np.asarray(angle, dtype=np.float64)
+    idx = lttb(t, angle, max_points)
+
+    fig = Figure(figsize=(size[0] / dpi, size[1] / dpi), dpi=dpi)
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.plot(t[idx], angle[idx], label="Joint Angle", color="#20bf6b", linewidth=1.5)
+
+    if calib is not None and None not in calib:
+        lo, hi = calib
+        ax.axhspan(lo, hi, color="#0fb9b1", alpha=0.1,
+                   label=f"Calibrated ROM ({lo:.0f}-{hi:.0f}°)")
+    if thresholds is not None:
+        down, up = thresholds
+        ax.axhline(y=up, color="r", linestyle="--", label=f"UP threshold ({up:.0f}°)")
+        ax.axhline(y=down, color="b", linestyle="--", label=f"DOWN threshold ({down:.0f}°)")
+
+    ax.set_title(f"Analysis: {exercise_name} - Patient: {patient_name}")
+    ax.set_xlabel("Time (s)")
+    ax.set_ylabel("Angle (Degrees)")
+    ax.legend(loc="upper right")
+    ax.grid(True, alpha=0.3)
+    # Lề cố định cho kích thước mặc định (tight_layout tốn thêm 1 lần vẽ ~100 ms)
+    fig.subplots_adjust(left=0.07, right=0.98, top=0.93, bottom=0.1)
+    canvas.draw()
+    width, height = canvas.get_width_height()
+    return Image.frombuffer(
+        "RGBA", (width, height), canvas.buffer_rgba(), "raw", "RGBA", 0, 1
+    ).copy()
+
+
+class ChartCache:
+    """LRU nhỏ: (session id, size) -> PIL Image đã vẽ."""
+    def __init__(self, max_items=8):
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            image = self._items.get(key)
+            if image is not None:
+                self._items.move_to_end(key)
+            return image
+
+    def put(self, key, image):
+        with self._lock:
+            self._items[key] = image
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+
+CHART_CACHE = ChartCache()
+_executor = None
+_pending = {}  # key -> Future đang vẽ (gọi lại khi chưa xong dùng chung 1 job)
+_executor_lock = threading.Lock()
+
+
+def _render_job(key, *args, **kwargs):
+    try:
+        image = render_chart(*args, **kwargs)
+        CHART_CACHE.put(key, image)
+        return image
+    finally:
+        with _executor_lock:
+            _pending.pop(key, None)
+
+
+def render_cached(session_id, t, angle, exercise_name, patient_name, thresholds=None,
+                  calib=None, size=CHART_SIZE):
+    """
+    Future -> PIL Image: lấy từ CHART_CACHE nếu session đã vẽ (hoặc đang vẽ),
+    không thì vẽ ở thread nền (1 thread, các chart xếp hàng). t / angle được
+    copy trước nên caller có thể dùng tiếp chuỗi của session.
+    """
+    global _executor
+    key = (session_id, tuple(size))
+    image = CHART_CACHE.get(key)
+    if image is not None:
+        future = Future()
+        future.set_result(image)
+        return future
+    with _executor_lock:
+        future = _pending.get(key)
+        if future is not None:
+            return future
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chart")
+        future = _pending[key] = _executor.submit(
+            _render_job, key, np.array(t, dtype=np.float64),
+            np.array(angle, dtype=np.float64), exercise_name, patient_name,
+            thresholds=thresholds, calib=calib, size=size,
+        )
+    return future
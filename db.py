@@ -0,0 +1,502 @@
+"""
+Lớp kết nối SQLite dùng chung cho rehab_data.db.
+
+- Mỗi thread giữ 1 connection sống lâu (không mở / đóng mỗi lần ghi).
+  sqlite3 cache câu lệnh đã biên dịch theo connection (cached_statements)
+  -> câu SQL cố định được prepare 1 lần rồi dùng lại.
+- WAL + synchronous=NORMAL: reader không chặn writer; nhiều process (trạm
+  tập, batch) cùng ghi bằng transaction ngắn BEGIN IMMEDIATE, chờ lock tối
+  đa `timeout` giây (busy_timeout) thay vì lỗi ngay.
+- Schema có version (PRAGMA user_version): MIGRATIONS chạy 1 lần khi mở DB,
+  trong 1 transaction -> 2 process mở cùng lúc không migrate 2 lần.
+- DatabaseWriter: thread nền nhận job ghi (từ Tk / worker), gom mọi job đang
+  chờ vào 1 transaction. Thread gọi chỉ đưa job vào queue (vài µs).
+
+    writer = get_writer()
+    future = writer.submit(insert_fn, arg1, arg2)  # insert_fn(conn, arg1, arg2)
+    future.result()  # chỉ khi cần chờ (vd. lấy id vừa ghi)
+"""
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from metrics import METRICS
+
+DB_PATH = "rehab_data.db"
+
+# sessions.fatigue_level: chỉ số trong tuple (text như compute_rom_and_fatigue)
+FATIGUE_LEVELS = ("Low", "Moderate", "High")
+
+_ROLLUP_COLUMNS = """
+                patient_name TEXT,
+                exercise TEXT,
+                period TEXT,
+                sessions INTEGER,
+                reps INTEGER,
+                duration_s REAL,
+                range_sum REAL,
+                rom_n INTEGER,
+                rom_sum REAL,
+                rom_best REAL,
+                fatigue_n INTEGER,
+                fatigue_sum INTEGER,
+                fatigue_high INTEGER,
+                first_ts INTEGER,
+                last_ts INTEGER,
+                PRIMARY KEY (patient_name, exercise, period)
+"""
+
+# period: ngày 'YYYY-MM-DD' / thứ Hai đầu tuần (theo giờ local của timestamp)
+ROLLUP_PERIODS = {
+    "day": ("session_daily", "substr(timestamp, 1, 10)"),
+    "week": ("session_weekly", "date(timestamp, 'weekday 0', '-6 days')"),
+}
+
+
+def _rollup_select(period, where):
+    return f"""
+        SELECT patient_name, exercise, {period}, COUNT(*), SUM(reps),
+               TOTAL(duration_s), TOTAL(max_angle - min_angle),
+               COUNT(rom_score), TOTAL(rom_score), MAX(rom_score),
+               COUNT(fatigue_level), TOTAL(fatigue_level),
+               COUNT(CASE WHEN fatigue_level = 2 THEN 1 END), MIN(ts), MAX(ts)
+        FROM sessions
+        WHERE ts IS NOT NULL AND {where}
+        GROUP BY patient_name, exercise, {period}
+    """
+
+
+def rebuild_rollups(conn):
+    """
+    Tính lại toàn bộ bảng rollup (migration / sửa tay): ngày từ sessions,
+    tuần gộp từ bảng ngày (ít dòng hơn nhiều so với sessions).
+    """
+    daily, day = ROLLUP_PERIODS["day"]
+    weekly, _ = ROLLUP_PERIODS["week"]
+    conn.execute(f"DELETE FROM {daily}")
+    conn.execute(f"INSERT INTO {daily} {_rollup_select(day, '1')}")
+    conn.execute(f"DELETE FROM {weekly}")
+    conn.execute(
+        f"""
+        INSERT INTO {weekly}
+        SELECT patient_name, exercise, date(period, 'weekday 0', '-6 days') AS week,
+               SUM(sessions), SUM(reps), SUM(duration_s), SUM(range_sum), SUM(rom_n),
+               SUM(rom_sum), MAX(rom_best), SUM(fatigue_n), SUM(fatigue_sum),
+               SUM(fatigue_high), MIN(first_ts), MAX(last_ts)
+        FROM {daily}
+        GROUP BY patient_name, exercise, week
+        """
+    )
+
+
+def add_to_rollups(conn, session_id):
+    """Cộng 1 session vừa ghi vào rollup ngày / tuần (cùng transaction với INSERT)."""
+    for table, period in ROLLUP_PERIODS.values():
+        conn.execute(
+            f"""
+            INSERT INTO {table} {_rollup_select(period, "id = ?")}
+            ON CONFLICT (patient_name, exercise, period) DO UPDATE SET
+                sessions = sessions + excluded.sessions,
+                reps = reps + excluded.reps,
+                duration_s = duration_s + excluded.duration_s,
+                range_sum = range_sum + excluded.range_sum,
+                rom_n = rom_n + excluded.rom_n,
+                rom_sum = rom_sum + excluded.rom_sum,
+                rom_best = CASE WHEN rom_best IS NULL OR excluded.rom_best > rom_best
+                           THEN excluded.rom_best ELSE rom_best END,
+                fatigue_n = fatigue_n + excluded.fatigue_n,
+                fatigue_sum = fatigue_sum + excluded.fatigue_sum,
+                fatigue_high = fatigue_high + excluded.fatigue_high,
+                first_ts = MIN(first_ts, excluded.first_ts),
+                last_ts = MAX(last_ts, excluded.last_ts)
+            """,
+            (session_id,),
+        )
+
+
+def _backfill_session_columns(conn):
+    """
+    v3: điền cột có kiểu cho session cũ trong 1 lượt UPDATE - timestamp text
+    (giờ local) -> ts, "Good | ROM 87.3% | Fatigue Low" -> rom_score,
+    fatigue_level (CAST lấy phần số đứng đầu chuỗi sau "ROM ").
+    """
+    fatigue = " ".join(
+        f"WHEN assessment LIKE '%Fatigue {name}%' THEN {i}"
+        for i, name in enumerate(FATIGUE_LEVELS)
+    )
+    conn.execute(
+        f"""
+        UPDATE sessions SET
+            ts = CAST(strftime('%s', timestamp, 'utc') AS INTEGER),
+            rom_score = CASE WHEN instr(assessment, 'ROM ') > 0 THEN
+                CAST(substr(assessment, instr(assessment, 'ROM ') + 4) AS REAL) END,
+            fatigue_level = CASE {fatigue} END
+        WHERE ts IS NULL
+        """
+    )
+
+
+MIGRATIONS = [
+    (
+        1,
+        "sessions, model switches, rep metrics, session metrics",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS sessions
+            (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp TEXT,
+                patient_name TEXT,
+                exercise TEXT,
+                reps INTEGER,
+                min_angle REAL,
+                max_angle REAL,
+                assessment TEXT
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS model_switches
+            (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id INTEGER,
+                time TEXT,
+                from_complexity INTEGER,
+                to_complexity INTEGER,
+                latency_ms REAL,
+                budget_ms REAL,
+                reps INTEGER
+            )
+            """,
+            # Rep của session KHÔNG có journal (batch, multistream, GUI tắt
+            # PERSIST_SERIES). Session có journal: rep nằm ở series_reps.
+            # Đọc rep theo session qua view session_reps (v4).
+            """
+            CREATE TABLE IF NOT EXISTS rep_metrics
+            (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id INTEGER,
+                rep INTEGER,
+                start_s REAL,
+                duration_s REAL,
+                eccentric_s REAL,
+                concentric_s REAL,
+                peak_velocity REAL,
+                min_angle REAL,
+                max_angle REAL,
+                rom REAL
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS session_metrics
+            (
+                session_id INTEGER PRIMARY KEY,
+                metrics TEXT
+            )
+            """,
+        ],
+    ),
+    (
+        2,
+        "per-frame session series, rep events, feedback texts",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS session_series
+            (
+                id TEXT PRIMARY KEY,
+                session_id INTEGER,
+                patient_name TEXT,
+                exercise TEXT,
+                started TEXT,
+                updated TEXT,
+                n_joints INTEGER,
+                frames INTEGER DEFAULT 0,
+                status TEXT
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_series_session ON session_series (session_id)",
+            "CREATE INDEX IF NOT EXISTS idx_series_patient ON session_series (patient_name, started)",
+            """
+            CREATE TABLE IF NOT EXISTS series_chunks
+            (
+                series_id TEXT,
+                chunk INTEGER,
+                t0 REAL,
+                t1 REAL,
+                rows INTEGER,
+                data BLOB,
+                PRIMARY KEY (series_id, chunk)
+            )
+            """,
+            # Nguồn chuẩn cho rep của session có journal (ghi ngay khi đếm,
+            # còn lại cả khi session bị ngắt); insert_session không ghi lại
+            # các rep này vào rep_metrics.
+            """
+            CREATE TABLE IF NOT EXISTS series_reps
+            (
+                series_id TEXT,
+                rep INTEGER,
+                start_s REAL,
+                duration_s REAL,
+                eccentric_s REAL,
+                concentric_s REAL,
+                peak_velocity REAL,
+                min_angle REAL,
+                max_angle REAL,
+                rom REAL,
+                PRIMARY KEY (series_id, rep)
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS feedback_texts
+            (
+                code INTEGER PRIMARY KEY,
+                text TEXT UNIQUE
+            )
+            """,
+        ],
+    ),
+    (
+        3,
+        "typed session columns, patient/exercise/time index, daily/weekly rollups",
+        [
+            "ALTER TABLE sessions ADD COLUMN ts INTEGER",
+            "ALTER TABLE sessions ADD COLUMN rom_score REAL",
+            "ALTER TABLE sessions ADD COLUMN fatigue_level INTEGER",
+            "ALTER TABLE sessions ADD COLUMN calib_min REAL",
+            "ALTER TABLE sessions ADD COLUMN calib_max REAL",
+            "ALTER TABLE sessions ADD COLUMN duration_s REAL",
+            _backfill_session_columns,
+            # Index tạo sau khi backfill (không phải cập nhật index từng dòng)
+            "CREATE INDEX IF NOT EXISTS idx_sessions_patient "
+            "ON sessions (patient_name, exercise, ts)",
+            f"CREATE TABLE IF NOT EXISTS session_daily ({_ROLLUP_COLUMNS}) WITHOUT ROWID",
+            f"CREATE TABLE IF NOT EXISTS session_weekly ({_ROLLUP_COLUMNS}) WITHOUT ROWID",
+            rebuild_rollups,
+        ],
+    ),
+    (
+        4,
+        "session_reps view over rep_metrics + series_reps, drop duplicated rep rows",
+        [
+            # Bản cũ ghi rep của session có journal vào cả 2 bảng
+            """
+            DELETE FROM rep_metrics WHERE session_id IN (
+                SELECT s.session_id FROM session_series s
+                WHERE s.session_id IS NOT NULL
+                  AND EXISTS (SELECT 1 FROM series_reps r WHERE r.series_id = s.id)
+            )
+            """,
+            """
+            CREATE VIEW IF NOT EXISTS session_reps AS
+            SELECT session_id, rep, start_s, duration_s, eccentric_s, concentric_s,
+                   peak_velocity, min_angle, max_angle, rom
+            FROM rep_metrics
+            UNION ALL
+            SELECT s.session_id, r.rep, r.start_s, r.duration_s, r.eccentric_s,
+                   r.concentric_s, r.peak_velocity, r.min_angle, r.max_angle, r.rom
+            FROM series_reps r JOIN session_series s ON s.id = r.series_id
+            WHERE s.session_id IS NOT NULL
+            """,
+        ],
+    ),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn, migrations=MIGRATIONS):
+    """Chạy các migration có version > user_version trong 1 transaction."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        version = schema_version(conn)
+        for target, description, steps in migrations:
+            if target <= version:
+                continue
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(f"PRAGMA user_version = {int(target)}")
+            print(f"DB migrated to v{target}: {description}")
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+class Database:
+    """Connection theo thread tới 1 file DB (schema migrate ở lần mở đầu tiên)."""
+    def __init__(self, path=DB_PATH, timeout=5.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._migrated = False
+
+    def _open(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.timeout,
+            isolation_level=None,  # tự quản lý BEGIN / COMMIT
+            check_same_thread=False,
+            cached_statements=256,
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with self._lock:
+            if not self._migrated:
+                migrate(conn)
+                self._migrated = True
+        return conn
+
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._open()
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """BEGIN IMMEDIATE (lấy write lock ngay, chờ tối đa timeout) ... COMMIT."""
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def close(self):
+        """Đóng connection của thread hiện tại."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class DatabaseWriter(threading.Thread):
+    """
+    Thread ghi nền: submit(fn, *args, after=None) -> Future.
+    fn(conn, *args) chạy trong transaction chung với các job đang chờ khác;
+    after(kết quả) chạy sau khi COMMIT (vd. ghi CSV, in log).
+    Batch lỗi thì chạy lại từng job riêng để 1 job hỏng không kéo theo job khác.
+    """
+    def __init__(self, database, max_batch=256, retries=3):
+        super().__init__(daemon=True)
+        self.database = database
+        self.max_batch = max_batch
+        self.retries = retries
+        self.queue = queue.Queue()
+        self.transactions = 0
+        self.jobs = 0
+
+    def submit(self, fn, *args, after=None):
+        future = Future()
+        self.queue.put((fn, args, after, future))
+        return future
+
+    def run(self):
+        stop = False
+        while not stop:
+            job = self.queue.get()
+            if job is None:
+                break
+            batch = [job]
+            while len(batch) < self.max_batch:
+                try:
+                    job = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    stop = True
+                    break
+                batch.append(job)
+            self._run_batch(batch)
+        self.database.close()
+
+    def _commit(self, batch):
+        """Chạy batch trong 1 transaction, thử lại khi DB đang bị process khác khóa."""
+        for attempt in range(self.retries + 1):
+            try:
+                t0 = time.perf_counter()
+                with self.database.transaction() as conn:
+                    results = [fn(conn, *args) for fn, args, _, _ in batch]
+                METRICS.record("db_commit", time.perf_counter() - t0)
+                self.transactions += 1
+                return results
+            except sqlite3.OperationalError as e:
+                if "locked" not in str(e) or attempt == self.retries:
+                    raise
+                METRICS.count("db_busy_retries")
+                time.sleep(0.05 * (attempt + 1))
+
+    def _run_batch(self, batch):
+        try:
+            results = self._commit(batch)
+        except Exception as e:
+            if len(batch) == 1:
+                print(f"DB Write Error: {e}")
+                METRICS.exception("db_write", e)
+                batch[0][3].set_exception(e)
+                return
+            for job in batch:
+                self._run_batch([job])
+            return
+
+        self.jobs += len(batch)
+        for (_, _, after, future), result in zip(batch, results):
+            if after is not None:
+                try:
+                    after(result)
+                except Exception as e:
+                    print(f"DB Callback Error: {e}")
+                    METRICS.exception("db_after", e)
+            future.set_result(result)
+
+    def flush(self, timeout=None):
+        """Chờ mọi job đã submit trước đó ghi xong."""
+        if self.is_alive():
+            self.submit(lambda conn: None).result(timeout)
+
+    def close(self, timeout=10.0):
+        if self.is_alive():
+            self.queue.put(None)
+            self.join(timeout)
+
+
+_databases = {}
+_writers = {}
+_singleton_lock = threading.Lock()
+
+
+def get_database(path=DB_PATH):
+    """Database dùng chung trong process (process con sau fork tạo lại)."""
+    key = (os.getpid(), os.path.abspath(path))
+    with _singleton_lock:
+        if key not in _databases:
+            _databases[key] = Database(path)
+        return _databases[key]
+
+
+def get_writer(path=DB_PATH):
+    """DatabaseWriter dùng chung (khởi động lần đầu, tự flush khi thoát)."""
+    database = get_database(path)
+    key = (os.getpid(), os.path.abspath(path))
+    with _singleton_lock:
+        writer = _writers.get(key)
+        if writer is None or not writer.is_alive():
+            writer = DatabaseWriter(database)
+            writer.start()
+            _writers[key] = writer
+            atexit.register(writer.close)
+        return writer
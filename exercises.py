@@ -0,0 +1,227 @@
+"""
+Định nghĩa bài tập dạng dữ liệu.
+
+Mỗi bài tập là 1 ExerciseSpec: khớp tính góc, chiều của pha "down", ngưỡng
+mặc định, feedback và các form rule (điều kiện trên góc khớp / vị trí
+landmark). `register_exercise` biên dịch spec thành bảng tra sẵn (index
+landmark / góc cho từng bên, hàm so sánh) -> mỗi frame RehabSession chỉ tra
+dict 1 lần, không so sánh tên bài tập. Thêm bài tập mới chỉ cần thêm spec.
+"""
+import operator
+
+# Góc khớp -> (đầu, đỉnh, cuối). Index 33/34/35 là điểm ảo: giữa 2 vai,
+# giữa 2 hông, điểm ngay dưới giữa hông (trunk = 180 khi lưng thẳng đứng).
+JOINT_TRIPLETS = {
+    "elbow_L": (11, 13, 15),
+    "elbow_R": (12, 14, 16),
+    "shoulder_L": (13, 11, 23),
+    "shoulder_R": (14, 12, 24),
+    "hip_L": (11, 23, 25),
+    "hip_R": (12, 24, 26),
+    "knee_L": (23, 25, 27),
+    "knee_R": (24, 26, 28),
+    "trunk": (33, 34, 35),
+}
+JOINT_NAMES = list(JOINT_TRIPLETS)
+JOINT_INDEX = {name: i for i, name in enumerate(JOINT_NAMES)}
+
+# Landmark theo bên (trái, phải)
+SIDE_LANDMARKS = {
+    "shoulder": (11, 12),
+    "elbow": (13, 14),
+    "wrist": (15, 16),
+    "hip": (23, 24),
+    "knee": (25, 26),
+    "ankle": (27, 28),
+}
+SIDES = ("L", "R")
+
+WHITE = (255, 255, 255)
+GREEN = (0, 255, 0)
+ORANGE = (0, 165, 255)
+RED = (0, 0, 255)
+
+_OPS = {"<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge}
+_AXES = {"x": 0, "y": 1}
+
+
+class FormRule:
+    """
+    Kiểm tra form, vi phạm khi điều kiện đúng:
+    - angle="hip": góc khớp (bên đang dùng, hoặc "trunk") `op` value
+    - offset=("knee", "ankle", "x"): landmark a - landmark b theo trục `op` value
+    Chỉ xét khi stage == `stage` (None = mọi stage).
+    """
+    def __init__(self, feedback, angle=None, offset=None, op=">", value=0.0,
+                 stage="down", color=RED):
+        if (angle is None) == (offset is None):
+            raise ValueError("FormRule needs exactly one of angle / offset")
+        self.feedback = feedback
+        self.angle = angle
+        self.offset = offset
+        self.op = op
+        self.value = value
+        self.stage = stage
+        self.color = color
+
+
+class ExerciseSpec:
+    """
+    joint: khớp đếm rep ("elbow", "knee", ...; bên trái/phải chọn lúc chạy).
+    down_when: "below" -> pha down khi góc < DOWN_TH (Squat);
+               "above" -> pha down khi góc > DOWN_TH (Bicep Curl, tay duỗi).
+    thresholds: (DOWN_TH, UP_TH) mặc định trước khi auto-calib.
+    feedback: {"down": (text, color), "rep": (text, color),
+               "between": (text, color) - giữa 2 ngưỡng khi chưa xuống (tùy chọn)}
+    min_stage_s: thời gian (giây) góc phải ở bên kia ngưỡng mới đổi stage
+                 (~3 frame @30fps); đổi ra số frame theo dt thực lúc chạy.
+    fatigue_diff: (High, Moderate) - độ giảm biên độ (độ) khi đánh giá
+                  mệt mỏi kiểu cũ (session quá ít rep).
+    """
+    def __init__(self, joint, down_when, thresholds, feedback, form_rules=(),
+                 min_stage_s=0.1, fatigue_diff=(15, 7), guide=""):
+        if down_when not in ("below", "above"):
+            raise ValueError(f"down_when must be 'below' or 'above', got {down_when!r}")
+        self.joint = joint
+        self.down_when = down_when
+        self.thresholds = thresholds
+        self.feedback = feedback
+        self.form_rules = list(form_rules)
+        self.min_stage_s = min_stage_s
+        self.fatigue_diff = fatigue_diff
+        self.guide = guide
+
+
+class CompiledExercise:
+    """Spec đã biên dịch: mọi index / hàm so sánh tra sẵn theo bên."""
+    def __init__(self, name, spec):
+        self.name = name
+        self.spec = spec
+        # +1: down khi góc nhỏ; -1: down khi góc lớn -> so sánh sign*angle
+        self.sign = 1 if spec.down_when == "below" else -1
+        self.turn_at_max = self.sign < 0
+        self.min_stage_s = spec.min_stage_s
+        self.default_thresholds = {
+            "DOWN_TH": spec.thresholds[0],
+            "UP_TH": spec.thresholds[1],
+        }
+        self.down_feedback = spec.feedback["down"]
+        self.rep_feedback = spec.feedback["rep"]
+        self.between_feedback = spec.feedback.get("between")
+        self.fatigue_diff = spec.fatigue_diff
+
+        self.angle_index = {}  # bên -> index trong vector góc
+        self.triplet = {}      # bên -> 3 landmark của khớp chính
+        self.rules = {}        # bên -> [(stage, kind, a, b, op, value, feedback, color)]
+        self.tracked = {}      # bên -> landmark cần theo dõi giữa keyframe
+        for side in SIDES:
+            joint = f"{spec.joint}_{side}"
+            self.angle_index[side] = JOINT_INDEX[joint]
+            self.triplet[side] = JOINT_TRIPLETS[joint]
+            tracked = list(JOINT_TRIPLETS[joint])
+            rules = []
+            for rule in spec.form_rules:
+                op = _OPS[rule.op]
+                if rule.angle is not None:
+                    name = rule.angle if rule.angle in JOINT_INDEX else f"{rule.angle}_{side}"
+                    a, b = JOINT_INDEX[name], None
+                    points = [i for i in JOINT_TRIPLETS[name] if i < 33]
+                    kind = "angle"
+                else:
+                    pa, pb, axis = rule.offset
+                    k = SIDES.index(side)
+                    a, b = SIDE_LANDMARKS[pa][k], SIDE_LANDMARKS[pb][k]
+                    points = [a, b]
+                    kind = _AXES[axis]
+                rules.append(
+                    (rule.stage, kind, a, b, op, rule.value, rule.feedback, rule.color)
+                )
+                tracked += [i for i in points if i not in tracked]
+            self.rules[side] = rules
+            self.tracked[side] = tracked
+
+
+EXERCISES = {}  # tên -> CompiledExercise (bảng dispatch)
+
+
+def register_exercise(name, spec):
+    EXERCISES[name] = CompiledExercise(name, spec)
+    return EXERCISES[name]
+
+
+def get_exercise(name):
+    """CompiledExercise của bài tập, None nếu chưa đăng ký."""
+    return EXERCISES.get(name)
+
+
+def exercise_names():
+    return list(EXERCISES)
+
+
+# ===================== THƯ VIỆN BÀI TẬP =====================
+
+register_exercise(
+    "Bicep Curl",
+    ExerciseSpec(
+        joint="elbow",
+        down_when="above",
+        thresholds=(150, 40),
+        feedback={"down": ("Curl Up", WHITE), "rep": ("Good Rep!", GREEN)},
+        fatigue_diff=(10, 5),
+        guide=(
+            "BICEP CURL (Tập tay trước)\n\n"
+            "• Đứng nghiêng 45°–90° so với camera, tay tập gần camera.\n"
+            "• Tư thế bắt đầu: tay duỗi gần như thẳng xuống.\n"
+            "• Tư thế kết thúc: gập tay hết mức về phía vai.\n"
+            "• Giữ vai cố định, không đánh người.\n"
+            "• Hít vào khi hạ tay, thở ra khi gập tay."
+        ),
+    ),
+)
+
+register_exercise(
+    "Squat",
+    ExerciseSpec(
+        joint="knee",
+        down_when="below",
+        thresholds=(90, 165),
+        feedback={
+            "down": ("Stand Up", RED),
+            "rep": ("Perfect Squat!", GREEN),
+            "between": ("Lower! (Go deeper)", ORANGE),
+        },
+        form_rules=[
+            FormRule("Knee too far forward", offset=("knee", "ankle", "x"), op=">", value=0.12),
+            FormRule("Keep your back more upright", angle="hip", op="<", value=150),
+        ],
+        guide=(
+            "SQUAT (Tập chân & mông)\n\n"
+            "• Đặt camera bên hông (side view).\n"
+            "• Tư thế bắt đầu: đứng thẳng, chân rộng bằng vai.\n"
+            "• Ngồi xuống như ngồi ghế, gối không vượt mũi chân quá nhiều.\n"
+            "• Giữ lưng thẳng, ngực mở, mắt nhìn trước.\n"
+            "• Đứng thẳng người trở lại, siết mông ở cuối chuyển động."
+        ),
+    ),
+)
+
+register_exercise(
+    "Lunges",
+    ExerciseSpec(
+        joint="knee",
+        down_when="below",
+        thresholds=(95, 165),
+        feedback={"down": ("Push Up", RED), "rep": ("Good Lunge!", GREEN)},
+        form_rules=[
+            FormRule("Front knee too far forward", offset=("knee", "ankle", "x"), op=">", value=0.12),
+        ],
+        guide=(
+            "LUNGES (Tập chân trước & sau)\n\n"
+            "• Đặt camera bên hông, thấy rõ chân trước và chân sau.\n"
+            "• Bước một chân lên phía trước, hạ người xuống.\n"
+            "• Gối trước gần 90°, không vượt mũi chân quá nhiều.\n"
+            "• Giữ lưng thẳng, trọng tâm ổn định.\n"
+            "• Đẩy người lên và đổi chân nếu cần."
+        ),
+    ),
+)
@@ -0,0 +1,91 @@
+import time
+
+
+class ComplexityGovernor:
+    """
+    Giữ thời gian inference trong ngân sách frame (1 / target_fps) bằng cách
+    đổi model_complexity của MediaPipe (0 = lite, 1 = full, 2 = heavy).
+
+    Chống dao động:
+    - Latency đo bằng EMA, phải vượt / dưới ngưỡng liên tục `window` lần.
+    - Hạ cấp khi EMA > budget * down_ratio; nâng cấp khi latency đã biết
+      của mức trên (hoặc mức hiện tại * 2 nếu chưa đo / đo cách đây quá
+      `reprobe_s` giây) < budget * up_ratio.
+    - Sau mỗi lần đổi phải chờ `cooldown_s` giây.
+    - Chỉ đổi khi `can_switch` (không đang giữa 1 rep).
+    """
+    def __init__(self, levels=(0, 1, 2), start_level=1, target_fps=30.0,
+                 down_ratio=1.0, up_ratio=0.6, window=30, cooldown_s=5.0,
+                 reprobe_s=60.0):
+        self.levels = sorted(levels)
+        self.level = start_level if start_level in self.levels else self.levels[0]
+        self.budget_s = 1.0 / target_fps
+        self.down_ratio = down_ratio
+        self.up_ratio = up_ratio
+        self.window = window
+        self.cooldown_s = cooldown_s
+        self.reprobe_s = reprobe_s
+        self.latency_ema = {}  # level -> EMA latency (s)
+        self._measured_at = {}  # level -> thời điểm đo gần nhất
+        self.reset()
+
+    def reset(self):
+        """Reset theo session (giữ latency đã học của từng mức)."""
+        self._over = 0
+        self._under = 0
+        self._last_switch = time.time()
+        self.events = []
+
+    def observe(self, latency_s, can_switch=True, reps=0):
+        """Ghi nhận 1 lần inference; trả về mức mới nếu cần đổi, ngược lại None."""
+        now = time.time()
+        ema = self.latency_ema.get(self.level)
+        stale = now - self._measured_at.get(self.level, 0.0) > self.reprobe_s
+        ema = latency_s if ema is None or stale else 0.9 * ema + 0.1 * latency_s
+        self.latency_ema[self.level] = ema
+        self._measured_at[self.level] = now
+
+        pos = self.levels.index(self.level)
+        if ema > self.budget_s * self.down_ratio and pos > 0:
+            self._over += 1
+            self._under = 0
+        elif pos < len(self.levels) - 1:
+            up = self.levels[pos + 1]
+            if now - self._measured_at.get(up, 0.0) > self.reprobe_s:
+                higher = 2.0 * ema  # chưa đo hoặc số đo đã cũ (tải máy có thể đã đổi)
+            else:
+                higher = self.latency_ema[up]
+            if higher < self.budget_s * self.up_ratio:
+                self._under += 1
+            else:
+                self._under = 0
+            self._over = 0
+        else:
+            self._over = 0
+            self._under = 0
+
+        if not can_switch or now - self._last_switch < self.cooldown_s:
+            return None
+
+        if self._over >= self.window:
+            new_level = self.levels[pos - 1]
+        elif self._under >= self.window:
+            new_level = self.levels[pos + 1]
+        else:
+            return None
+
+        self.events.append(
+            {
+                "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "from": self.level,
+                "to": new_level,
+                "latency_ms": round(1000.0 * ema, 1),
+                "budget_ms": round(1000.0 * self.budget_s, 1),
+                "reps": reps,
+            }
+        )
+        self.level = new_level
+        self._over = 0
+        self._under = 0
+        self._last_switch = now
+        return new_level
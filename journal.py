@@ -0,0 +1,278 @@
+"""
+Lưu bền chuỗi theo frame + sự kiện rep của session vào SQLite.
+
+SeriesJournal gắn vào RehabSession (session.journal): mỗi `chunk_rows` frame
+copy phần mới của SessionSeries (vài chục µs) rồi giao cho db.DatabaseWriter;
+nén + INSERT chạy ở thread ghi -> vòng frame không chờ I/O. Rep được ghi ngay
+khi đếm vào series_reps - nguồn chuẩn cho rep của session có journal (không
+ghi lại vào rep_metrics; đọc theo session qua view session_reps). Mỗi chunk
+là 1 transaction đã commit (WAL), nên session bị kill giữa chừng vẫn giữ mọi
+thứ tới chunk cuối (~5 s @30 FPS); session_series.status ở lại "open" và
+được đánh dấu "interrupted" ở lần khởi động sau.
+
+Chunk (bảng series_chunks) nén zlib theo cột, delta theo frame:
+    t: ms tính từ t0 (int32), angle (int16, vốn là int), angles: 0.1 độ
+    (int16), stage (int8), visibility: /255 (uint8), feedback (int16, mã
+    trong bảng feedback_texts).
+~1 MB mỗi giờ @30 FPS với 9 góc (thô ~5.9 MB).
+
+    frames = load_series(series_id)  # dict: meta, frames (structured), feedback, reps
+"""
+import time
+import uuid
+import zlib
+
+import numpy as np
+
+import db
+from timeseries import FEEDBACK_TEXTS
+
+CHUNK_VERSION = 1
+
+
+def _record_dtype(n_joints):
+    return [
+        ("t", "f8"),
+        ("angle", "f4"),
+        ("angles", "f4", (n_joints,)),
+        ("stage", "i1"),
+        ("visibility", "f4"),
+        ("feedback", "i2"),
+    ]
+
+
+def encode_chunk(records):
+    """Structured array (SessionSeries.to_records) -> (t0, t1, blob nén)."""
+    t0 = float(records["t"][0])
+    t_ms = np.round((records["t"] - t0) * 1000.0).astype(np.int32)
+    angles = np.round(records["angles"] * 10.0).astype(np.int16)
+    columns = (
+        np.diff(t_ms, prepend=0).astype(np.int32),
+        np.diff(records["angle"].astype(np.int16), prepend=0).astype(np.int16),
+        np.ascontiguousarray(np.diff(angles, axis=0, prepend=0).T).astype(np.int16),
+        records["stage"].astype(np.int8),
+        np.round(np.clip(records["visibility"], 0.0, 1.0) * 255.0).astype(np.uint8),
+        records["feedback"].astype(np.int16),
+    )
+    blob = bytes([CHUNK_VERSION]) + zlib.compress(b"".join(c.tobytes() for c in columns), 6)
+    return t0, float(records["t"][-1]), blob
+
+
+def decode_chunk(t0, blob, rows, n_joints):
+    if blob[0] != CHUNK_VERSION:
+        raise ValueError(f"Unknown chunk version {blob[0]}")
+    raw = zlib.decompress(blob[1:])
+    layout = (
+        ("t", np.int32, rows),
+        ("angle", np.int16, rows),
+        ("angles", np.int16, rows * n_joints),
+        ("stage", np.int8, rows),
+        ("visibility", np.uint8, rows),
+        ("feedback", np.int16, rows),
+    )
+    cols = {}
+    offset = 0
+    for name, dtype, count in layout:
+        cols[name] = np.frombuffer(raw, dtype=dtype, count=count, offset=offset)
+        offset += count * np.dtype(dtype).itemsize
+
+    out = np.empty(rows, dtype=_record_dtype(n_joints))
+    out["t"] = t0 + np.cumsum(cols["t"], dtype=np.int64) / 1000.0
+    out["angle"] = np.cumsum(cols["angle"], dtype=np.int32)
+    out["angles"] = np.cumsum(
+        cols["angles"].reshape(n_joints, rows).T, axis=0, dtype=np.int32
+    ) / 10.0
+    out["stage"] = cols["stage"]
+    out["visibility"] = cols["visibility"] / 255.0
+    out["feedback"] = cols["feedback"]
+    return out
+
+
+def _now():
+    return time.strftime("%Y-%m-%d %H:%M:%S")
+
+
+class SeriesJournal:
+    """Ghi dần SessionSeries + rep của 1 session qua DatabaseWriter."""
+    def __init__(self, patient_name, exercise, n_joints, writer=None, chunk_rows=150):
+        self.series_id = uuid.uuid4().hex
+        self.n_joints = n_joints
+        self.writer = writer or db.get_writer()
+        self.chunk_rows = chunk_rows
+        self.written = 0   # số dòng (tính từ đầu session) đã giao cho writer
+        self.chunks = 0
+        self.skipped = 0   # dòng đã bị spill khỏi RAM trước khi kịp ghi
+        self._feedback_db = {}  # mã trong process -> mã DB (chỉ thread ghi dùng)
+        self.writer.submit(
+            _open_series, self.series_id, patient_name, exercise, n_joints, _now()
+        )
+
+    def on_append(self, series):
+        """Gọi sau mỗi series.append (thread frame)."""
+        if series.total - self.written >= self.chunk_rows:
+            self.flush(series)
+
+    def flush(self, series):
+        start = self.written - series.spilled
+        if start < 0:
+            self.skipped += -start
+            start = 0
+        if start >= len(series):
+            return
+        records = series.to_records(start, len(series))
+        self.writer.submit(self._write_chunk, self.chunks, records)
+        self.chunks += 1
+        self.written = series.total
+
+    def add_rep(self, rep):
+        self.writer.submit(_insert_rep, self.series_id, rep)
+
+    def close(self, series, status="closed"):
+        """Ghi nốt phần còn lại và đóng series (không chờ)."""
+        self.flush(series)
+        return self.writer.submit(_close_series, self.series_id, status, _now())
+
+    def _write_chunk(self, conn, chunk, records):
+        codes = np.unique(records["feedback"])
+        for code in codes.tolist():
+            if code and code not in self._feedback_db:
+                text = FEEDBACK_TEXTS[code]
+                conn.execute("INSERT OR IGNORE INTO feedback_texts (text) VALUES (?)", (text,))
+                self._feedback_db[code] = conn.execute(
+                    "SELECT code FROM feedback_texts WHERE text = ?", (text,)
+                ).fetchone()[0]
+        if len(codes) and codes.max() > 0:
+            lut = np.zeros(int(codes.max()) + 1, dtype=np.int16)
+            for code in codes.tolist():
+                lut[code] = self._feedback_db.get(code, 0)
+            records["feedback"] = lut[records["feedback"]]
+
+        t0, t1, blob = encode_chunk(records)
+        conn.execute(
+            "INSERT OR REPLACE INTO series_chunks (series_id, chunk, t0, t1, rows, data) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (self.series_id, chunk, t0, t1, len(records), blob),
+        )
+        conn.execute(
+            "UPDATE session_series SET frames = frames + ?, updated = ? WHERE id = ?",
+            (len(records), _now(), self.series_id),
+        )
+
+
+def _open_series(conn, series_id, patient_name, exercise, n_joints, started):
+    conn.execute(
+        "INSERT INTO session_series "
+        "(id, patient_name, exercise, started, updated, n_joints, frames, status) "
+        "VALUES (?, ?, ?, ?, ?, ?, 0, 'open')",
+        (series_id, patient_name, exercise, started, started, n_joints),
+    )
+
+
+def _insert_rep(conn, series_id, rep):
+    conn.execute(
+        """
+        INSERT OR REPLACE INTO series_reps
+        (series_id, rep, start_s, duration_s, eccentric_s, concentric_s,
+         peak_velocity, min_angle, max_angle, rom)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """,
+        (
+            series_id,
+            rep["rep"],
+            rep["start"],
+            rep["duration"],
+            rep["eccentric_s"],
+            rep["concentric_s"],
+            rep["peak_velocity"],
+            rep["min_angle"],
+            rep["max_angle"],
+            rep["rom"],
+        ),
+    )
+
+
+def _close_series(conn, series_id, status, ended):
+    conn.execute(
+        "UPDATE session_series SET status = ?, updated = ? WHERE id = ?",
+        (status, ended, series_id),
+    )
+
+
+def mark_interrupted(database=None, stale_seconds=600):
+    """Series còn "open" mà không được ghi thêm quá stale_seconds -> "interrupted"."""
+    conn = (database or db.get_database()).connection()
+    cutoff = time.strftime(
+        "%Y-%m-%d %H:%M:%S", time.localtime(time.time() - stale_seconds)
+    )
+    cur = conn.execute(
+        "UPDATE session_series SET status = 'interrupted' "
+        "WHERE status = 'open' AND updated < ?",
+        (cutoff,),
+    )
+    return cur.rowcount
+
+
+def list_series(patient_name=None, limit=50, database=None):
+    conn = (database or db.get_database()).connection()
+    sql = ("SELECT id, session_id, patient_name, exercise, started, updated, frames, status "
+           "FROM session_series")
+    args = []
+    if patient_name is not None:
+        sql += " WHERE patient_name = ?"
+        args.append(patient_name)
+    sql += " ORDER BY started DESC LIMIT ?"
+    args.append(limit)
+    keys = ("id", "session_id", "patient_name", "exercise", "started", "updated",
+            "frames", "status")
+    return [dict(zip(keys, row)) for row in conn.execute(sql, args)]
+
+
+def load_series(series_id, database=None):
+    """
+    Đọc lại 1 series: {"meta", "frames" (structured array như
+    SessionSeries.to_records), "feedback" {mã: text}, "reps" [dict]}.
+    None nếu không có.
+    """
+    conn = (database or db.get_database()).connection()
+    row = conn.execute(
+        "SELECT id, session_id, patient_name, exercise, started, updated, n_joints, "
+        "frames, status FROM session_series WHERE id = ?",
+        (series_id,),
+    ).fetchone()
+    if row is None:
+        return None
+    keys = ("id", "session_id", "patient_name", "exercise", "started", "updated",
+            "n_joints", "frames", "status")
+    meta = dict(zip(keys, row))
+    n_joints = meta["n_joints"]
+
+    parts = [
+        decode_chunk(t0, blob, rows, n_joints)
+        for t0, rows, blob in conn.execute(
+            "SELECT t0, rows, data FROM series_chunks WHERE series_id = ? ORDER BY chunk",
+            (series_id,),
+        )
+    ]
+    frames = np.concatenate(parts) if parts else np.empty(0, dtype=_record_dtype(n_joints))
+    codes = np.unique(frames["feedback"]).tolist()
+    feedback = {}
+    if codes:
+        placeholders = ",".join("?" * len(codes))
+        feedback = dict(
+            conn.execute(
+                f"SELECT code, text FROM feedback_texts WHERE code IN ({placeholders})",
+                codes,
+            ).fetchall()
+        )
+
+    rep_keys = ("rep", "start", "duration", "eccentric_s", "concentric_s",
+                "peak_velocity", "min_angle", "max_angle", "rom")
+    reps = [
+        dict(zip(rep_keys, r))
+        for r in conn.execute(
+            "SELECT rep, start_s, duration_s, eccentric_s, concentric_s, peak_velocity, "
+            "min_angle, max_angle, rom FROM series_reps WHERE series_id = ? ORDER BY rep",
+            (series_id,),
+        )
+    ]
+    return {"meta": meta, "frames": frames, "feedback": feedback, "reps": reps}
@@ -0,0 +1,196 @@
+"""
+Cache landmark trên đĩa cho phân tích lại video đã ghi.
+
+Output của pose chỉ phụ thuộc nội dung video + tham số Pose(...) / cách chạy
+(kích thước frame; video chia chunk thêm chunked / chunk_seconds /
+warmup_seconds vì landmark ghép từ chunk khác bản chạy tuần tự) -> khóa
+cache = sha256(nội dung video) + các tham số đó. Mỗi entry là 1 file .npy (n_frames, 33, 4) float32
+[x, y, z, visibility] (NaN = frame không có người) + 1 file .json meta
+(fps, số frame, checksum). Đọc bằng np.load(mmap_mode="r") -> không copy
+vào RAM, replay đọc dần theo frame.
+
+- Ghi atomic (tmp + os.replace), file meta ghi sau cùng: có meta = entry đủ.
+- Integrity: shape / dtype / số frame khớp meta, sha256 dữ liệu (verify=True).
+  Entry hỏng bị xóa và coi như miss.
+- LRU theo mtime của file meta (chạm vào mỗi lần hit); vượt max_bytes thì
+  xóa entry ít dùng nhất.
+- Hash video được nhớ theo (đường dẫn, size, mtime) -> lần sau không đọc lại.
+
+Ví dụ:
+    cache = LandmarkCache("landmark_cache", max_bytes=2 * 1024**3)
+    key = cache.key(video_digest("a.avi", cache.root), {"model_complexity": 1})
+    hit = cache.get(key)  # (landmarks mmap, meta) hoặc None
+"""
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+CACHE_VERSION = 1
+_CHUNK = 1 << 20
+
+
+def _file_key(path):
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime": int(st.st_mtime)}
+
+
+def _write_json(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
+def _data_digest(landmarks):
+    return hashlib.sha256(memoryview(np.ascontiguousarray(landmarks)).cast("B")).hexdigest()
+
+
+def video_digest(path, cache_dir=None):
+    """sha256 nội dung file video (nhớ lại trong cache_dir/digests nếu có)."""
+    memo = None
+    stat = _file_key(path)
+    if cache_dir:
+        name = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()
+        memo = os.path.join(cache_dir, "digests", name + ".json")
+        try:
+            with open(memo, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            if entry.get("file") == stat:
+                return entry["sha256"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(_CHUNK), b""):
+            h.update(block)
+    digest = h.hexdigest()
+
+    if memo:
+        os.makedirs(os.path.dirname(memo), exist_ok=True)
+        _write_json(memo, {"path": os.path.abspath(path), "file": stat, "sha256": digest})
+    return digest
+
+
+class LandmarkCache:
+    def __init__(self, root="landmark_cache", max_bytes=2 * 1024**3, verify=True):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.verify = verify
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def key(digest, params):
+        """Khóa = hash(nội dung video + tham số pose, sắp xếp theo tên)."""
+        blob = json.dumps(
+            {"v": CACHE_VERSION, "video": digest, "params": params}, sort_keys=True
+        )
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    def _paths(self, key):
+        folder = os.path.join(self.root, key[:2])
+        return os.path.join(folder, key + ".npy"), os.path.join(folder, key + ".json")
+
+    def get(self, key):
+        """(landmarks memmap (n, 33, 4), meta) hoặc None nếu miss / entry hỏng."""
+        data_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            landmarks = np.load(data_path, mmap_mode="r")
+        except (OSError, ValueError):
+            # Không có meta = chưa có entry; có meta mà hỏng / thiếu data = xóa
+            if os.path.exists(meta_path):
+                self._remove(key)
+            self.misses += 1
+            return None
+
+        ok = (
+            landmarks.dtype == np.float32
+            and landmarks.shape == (meta.get("frames"), 33, 4)
+            and (not self.verify or _data_digest(landmarks) == meta.get("sha256"))
+        )
+        if not ok:
+            print(f"Landmark cache: corrupt entry {key[:12]} -> removed")
+            del landmarks
+            self._remove(key)
+            self.misses += 1
+            return None
+
+        try:
+            os.utime(meta_path)  # LRU: đánh dấu vừa dùng
+        except OSError:
+            pass
+        self.hits += 1
+        return landmarks, meta
+
+    def put(self, key, landmarks, fps, **extra):
+        """Lưu chuỗi landmark (n, 33, 4) của 1 video rồi evict nếu vượt max_bytes."""
+        landmarks = np.ascontiguousarray(landmarks, dtype=np.float32)
+        data_path, meta_path = self._paths(key)
+        os.makedirs(os.path.dirname(data_path), exist_ok=True)
+
+        tmp = f"{data_path}.{os.getpid()}.tmp.npy"
+        np.save(tmp, landmarks)
+        os.replace(tmp, data_path)
+        meta = {
+            "version": CACHE_VERSION,
+            "frames": int(len(landmarks)),
+            "fps": float(fps),
+            "sha256": _data_digest(landmarks),
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        meta.update(extra)
+        _write_json(meta_path, meta)
+        self.evict(keep=key)
+        return data_path
+
+    def _remove(self, key):
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def entries(self):
+        """[(key, bytes, last used)] của mọi entry hợp lệ trên đĩa."""
+        out = []
+        for folder in os.scandir(self.root):
+            if not folder.is_dir() or len(folder.name) != 2:
+                continue
+            for entry in os.scandir(folder.path):
+                if not entry.name.endswith(".json"):
+                    continue
+                key = entry.name[:-5]
+                data_path, _ = self._paths(key)
+                try:
+                    size = os.path.getsize(data_path) + entry.stat().st_size
+                    out.append((key, size, entry.stat().st_mtime))
+                except OSError:
+                    continue  # process khác vừa xóa
+        return out
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, keep=None):
+        """Xóa entry ít dùng nhất tới khi tổng dung lượng <= max_bytes."""
+        if not self.max_bytes:
+            return 0
+        entries = sorted(self.entries(), key=lambda e: e[2])
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for key, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            self._remove(key)
+            total -= size
+            removed += 1
+        return removed
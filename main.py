@@ -5,9 +5,37 @@ import os
 import time
 from datetime import datetime
 from PIL import Image, ImageTk, ImageDraw, ImageFont
+import chart
+from exercises import JOINT_NAMES, exercise_names, get_exercise
+from journal import SeriesJournal, mark_interrupted
 from pose_module import RehabDetector
+from pipeline import AsyncVideoWriter, FramePipeline
+from replay import LandmarkRecorder
 import utils
 
+# Độ phân giải hiển thị / ghi video, độc lập với độ phân giải inference
+DISPLAY_SIZE = (800, 600)
+# Pose chạy trên crop quanh người (ROI), cạnh dài crop thu về INFERENCE_SIZE px.
+# Tắt mặc định: chưa đối chiếu rep / góc với chạy cả frame (replay.py eval)
+ROI_MODE = False
+INFERENCE_SIZE = 256
+# Chỉ chạy model trên keyframe, giữa các keyframe đẩy khớp bằng optical flow.
+# Tắt mặc định: góc giữa 2 keyframe là ước lượng theo flow
+KEYFRAME_MODE = False
+# Tự đổi model_complexity (0/1/2) để giữ inference trong ngân sách TARGET_FPS
+ADAPTIVE_COMPLEXITY = False
+TARGET_FPS = 30.0
+# Khi ghi video: lưu thêm landmark (.npz) để replay / kiểm thử (replay.py)
+RECORD_LANDMARKS = True
+# Lưu chuỗi góc theo frame + rep vào DB trong lúc tập (journal.py)
+PERSIST_SERIES = True
+# Overlay latency / bộ đếm (metrics.py) lên video; F3 để bật / tắt khi chạy
+DEBUG_OVERLAY = False
+
+
+# Cache màu feedback theo text (feedback chỉ có vài câu cố định)
+_FEEDBACK_COLORS = {}
+
 
 class RehabApp:
     def __init__(self, root):
@@ -16,19 +44,36 @@ class RehabApp:
         self.root.geometry("1200x760")
         self.root.configure(bg="#1e272e")
 
-        self.detector = RehabDetector()
+        self.detector = RehabDetector(
+            roi_mode=ROI_MODE,
+            inference_size=INFERENCE_SIZE,
+            keyframe_mode=KEYFRAME_MODE,
+            adaptive_complexity=ADAPTIVE_COMPLEXITY,
+            target_fps=TARGET_FPS,
+        )
         self.is_running = False
         self.cap = None
+        self.pipeline = None
 
         self.current_exercise = tk.StringVar(value="Bicep Curl")
         self.patient_name = tk.StringVar(value="Patient_001")
         self.is_recording = tk.BooleanVar(value=False)
         self.video_writer = None
+        self.landmark_recorder = None
+        self.series_journal = None
+        self.last_chart = None  # tham số chart của session vừa xong (xem lại)
 
-        self.prev_time = 0
         self.fps_avg = 0
+        # Display: 1 PhotoImage dùng lại + cache giá trị label đã hiển thị
+        self.video_photo = None
+        self.display_ms = 0.0
+        self._label_state = {}
+        self.show_debug = DEBUG_OVERLAY
+        self._debug_lines = []
+        self._debug_refresh = 0.0
 
         self.setup_ui()
+        self.root.bind("<F3>", self.toggle_debug_overlay)
 
     def setup_ui(self):
         # HEADER
@@ -90,7 +135,7 @@ class RehabApp:
             state="readonly",
             font=("Segoe UI", 12),
         )
-        ex_combo["values"] = ("Bicep Curl", "Squat", "Lunges")
+        ex_combo["values"] = tuple(exercise_names())
         ex_combo.pack(pady=5, padx=20, fill="x")
         ex_combo.bind("<<ComboboxSelected>>", self.on_exercise_change)
 
@@ -149,6 +194,20 @@ class RehabApp:
         )
         self.btn_help.pack(pady=10, padx=20, fill="x")
 
+        self.btn_chart = tk.Button(
+            left_frame,
+            text="VIEW LAST CHART",
+            bg="#485460",
+            fg="white",
+            font=("Segoe UI", 11, "bold"),
+            bd=0,
+            pady=8,
+            command=self.show_last_chart,
+            state="disabled",
+            cursor="hand2",
+        )
+        self.btn_chart.pack(pady=5, padx=20, fill="x")
+
         # STATS
         stats_frame = tk.Frame(left_frame, bg="#1e272e", bd=1, relief="solid")
         stats_frame.pack(fill="x", padx=20, pady=20)
@@ -201,40 +260,14 @@ class RehabApp:
     # ===== IDLE SCREEN & HƯỚNG DẪN BÀI TẬP =====
 
     def get_exercise_guide_text(self):
-        ex = self.current_exercise.get()
-        if ex == "Bicep Curl":
-            return (
-                "BICEP CURL (Tập tay trước)\n\n"
-                "• Đứng nghiêng 45°–90° so với camera, tay tập gần camera.\n"
-                "• Tư thế bắt đầu: tay duỗi gần như thẳng xuống.\n"
-                "• Tư thế kết thúc: gập tay hết mức về phía vai.\n"
-                "• Giữ vai cố định, không đánh người.\n"
-                "• Hít vào khi hạ tay, thở ra khi gập tay."
-            )
-        elif ex == "Squat":
-            return (
-                "SQUAT (Tập chân & mông)\n\n"
-                "• Đặt camera bên hông (side view).\n"
-                "• Tư thế bắt đầu: đứng thẳng, chân rộng bằng vai.\n"
-                "• Ngồi xuống như ngồi ghế, gối không vượt mũi chân quá nhiều.\n"
-                "• Giữ lưng thẳng, ngực mở, mắt nhìn trước.\n"
-                "• Đứng thẳng người trở lại, siết mông ở cuối chuyển động."
-            )
-        elif ex == "Lunges":
-            return (
-                "LUNGES (Tập chân trước & sau)\n\n"
-                "• Đặt camera bên hông, thấy rõ chân trước và chân sau.\n"
-                "• Bước một chân lên phía trước, hạ người xuống.\n"
-                "• Gối trước gần 90°, không vượt mũi chân quá nhiều.\n"
-                "• Giữ lưng thẳng, trọng tâm ổn định.\n"
-                "• Đẩy người lên và đổi chân nếu cần."
-            )
-        else:
-            return "Chọn một bài tập để xem hướng dẫn."
+        spec = get_exercise(self.current_exercise.get())
+        if spec is not None and spec.spec.guide:
+            return spec.spec.guide
+        return "Chọn một bài tập để xem hướng dẫn."
 
     def show_idle_screen(self):
         """Hiển thị màn hình chờ với hướng dẫn bài tập hiện tại."""
-        width, height = 800, 600
+        width, height = DISPLAY_SIZE
         img = Image.new("RGB", (width, height), color=(15, 20, 30))
         draw = ImageDraw.Draw(img)
 
@@ -270,6 +303,8 @@ class RehabApp:
         """Khi đổi bài tập, nếu chưa chạy camera thì update màn hình chờ."""
         if not self.is_running:
             self.show_idle_screen()
+        elif self.pipeline:
+            self.pipeline.set_exercise(self.current_exercise.get())
 
     # ===== HƯỚNG DẪN CAMERA =====
 
@@ -319,13 +354,42 @@ class RehabApp:
                     f"recordings/{self.patient_name.get().strip().replace(' ', '_')}_"
                     f"{datetime.now().strftime('%Y%m%d_%H%M%S')}.avi"
                 )
-                fourcc = cv2.VideoWriter_fourcc(*"XVID")
-                self.video_writer = cv2.VideoWriter(filename, fourcc, 20.0, (800, 600))
+                # Encode ở thread nền, FPS lấy theo timestamp capture thực tế
+                self.video_writer = AsyncVideoWriter(
+                    filename, DISPLAY_SIZE, rgb_input=True
+                )
+                if RECORD_LANDMARKS:
+                    self.landmark_recorder = LandmarkRecorder(
+                        filename[:-4] + "_landmarks.npz", self.current_exercise.get()
+                    )
+
+            # Giảm buffer của driver để không đọc frame cũ
+            self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
 
             self.detector.reset_session()
+            self.detector.recorder = self.landmark_recorder
+            self.detector.metrics.reset()
+            self._debug_lines = []
+            if PERSIST_SERIES:
+                self.series_journal = SeriesJournal(
+                    self.patient_name.get(), self.current_exercise.get(), len(JOINT_NAMES)
+                )
+                self.detector.journal = self.series_journal
             self.is_running = True
-            self.prev_time = time.time()
             self.fps_avg = 0
+            # Idle screen đã thay ảnh của label -> gắn lại PhotoImage ở frame đầu
+            self.video_photo = None
+            self.display_ms = 0.0
+            self._label_state = {}
+
+            self.pipeline = FramePipeline(
+                self.cap, self.detector, self.current_exercise.get(), size=DISPLAY_SIZE
+            )
+            if self.video_writer:
+                # Writer trả buffer RGB về pool sau khi đổi sang BGR để encode
+                self.video_writer.release = self.pipeline.release
+                self.video_writer.start()
+            self.pipeline.start()
 
             self.btn_start.config(state="disabled", bg="#95a5a6")
             self.btn_stop.config(state="normal", bg="#eb3b5a")
@@ -335,12 +399,32 @@ class RehabApp:
     def stop_camera(self):
         if self.is_running:
             self.is_running = False
+            if self.pipeline:
+                self.pipeline.stop()
+                self.pipeline = None
             if self.cap:
                 self.cap.release()
 
+            series_id = None
+            if self.series_journal:
+                self.detector.journal = None
+                self.series_journal.close(self.detector.series)
+                series_id = self.series_journal.series_id
+                self.series_journal = None
+
+            if self.landmark_recorder:
+                self.detector.recorder = None
+                self.landmark_recorder.save()
+                self.landmark_recorder = None
+
             if self.video_writer:
-                self.video_writer.release()
+                stats = self.video_writer.close()
                 self.video_writer = None
+                print(
+                    f"Video: {stats['fps']} FPS, {stats['frames_written']} frames "
+                    f"({stats['duplicated']} duplicated, "
+                    f"{stats['dropped_ahead'] + stats['dropped_queue']} dropped)"
+                )
                 messagebox.showinfo(
                     "Evidence Saved", "Video recording saved to 'recordings/' folder."
                 )
@@ -349,12 +433,13 @@ class RehabApp:
             self.btn_stop.config(state="disabled", bg="#95a5a6")
 
             data = self.detector.session_data
-            history = self.detector.angle_history
+            series = self.detector.series
             p_name = self.patient_name.get()
             ex_name = self.current_exercise.get()
 
             # ROM% & fatigue (dựa trên auto-calib)
             rom_score, fatigue_flag = self.detector.compute_rom_and_fatigue(ex_name)
+            calib_min, calib_max = self.detector.calibrated_range(ex_name)
 
             if data["reps"] > 0:
                 utils.log_session(
@@ -365,8 +450,28 @@ class RehabApp:
                     data["max_angle"],
                     rom_score=rom_score,
                     fatigue_flag=fatigue_flag,
+                    model_switches=self.detector.model_switches,
+                    rep_records=self.detector.rep_records,
+                    metrics=self.detector.metrics.snapshot(buckets=True),
+                    series_id=series_id,
+                    calib_min=calib_min,
+                    calib_max=calib_max,
+                    duration_s=series.duration,
                 )
 
+                # Vẽ chart ở thread nền ngay (trong lúc hộp thoại đang mở)
+                self.last_chart = {
+                    "session_id": series_id or f"{p_name}|{ex_name}|{time.time()}",
+                    "t": series.t - series.t_first,
+                    "angle": series.angle.copy(),
+                    "exercise_name": ex_name,
+                    "patient_name": p_name,
+                    "thresholds": self.detector.current_thresholds(ex_name),
+                    "calib": (calib_min, calib_max),
+                }
+                chart.render_cached(**self.last_chart)
+                self.btn_chart.config(state="normal")
+
                 extra = ""
                 if rom_score is not None:
                     extra += f"\nROM: {rom_score:.1f}%"
@@ -378,85 +483,147 @@ class RehabApp:
                     f"Session Finished.\nReps: {data['reps']}{extra}\n\nView Analysis Chart?"
                 )
                 if ans:
-                    utils.show_performance_chart(history, ex_name, p_name)
+                    self.show_last_chart()
             else:
                 messagebox.showinfo("Info", "No reps recorded.")
 
             # Quay lại idle screen
             self.show_idle_screen()
 
+    def show_last_chart(self):
+        if self.last_chart:
+            utils.show_performance_chart(self.root, **self.last_chart)
+
+    @staticmethod
+    def feedback_color(fb_text):
+        """Màu chữ feedback (cache theo text, chỉ dò chuỗi 1 lần cho mỗi câu)."""
+        color = _FEEDBACK_COLORS.get(fb_text)
+        if color is not None:
+            return color
+        if "Good" in fb_text or "Perfect" in fb_text:
+            color = "#20bf6b"
+        elif "Ready" in fb_text:
+            color = "#f7b731"
+        elif (
+            "Adjust" in fb_text
+            or "Missing" in fb_text
+            or "Lost" in fb_text
+            or "LOST" in fb_text
+        ):
+            color = "#ff0000"
+        else:
+            color = "#eb3b5a"
+        _FEEDBACK_COLORS[fb_text] = color
+        return color
+
+    def toggle_debug_overlay(self, event=None):
+        self.show_debug = not self.show_debug
+
+    def _draw_debug(self, frame):
+        """Latency p50/p95 theo stage + bộ đếm (làm mới 2 lần/giây)."""
+        now = time.time()
+        if now - self._debug_refresh > 0.5:
+            self._debug_lines = self.detector.metrics.overlay_lines()
+            self._debug_refresh = now
+        y = frame.shape[0] - 12 - 20 * (len(self._debug_lines) - 1)
+        for line in self._debug_lines:
+            cv2.putText(
+                frame, line, (20, y), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 1
+            )
+            y += 20
+
+    def _set_label(self, label, key, **options):
+        """Chỉ gọi config khi giá trị thật sự đổi (tránh redraw Tk thừa)."""
+        if self._label_state.get(key) != options:
+            self._label_state[key] = options
+            label.config(**options)
+
     def update_frame(self):
-        if self.is_running and self.cap.isOpened():
-            ret, frame = self.cap.read()
-            if ret:
-                try:
-                    frame = cv2.resize(frame, (800, 600))
-
-                    curr_time = time.time()
-                    dt = curr_time - self.prev_time
-                    fps = 1 / dt if dt > 0 else 0
-                    self.prev_time = curr_time
-                    self.fps_avg = 0.9 * self.fps_avg + 0.1 * fps
-
-                    processed_frame, data, angle = self.detector.process_frame(
-                        frame, self.current_exercise.get()
-                    )
+        if not (self.is_running and self.pipeline):
+            return
 
-                    # FPS
-                    cv2.putText(
-                        processed_frame,
-                        f"FPS: {int(self.fps_avg)}",
-                        (20, 40),
-                        cv2.FONT_HERSHEY_SIMPLEX,
-                        0.8,
-                        (0, 255, 0),
-                        2,
-                    )
+        result = self.pipeline.get_latest()
+        if result is not None:
+            try:
+                t0 = time.perf_counter()
+                processed_frame = result["frame"]
+                data = result["data"]
+                angle = result["angle"]
+                self.fps_avg = result["fps"]
+
+                # FPS + chi phí hiển thị của frame trước
+                cv2.putText(
+                    processed_frame,
+                    f"FPS: {int(self.fps_avg)} | UI {self.display_ms:.1f} ms",
+                    (20, 40),
+                    cv2.FONT_HERSHEY_SIMPLEX,
+                    0.8,
+                    (0, 255, 0),
+                    2,
+                )
 
-                    # REPS overlay
+                # REPS overlay (frame là RGB -> vàng = (255, 255, 0))
+                cv2.putText(
+                    processed_frame,
+                    f"REPS: {data['reps']}",
+                    (20, 80),
+                    cv2.FONT_HERSHEY_SIMPLEX,
+                    0.9,
+                    (255, 255, 0),
+                    2,
+                )
+                if data.get("fatigue"):
                     cv2.putText(
                         processed_frame,
-                        f"REPS: {data['reps']}",
-                        (20, 80),
+                        f"FATIGUE: {data['fatigue']}",
+                        (20, 115),
                         cv2.FONT_HERSHEY_SIMPLEX,
-                        0.9,
-                        (0, 255, 255),
+                        0.7,
+                        (255, 255, 0),
                         2,
                     )
 
-                    if self.video_writer:
-                        self.video_writer.write(processed_frame)
-
-                    # Đồng bộ label bên trái
-                    self.lbl_reps.config(text=str(data["reps"]))
-
-                    fb_text = data["feedback"]
-                    if "Good" in fb_text or "Perfect" in fb_text:
-                        color = "#20bf6b"
-                    elif "Ready" in fb_text:
-                        color = "#f7b731"
-                    elif (
-                        "Adjust" in fb_text
-                        or "Missing" in fb_text
-                        or "Lost" in fb_text
-                        or "LOST" in fb_text
-                    ):
-                        color = "#ff0000"
-                    else:
-                        color = "#eb3b5a"
+                if self.show_debug:
+                    self._draw_debug(processed_frame)
 
-                    self.lbl_feedback.config(text=fb_text, fg=color)
-                    self.lbl_angle.config(text=f"Joint Angle: {angle}°")
-
-                    img_rgb = cv2.cvtColor(processed_frame, cv2.COLOR_BGR2RGB)
-                    img_tk = ImageTk.PhotoImage(image=Image.fromarray(img_rgb))
-                    self.video_label.imgtk = img_tk
-                    self.video_label.configure(image=img_tk)
-
-                except Exception as e:
-                    print(f"Frame Error: {e}")
+                # Đồng bộ label bên trái (chỉ khi session_data đổi)
+                fb_text = data["feedback"]
+                self._set_label(self.lbl_reps, "reps", text=str(data["reps"]))
+                self._set_label(
+                    self.lbl_feedback, "feedback",
+                    text=fb_text, fg=self.feedback_color(fb_text),
+                )
+                self._set_label(self.lbl_angle, "angle", text=f"Joint Angle: {angle}°")
+
+                # Vẽ vào PhotoImage cố định: Image.frombuffer dùng chung bộ nhớ
+                # với buffer RGB, paste() copy thẳng vào ảnh Tk đang hiển thị
+                h, w = processed_frame.shape[:2]
+                img = Image.frombuffer("RGB", (w, h), processed_frame, "raw", "RGB", 0, 1)
+                if self.video_photo is None or self.video_photo.width() != w \
+                        or self.video_photo.height() != h:
+                    self.video_photo = ImageTk.PhotoImage("RGB", (w, h))
+                    self.video_label.imgtk = self.video_photo
+                    self.video_label.configure(image=self.video_photo)
+                self.video_photo.paste(img)
+
+                dt = time.perf_counter() - t0
+                self.display_ms = 0.9 * self.display_ms + 0.1 * (1000.0 * dt)
+                metrics = self.detector.metrics
+                metrics.record("display", dt)
+                metrics.record("capture_to_display", time.time() - result["t_capture"])
+
+            except Exception as e:
+                print(f"Frame Error: {e}")
+                self.detector.metrics.exception("display", e)
+
+            # Buffer: chuyển cho writer (writer tự trả) hoặc trả về pool
+            if self.video_writer:
+                self.video_writer.write(result["frame"], result["t_capture"])
+            else:
+                self.pipeline.release(result["frame"])
 
-            self.root.after(10, self.update_frame)
+        # Tk chỉ lấy kết quả mới nhất, không chờ camera/model
+        self.root.after(10, self.update_frame)
 
     def on_close(self):
         if self.is_running:
@@ -465,6 +632,9 @@ class RehabApp:
 
 
 if __name__ == "__main__":
+    # Migrate schema 1 lần lúc khởi động (các lần ghi sau chạy ở thread nền)
+    if utils.init_db():
+        mark_interrupted()
     root = tk.Tk()
     app = RehabApp(root)
     root.protocol("WM_DELETE_WINDOW", app.on_close)
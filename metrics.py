@@ -0,0 +1,175 @@
+"""
+Đo đạc luôn bật cho đường nóng: histogram latency theo stage + bộ đếm sự kiện.
+
+Histogram có số bucket cố định (chia log, 4 bucket mỗi lần gấp đôi, ~19% độ
+rộng) từ 10 µs tới ~100 s -> ghi 1 mẫu là O(1), không cấp phát, bộ nhớ không
+tăng theo thời gian chạy. Percentile đọc ra là cận trên của bucket.
+
+Mỗi stage chỉ nên được ghi từ 1 thread (capture / inference / Tk); bộ đếm thì
+có khóa vì nhiều thread cùng đếm (vd. frame bị bỏ ở các queue).
+
+    from metrics import METRICS
+    t0 = time.perf_counter()
+    ...
+    METRICS.record("model", time.perf_counter() - t0)
+    METRICS.count("lost_tracking")
+"""
+import json
+import math
+import threading
+import time
+from collections import deque
+
+
+class LatencyHistogram:
+    MIN_S = 1e-5
+    STEPS_PER_OCTAVE = 4
+    N_BUCKETS = 96  # 10 µs * 2^(95/4) ~ 140 s
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * self.N_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    @classmethod
+    def bucket_upper(cls, i):
+        """Cận trên (giây) của bucket i; bucket 0 = mọi giá trị <= MIN_S."""
+        return cls.MIN_S * 2.0 ** (i / cls.STEPS_PER_OCTAVE)
+
+    def record(self, seconds):
+        if seconds <= self.MIN_S:
+            i = 0
+        else:
+            i = int(math.log2(seconds / self.MIN_S) * self.STEPS_PER_OCTAVE) + 1
+            if i >= self.N_BUCKETS:
+                i = self.N_BUCKETS - 1
+        self.counts[i] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        """Percentile p (0-100) theo giây, None nếu chưa có mẫu."""
+        if not self.count:
+            return None
+        target = p / 100.0 * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if c and seen >= target:
+                return min(self.bucket_upper(i), self.max)
+        return self.max
+
+    def summary(self):
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean_ms": 1000.0 * self.total / self.count,
+            "p50_ms": 1000.0 * self.percentile(50),
+            "p95_ms": 1000.0 * self.percentile(95),
+            "p99_ms": 1000.0 * self.percentile(99),
+            "max_ms": 1000.0 * self.max,
+        }
+
+    def buckets(self):
+        """Bucket khác 0: [(cận trên ms, số mẫu)] (để xuất / gộp lại sau)."""
+        return [
+            (round(1000.0 * self.bucket_upper(i), 4), c)
+            for i, c in enumerate(self.counts)
+            if c
+        ]
+
+
+class Metrics:
+    """Histogram theo tên stage + bộ đếm + vài exception gần nhất."""
+    # Thứ tự hiển thị trên overlay (stage khác xếp sau)
+    OVERLAY_STAGES = ("preprocess", "inference", "model", "analysis", "display",
+                      "capture_to_display")
+
+    def __init__(self, max_errors=20):
+        self._lock = threading.Lock()
+        self.max_errors = max_errors
+        self.reset()
+
+    def reset(self):
+        self.histograms = {}
+        self.counters = {}
+        self.errors = deque(maxlen=self.max_errors)
+        self.started = time.time()
+
+    def histogram(self, stage):
+        h = self.histograms.get(stage)
+        if h is None:
+            h = self.histograms.setdefault(stage, LatencyHistogram())
+        return h
+
+    def record(self, stage, seconds):
+        self.histogram(stage).record(seconds)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def exception(self, where, exc):
+        """Đếm exception bị nuốt ở `where` và giữ lại thông điệp."""
+        with self._lock:
+            self.counters["exceptions"] = self.counters.get("exceptions", 0) + 1
+            key = f"exceptions.{where}"
+            self.counters[key] = self.counters.get(key, 0) + 1
+            self.errors.append(
+                {
+                    "time": time.strftime("%H:%M:%S"),
+                    "where": where,
+                    "error": f"{type(exc).__name__}: {exc}",
+                }
+            )
+
+    def snapshot(self, buckets=False):
+        """Dict JSON được: tóm tắt từng stage, bộ đếm, exception gần nhất."""
+        stages = {}
+        for name, h in list(self.histograms.items()):
+            stages[name] = h.summary()
+            if buckets:
+                stages[name]["buckets"] = h.buckets()
+        with self._lock:
+            counters = dict(self.counters)
+            errors = list(self.errors)
+        return {
+            "uptime_s": time.time() - self.started,
+            "stages": stages,
+            "counters": counters,
+            "errors": errors,
+        }
+
+    def dump(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(buckets=True), f, indent=2)
+
+    def overlay_lines(self):
+        """Vài dòng ngắn cho debug overlay."""
+        names = [s for s in self.OVERLAY_STAGES if s in self.histograms]
+        names += sorted(s for s in self.histograms if s not in self.OVERLAY_STAGES)
+        lines = []
+        for name in names:
+            h = self.histograms[name]
+            if h.count:
+                lines.append(
+                    f"{name}: p50 {1000 * h.percentile(50):.1f} "
+                    f"p95 {1000 * h.percentile(95):.1f} ms"
+                )
+        c = self.counters
+        lines.append(
+            f"dropped {c.get('dropped_frames', 0)} | lost {c.get('lost_tracking', 0)}"
+            f" | no pose {c.get('no_pose', 0)} | exc {c.get('exceptions', 0)}"
+        )
+        return lines
+
+
+# Instance mặc định dùng chung (GUI / batch); đa luồng thì mỗi stream 1 instance
+METRICS = Metrics()
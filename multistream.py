@@ -0,0 +1,337 @@
+"""
+Chế độ nhiều trạm tập: 1 máy phục vụ N camera cùng lúc.
+
+Ví dụ:
+    python multistream.py 0 1 2 --exercise Squat --workers 2
+    python multistream.py cam0.avi cam1.avi --exercise Lunges --headless
+
+Mỗi stream có RehabSession riêng (reps, calib, filter...). Pose chạy trên
+một pool giới hạn gồm --workers model; stream được gán cố định vào 1 worker
+(stream_id % workers). Worker chỉ phục vụ 1 stream thì giữ tracking của
+MediaPipe, worker dùng chung cho nhiều stream chạy static_image_mode.
+FPS và độ sâu queue theo từng stream được in ra định kỳ để ước lượng phần cứng.
+"""
+import argparse
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from exercises import exercise_names
+from metrics import Metrics
+from pipeline import CaptureThread, LatestQueue
+from pose_module import PoseModel, RehabSession
+import utils
+
+
+def open_capture(source):
+    """'0' -> webcam index 0, còn lại coi là đường dẫn / URL."""
+    if isinstance(source, str) and source.isdigit():
+        source = int(source)
+    cap = cv2.VideoCapture(source)
+    if isinstance(source, int):
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    return cap
+
+
+class Stream:
+    """1 camera + session riêng + thống kê."""
+    def __init__(self, stream_id, source, exercise, patient, size=(640, 480)):
+        self.stream_id = stream_id
+        self.source = source
+        self.exercise = exercise
+        self.patient = patient
+        self.cap = open_capture(source)
+        self.metrics = Metrics()
+        self.frames = LatestQueue(maxsize=1)
+        self.capture = CaptureThread(
+            self.cap, self.frames, size=size, stop_on_eof=not str(source).isdigit(),
+            metrics=self.metrics,
+        )
+
+        self.session = RehabSession()
+        self.session.sound_enabled = False
+        self.session.metrics = self.metrics
+        self.results = LatestQueue(maxsize=1)
+
+        # Mỗi lúc chỉ 1 frame của stream được xử lý (state tuần tự)
+        self.in_flight = False
+        self.processed = 0
+        self.fps_avg = 0.0
+        self.latency_avg = 0.0
+        self._prev_time = None
+
+    def on_result(self, image, angle, t_capture):
+        now = time.time()
+        if self._prev_time is not None:
+            dt = now - self._prev_time
+            fps = 1 / dt if dt > 0 else 0
+            self.fps_avg = 0.9 * self.fps_avg + 0.1 * fps
+        self._prev_time = now
+        self.latency_avg = 0.9 * self.latency_avg + 0.1 * (now - t_capture)
+        self.metrics.record("capture_to_result", now - t_capture)
+        self.processed += 1
+        self.results.put(
+            {"frame": image, "data": dict(self.session.session_data), "angle": angle}
+        )
+        self.in_flight = False
+
+    def queue_depth(self):
+        return self.frames.qsize() + (1 if self.in_flight else 0)
+
+
+class PoseWorker(threading.Thread):
+    """1 PoseModel + 1 queue task có giới hạn."""
+    def __init__(self, worker_id, shared, model_complexity=1):
+        super().__init__(daemon=True)
+        self.worker_id = worker_id
+        self.tasks = queue.Queue(maxsize=2)
+        self.model = PoseModel(
+            model_complexity=model_complexity, static_image_mode=shared
+        )
+        self.stop_event = threading.Event()
+        self.busy_time = 0.0
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                stream, frame, t_capture = self.tasks.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+            t0 = time.perf_counter()
+            try:
+                image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                image.flags.writeable = False
+                results = self.model.process(image)
+                t1 = time.perf_counter()
+                stream.metrics.record("model", t1 - t0)
+                angle = stream.session.analyze(
+                    frame, results, stream.exercise, timestamp=t_capture
+                )
+                stream.metrics.record("analysis", time.perf_counter() - t1)
+            except Exception as e:
+                print(f"[stream {stream.stream_id}] Frame Error: {e}")
+                stream.metrics.exception("inference", e)
+                stream.in_flight = False
+                continue
+            finally:
+                self.busy_time += time.perf_counter() - t0
+
+            stream.on_result(frame, angle, t_capture)
+
+    def stop(self):
+        self.stop_event.set()
+
+
+class MultiStreamRunner:
+    def __init__(self, sources, exercises, patients, workers=2, model_complexity=1,
+                 size=(640, 480)):
+        self.streams = [
+            Stream(i, src, exercises[i], patients[i], size=size)
+            for i, src in enumerate(sources)
+        ]
+        workers = max(1, min(workers, len(self.streams)))
+        self.workers = []
+        for w in range(workers):
+            served = [s for s in self.streams if s.stream_id % workers == w]
+            self.workers.append(
+                PoseWorker(w, shared=len(served) > 1, model_complexity=model_complexity)
+            )
+        self.stop_event = threading.Event()
+        self.scheduler = threading.Thread(target=self._schedule, daemon=True)
+        self.t_start = None
+
+    def _worker_for(self, stream):
+        return self.workers[stream.stream_id % len(self.workers)]
+
+    def _schedule(self):
+        """Round-robin: gửi frame mới nhất của stream rảnh sang worker của nó."""
+        while not self.stop_event.is_set():
+            submitted = False
+            for stream in self.streams:
+                if stream.in_flight:
+                    continue
+                item = stream.frames.get_latest()
+                if item is None:
+                    continue
+                frame, t_capture = item
+                stream.in_flight = True
+                try:
+                    self._worker_for(stream).tasks.put(
+                        (stream, frame, t_capture), timeout=0.5
+                    )
+                    submitted = True
+                except queue.Full:
+                    stream.in_flight = False
+                    stream.frames.dropped += 1
+            if not submitted:
+                time.sleep(0.002)
+
+    def start(self):
+        for s in self.streams:
+            if not s.cap.isOpened():
+                print(f"[stream {s.stream_id}] Cannot open source {s.source}")
+                continue
+            s.capture.start()
+        for w in self.workers:
+            w.start()
+        self.scheduler.start()
+        self.t_start = time.time()
+
+    def stop(self):
+        self.stop_event.set()
+        for s in self.streams:
+            s.capture.stop()
+        for w in self.workers:
+            w.stop()
+        for s in self.streams:
+            if s.capture.is_alive():
+                s.capture.join(2.0)
+            s.cap.release()
+        for w in self.workers:
+            w.join(2.0)
+
+    def report(self):
+        """Thống kê theo stream + mức bận của từng worker."""
+        elapsed = max(time.time() - (self.t_start or time.time()), 1e-6)
+        streams = [
+            {
+                "stream": s.stream_id,
+                "fps": round(s.fps_avg, 1),
+                "latency_ms": round(1000 * s.latency_avg, 1),
+                "queue_depth": s.queue_depth(),
+                "dropped": s.frames.dropped,
+                "processed": s.processed,
+                "reps": s.session.session_data["reps"],
+            }
+            for s in self.streams
+        ]
+        workers = [
+            {
+                "worker": w.worker_id,
+                "queue_depth": w.tasks.qsize(),
+                "utilization": round(w.busy_time / elapsed, 2),
+            }
+            for w in self.workers
+        ]
+        return {"streams": streams, "workers": workers}
+
+    def log_sessions(self):
+        for s in self.streams:
+            data = s.session.session_data
+            if data["reps"] <= 0:
+                continue
+            rom_score, fatigue_flag = s.session.compute_rom_and_fatigue(s.exercise)
+            calib_min, calib_max = s.session.calibrated_range(s.exercise)
+            utils.log_session(
+                s.patient,
+                s.exercise,
+                data["reps"],
+                data["min_angle"],
+                data["max_angle"],
+                rom_score=rom_score,
+                fatigue_flag=fatigue_flag,
+                rep_records=s.session.rep_records,
+                metrics=s.metrics.snapshot(buckets=True),
+                calib_min=calib_min,
+                calib_max=calib_max,
+                duration_s=s.session.series.duration,
+            )
+
+    def compose_grid(self, tile=(480, 360)):
+        """Ghép frame mới nhất của các stream thành 1 ảnh lưới."""
+        tiles = []
+        for s in self.streams:
+            result = s.results.get_latest()
+            if result is not None:
+                s.last_tile = cv2.resize(result["frame"], tile)
+            img = getattr(s, "last_tile", None)
+            if img is None:
+                img = np.zeros((tile[1], tile[0], 3), dtype=np.uint8)
+            img = img.copy()
+            cv2.putText(
+                img,
+                f"#{s.stream_id} {s.exercise} | REPS {s.session.session_data['reps']}"
+                f" | FPS {int(s.fps_avg)} | Q {s.queue_depth()}",
+                (10, 25),
+                cv2.FONT_HERSHEY_SIMPLEX,
+                0.55,
+                (0, 255, 255),
+                2,
+            )
+            tiles.append(img)
+
+        cols = int(np.ceil(np.sqrt(len(tiles))))
+        while len(tiles) % cols:
+            tiles.append(np.zeros_like(tiles[0]))
+        rows = [np.hstack(tiles[i:i + cols]) for i in range(0, len(tiles), cols)]
+        return np.vstack(rows)
+
+
+def print_report(report):
+    for s in report["streams"]:
+        print(f"[stream {s['stream']}] fps {s['fps']:5.1f} | latency {s['latency_ms']:6.1f} ms"
+              f" | queue {s['queue_depth']} | dropped {s['dropped']} | reps {s['reps']}")
+    for w in report["workers"]:
+        print(f"  [worker {w['worker']}] queue {w['queue_depth']} | busy {w['utilization']:.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run several exercise stations on one machine")
+    parser.add_argument("sources", nargs="+", help="Camera indices or video files")
+    parser.add_argument("--exercise", action="append",
+                        choices=exercise_names(),
+                        help="One per stream, or a single value for all")
+    parser.add_argument("--patient", action="append",
+                        help="One per stream, or a single name for all (suffixed _1, _2, ...)")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--model-complexity", type=int, default=1, choices=[0, 1, 2])
+    parser.add_argument("--report-seconds", type=float, default=5.0)
+    parser.add_argument("--headless", action="store_true")
+    args = parser.parse_args()
+
+    n = len(args.sources)
+    exercises = args.exercise or ["Bicep Curl"]
+    if len(exercises) == 1:
+        exercises = exercises * n
+    patients = args.patient or [f"Station_{i + 1}" for i in range(n)]
+    if len(patients) == 1 and n > 1:
+        # 1 tên cho mọi trạm -> thêm hậu tố để session của từng trạm tách biệt
+        patients = [f"{patients[0]}_{i + 1}" for i in range(n)]
+    if len(exercises) != n or len(patients) != n:
+        parser.error("--exercise / --patient must be given once or once per source")
+
+    runner = MultiStreamRunner(
+        args.sources, exercises, patients,
+        workers=args.workers, model_complexity=args.model_complexity,
+    )
+    runner.start()
+    next_report = time.time() + args.report_seconds
+    try:
+        while True:
+            if args.headless:
+                time.sleep(0.05)
+                if not any(s.capture.is_alive() for s in runner.streams):
+                    break
+            else:
+                cv2.imshow("Rehab Stations", runner.compose_grid())
+                if cv2.waitKey(15) & 0xFF == ord("q"):
+                    break
+            if time.time() >= next_report:
+                print_report(runner.report())
+                next_report = time.time() + args.report_seconds
+    except KeyboardInterrupt:
+        pass
+    finally:
+        runner.stop()
+        print_report(runner.report())
+        runner.log_sessions()
+        if not args.headless:
+            cv2.destroyAllWindows()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,393 @@
+import queue
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+from metrics import METRICS
+
+
+class LatestQueue:
+    """
+    Queue có giới hạn, khi đầy thì bỏ phần tử cũ nhất.
+    Dùng giữa các stage để luôn xử lý frame mới nhất (không dồn frame cũ).
+    """
+    def __init__(self, maxsize=1, on_drop=None):
+        self._q = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+        # Callback cho phần tử bị bỏ (trả buffer về pool)
+        self.on_drop = on_drop
+
+    def _drop(self, item):
+        self.dropped += 1
+        if self.on_drop is not None:
+            self.on_drop(item)
+
+    def put(self, item):
+        while True:
+            try:
+                self._q.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self._drop(self._q.get_nowait())
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):
+        """Chờ tối đa `timeout` giây, trả về None nếu không có gì."""
+        try:
+            return self._q.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def get_latest(self):
+        """Lấy phần tử mới nhất (non-blocking), bỏ qua các phần tử cũ hơn."""
+        item = None
+        while True:
+            try:
+                newer = self._q.get_nowait()
+            except queue.Empty:
+                return item
+            if item is not None:
+                self._drop(item)
+            item = newer
+
+    def qsize(self):
+        return self._q.qsize()
+
+
+class FrameBufferPool:
+    """
+    Pool buffer ảnh dùng lại giữa các frame (tránh cấp phát mỗi frame).
+    Mỗi buffer có đúng 1 chủ tại 1 thời điểm: stage nhận buffer phải
+    release() khi xong hoặc chuyển tiếp cho stage sau.
+    """
+    def __init__(self, shape, dtype=np.uint8, max_free=8):
+        self.shape = shape
+        self.dtype = dtype
+        self.max_free = max_free
+        self._free = deque()
+        self.allocated = 0
+
+    def acquire(self):
+        try:
+            return self._free.pop()
+        except IndexError:
+            self.allocated += 1
+            return np.empty(self.shape, dtype=self.dtype)
+
+    def release(self, buf):
+        if buf is not None and len(self._free) < self.max_free:
+            self._free.append(buf)
+
+
+class CaptureThread(threading.Thread):
+    """
+    Stage 1: đọc camera + resize, đẩy (frame, timestamp) vào queue.
+    stop_on_eof=True cho nguồn là file video (hết file thì dừng thread).
+
+    Có `rgb_pool`: resize vào buffer scratch rồi đổi BGR->RGB 1 lần duy nhất
+    vào buffer của pool -> các stage sau dùng thẳng RGB, không convert lại.
+    Thời gian resize + đổi màu ghi vào histogram "preprocess".
+    """
+    def __init__(self, cap, out_queue, size=(800, 600), stop_on_eof=False, rgb_pool=None,
+                 metrics=None):
+        super().__init__(daemon=True)
+        self.cap = cap
+        self.out_queue = out_queue
+        self.size = size
+        self.stop_on_eof = stop_on_eof
+        self.rgb_pool = rgb_pool
+        self.stop_event = threading.Event()
+        self.frames_read = 0
+        self.metrics = METRICS if metrics is None else metrics
+        self._scratch = None
+
+    def run(self):
+        while not self.stop_event.is_set():
+            ret, frame = self.cap.read()
+            if not ret:
+                if self.stop_on_eof:
+                    break
+                time.sleep(0.005)
+                continue
+            t_capture = time.time()
+            t0 = time.perf_counter()
+            if self.rgb_pool is not None:
+                if self._scratch is None:
+                    w, h = self.size
+                    self._scratch = np.empty((h, w, 3), dtype=np.uint8)
+                cv2.resize(frame, self.size, dst=self._scratch)
+                frame = self.rgb_pool.acquire()
+                cv2.cvtColor(self._scratch, cv2.COLOR_BGR2RGB, dst=frame)
+            else:
+                frame = cv2.resize(frame, self.size)
+            self.metrics.record("preprocess", time.perf_counter() - t0)
+            self.frames_read += 1
+            self.out_queue.put((frame, t_capture))
+
+    def stop(self):
+        self.stop_event.set()
+
+
+class InferenceWorker(threading.Thread):
+    """
+    Stage 2: chạy RehabDetector trên frame mới nhất, đẩy kết quả sang Tk.
+    Có `pool`: frame vào là RGB, HUD vẽ thẳng lên buffer đó (không copy).
+    """
+    def __init__(self, detector, in_queue, out_queue, exercise_type, pool=None):
+        super().__init__(daemon=True)
+        self.detector = detector
+        self.in_queue = in_queue
+        self.out_queue = out_queue
+        self.exercise_type = exercise_type
+        self.pool = pool
+        self.stop_event = threading.Event()
+        self.fps_avg = 0.0
+        self._prev_time = None
+
+    def run(self):
+        while not self.stop_event.is_set():
+            item = self.in_queue.get(timeout=0.1)
+            if item is None:
+                continue
+            frame, t_capture = item
+
+            now = time.time()
+            if self._prev_time is not None:
+                dt = now - self._prev_time
+                fps = 1 / dt if dt > 0 else 0
+                self.fps_avg = 0.9 * self.fps_avg + 0.1 * fps
+            self._prev_time = now
+
+            try:
+                if self.pool is not None:
+                    processed_frame, data, angle = self.detector.process_rgb(
+                        frame, self.exercise_type, timestamp=t_capture
+                    )
+                else:
+                    processed_frame, data, angle = self.detector.process_frame(
+                        frame, self.exercise_type, timestamp=t_capture
+                    )
+            except Exception as e:
+                print(f"Frame Error: {e}")
+                self.detector.metrics.exception("inference", e)
+                if self.pool is not None:
+                    self.pool.release(frame)
+                continue
+
+            # Copy session_data để Tk thread đọc an toàn
+            self.out_queue.put(
+                {
+                    "frame": processed_frame,
+                    "data": dict(data),
+                    "angle": angle,
+                    "t_capture": t_capture,
+                    "fps": self.fps_avg,
+                }
+            )
+
+    def stop(self):
+        self.stop_event.set()
+
+
+class FramePipeline:
+    """
+    Capture thread -> inference worker -> Tk consumer, nối bằng LatestQueue.
+
+    Tk thread chỉ gọi `get_latest()` trong vòng `root.after`, không bao giờ
+    chờ camera hay model.
+
+    Frame đi qua pipeline là 1 buffer RGB lấy từ pool (đổi màu 1 lần ở
+    capture). Consumer nhận frame phải trả lại bằng `release()` hoặc chuyển
+    cho AsyncVideoWriter (writer tự trả sau khi encode).
+
+    Metrics dùng chung với detector: frame bị bỏ ở 2 queue được đếm vào
+    "dropped_frames".
+    """
+    def __init__(self, cap, detector, exercise_type, size=(800, 600)):
+        w, h = size
+        self.pool = FrameBufferPool((h, w, 3))
+        self.metrics = detector.metrics
+        self.capture_queue = LatestQueue(maxsize=1, on_drop=self._drop_capture)
+        self.result_queue = LatestQueue(maxsize=2, on_drop=self._drop_result)
+        self.capture = CaptureThread(
+            cap, self.capture_queue, size=size, rgb_pool=self.pool,
+            metrics=self.metrics,
+        )
+        self.worker = InferenceWorker(
+            detector, self.capture_queue, self.result_queue, exercise_type,
+            pool=self.pool,
+        )
+
+    def _drop_capture(self, item):
+        self.metrics.count("dropped_frames")
+        self.pool.release(item[0])
+
+    def _drop_result(self, result):
+        self.metrics.count("dropped_frames")
+        self.pool.release(result["frame"])
+
+    def set_exercise(self, exercise_type):
+        self.worker.exercise_type = exercise_type
+
+    def start(self):
+        self.capture.start()
+        self.worker.start()
+
+    def stop(self, timeout=2.0):
+        self.capture.stop()
+        self.worker.stop()
+        self.capture.join(timeout)
+        self.worker.join(timeout)
+
+    def get_latest(self):
+        return self.result_queue.get_latest()
+
+    def release(self, frame):
+        self.pool.release(frame)
+
+    @property
+    def dropped_frames(self):
+        return self.capture_queue.dropped + self.result_queue.dropped
+
+
+class AsyncVideoWriter(threading.Thread):
+    """
+    Ghi video bằng chứng ở thread nền, không chặn vòng feedback.
+
+    - Queue giới hạn `max_queue` frame; khi đầy bỏ frame CŨ NHẤT (đếm vào
+      `dropped_queue`), chỗ trống được lấp bằng frame trước ở bước dưới.
+    - FPS file = FPS đo từ timestamp capture trong `calib_seconds` đầu, tối
+      đa `max_pending` frame (frame chờ đo FPS nằm ngoài pool -> giữ ít).
+    - Mỗi frame được đặt vào slot round((t - t0) * fps): thiếu slot thì lặp
+      frame trước (`duplicated`), trùng slot thì bỏ (`dropped_ahead`)
+      -> thời gian video khớp thời gian thực.
+    - rgb_input=True: frame RGB được đổi sang BGR ngay trong thread này
+      (2 buffer xoay vòng), rồi trả buffer gốc qua `release`.
+    """
+    def __init__(self, filename, size, fourcc="XVID", max_queue=64,
+                 calib_seconds=2.0, max_pending=10, min_fps=5.0, max_fps=60.0,
+                 max_gap_seconds=5.0, rgb_input=False, release=None):
+        super().__init__(daemon=True)
+        self.filename = filename
+        self.size = size
+        self.fourcc = cv2.VideoWriter_fourcc(*fourcc)
+        self.rgb_input = rgb_input
+        self.release = release
+        self.queue = LatestQueue(maxsize=max_queue, on_drop=self._on_drop)
+        w, h = size
+        self._bgr = [np.empty((h, w, 3), dtype=np.uint8) for _ in range(2)]
+        self._bgr_idx = 0
+        self.calib_seconds = calib_seconds
+        self.max_pending = max(int(max_pending), 2)
+        self.min_fps = min_fps
+        self.max_fps = max_fps
+        self.max_gap_seconds = max_gap_seconds
+        self.stop_event = threading.Event()
+
+        self.fps = None
+        self.frames_written = 0
+        self.duplicated = 0
+        self.dropped_ahead = 0
+
+        self._writer = None
+        self._pending = []  # frame chờ trong lúc đo FPS
+        self._t0 = None
+        self._next_slot = 0
+        self._last_frame = None
+
+    def _on_drop(self, item):
+        if self.release:
+            self.release(item[0])
+
+    def write(self, frame, t_capture):
+        """Gọi từ vòng UI: chỉ đẩy vào queue, không encode."""
+        self.queue.put((frame, t_capture))
+
+    @property
+    def dropped_queue(self):
+        return self.queue.dropped
+
+    def run(self):
+        while not self.stop_event.is_set() or self.queue.qsize():
+            item = self.queue.get(timeout=0.1)
+            if item is None:
+                continue
+            frame, t_capture = item
+            if self._writer is None:
+                self._pending.append(item)
+                t_first = self._pending[0][1]
+                if (t_capture - t_first >= self.calib_seconds
+                        or len(self._pending) >= self.max_pending):
+                    self._open()
+                continue
+            self._encode(frame, t_capture)
+
+        # Session ngắn hơn calib_seconds: mở với FPS đo được từ phần đã có
+        if self._writer is None and self._pending:
+            self._open()
+        if self._writer is not None:
+            self._writer.release()
+
+    def _open(self):
+        t_first = self._pending[0][1]
+        t_last = self._pending[-1][1]
+        if len(self._pending) > 1 and t_last > t_first:
+            fps = (len(self._pending) - 1) / (t_last - t_first)
+        else:
+            fps = 20.0
+        self.fps = float(min(max(round(fps), self.min_fps), self.max_fps))
+        self._writer = cv2.VideoWriter(self.filename, self.fourcc, self.fps, self.size)
+        self._t0 = t_first
+
+        pending, self._pending = self._pending, []
+        for frame, t_capture in pending:
+            self._encode(frame, t_capture)
+
+    def _encode(self, frame, t_capture):
+        slot = int(round((t_capture - self._t0) * self.fps))
+        if slot < self._next_slot:
+            # Frame tới sớm hơn slot kế tiếp -> bỏ để không kéo dài video
+            self.dropped_ahead += 1
+            if self.release:
+                self.release(frame)
+            return
+
+        if self.rgb_input:
+            # Buffer khác với _last_frame (còn dùng để lặp frame)
+            src = frame
+            frame = self._bgr[self._bgr_idx]
+            self._bgr_idx ^= 1
+            cv2.cvtColor(src, cv2.COLOR_RGB2BGR, dst=frame)
+            if self.release:
+                self.release(src)
+
+        gap = slot - self._next_slot
+        if self._last_frame is not None and gap > 0:
+            # Lấp khoảng trống bằng frame trước (giới hạn khi bị treo lâu)
+            gap = min(gap, int(self.max_gap_seconds * self.fps))
+            for _ in range(gap):
+                self._writer.write(self._last_frame)
+            self.duplicated += gap
+            self.frames_written += gap
+
+        self._writer.write(frame)
+        self.frames_written += 1
+        self._last_frame = frame
+        self._next_slot = slot + 1
+
+    def close(self, timeout=10.0):
+        """Dừng nhận frame, encode nốt phần còn trong queue rồi đóng file."""
+        self.stop_event.set()
+        self.join(timeout)
+        return {
+            "fps": self.fps,
+            "frames_written": self.frames_written,
+            "duplicated": self.duplicated,
+            "dropped_ahead": self.dropped_ahead,
+            "dropped_queue": self.dropped_queue,
+        }
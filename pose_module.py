@@ -1,15 +1,29 @@
 import cv2
 import mediapipe as mp
 import numpy as np
+import time
 import utils
-from collections import deque
+from exercises import JOINT_NAMES, JOINT_TRIPLETS, get_exercise, exercise_names
+from governor import ComplexityGovernor
+from metrics import METRICS
+from quantile import P2Quantile
+from reps import FatigueTrend, RepSegmenter
+from timeseries import SessionSeries, feedback_code
+from tracking import KeyframeScheduler, PropagatedResults
 
 
 class OneEuroFilter:
     """
-    Simple One Euro Filter for smoothing scalar signals (joint angles).
-    Tham số mặc định tuned cho video ~30 FPS.
+    One Euro Filter cho 1 tín hiệu (scalar) hoặc cả bộ tín hiệu cùng lúc
+    (mảng NumPy: mọi góc khớp, tọa độ landmark...).
+    dt lấy từ timestamp thực của frame; không có timestamp thì dùng 1/freq.
+    dt lớn hơn 1/freq (15 FPS, frame rơi) được chia thành các bước ~1/freq,
+    input nội suy tuyến tính giữa 2 mẫu: công thức te / (te + tau) lọc mạnh
+    hơn khi te lớn, chia bước giữ độ trễ như ở freq. dt <= 1/freq: 1 bước,
+    giống hệt One-Euro gốc.
     """
+    MAX_SUBSTEPS = 8
+
     def __init__(self, freq=30.0, min_cutoff=1.0, beta=0.003, dcutoff=1.0):
         self.freq = float(freq)
         self.min_cutoff = float(min_cutoff)
@@ -17,51 +31,238 @@ class OneEuroFilter:
         self.dcutoff = float(dcutoff)
         self.x_prev = None
         self.dx_prev = 0.0
+        self.t_prev = None
+        self.raw_prev = None  # input (chưa lọc) lần trước, để nội suy bước con
+        self.dt = 1.0 / self.freq  # dt của lần gọi gần nhất
 
-    def alpha(self, cutoff):
-        te = 1.0 / self.freq
+    def alpha(self, cutoff, dt=None):
+        te = 1.0 / self.freq if dt is None else dt
         tau = 1.0 / (2 * np.pi * cutoff)
         return 1.0 / (1.0 + tau / te)
 
-    def __call__(self, x):
+    def __call__(self, x, t=None):
         # First time: chỉ lưu lại
         if self.x_prev is None:
             self.x_prev = x
+            self.raw_prev = x
+            self.t_prev = t
             return x
 
-        # derivative
-        dx = (x - self.x_prev) * self.freq
-        a_d = self.alpha(self.dcutoff)
-        dx_hat = a_d * dx + (1 - a_d) * self.dx_prev
+        if t is not None and self.t_prev is not None and t > self.t_prev:
+            dt = t - self.t_prev
+        else:
+            dt = 1.0 / self.freq
+        self.t_prev = t
+        self.dt = dt
+
+        steps = min(max(1, int(dt * self.freq + 0.5)), self.MAX_SUBSTEPS)
+        te = dt / steps
+        x_hat, dx_hat = self.x_prev, self.dx_prev
+        for i in range(1, steps + 1):
+            xi = x if i == steps else self.raw_prev + (x - self.raw_prev) * (i / steps)
+
+            # derivative
+            dx = (xi - x_hat) / te
+            a_d = self.alpha(self.dcutoff, te)
+            dx_hat = a_d * dx + (1 - a_d) * dx_hat
 
-        # adaptive cutoff
-        cutoff = self.min_cutoff + self.beta * abs(dx_hat)
-        a = self.alpha(cutoff)
+            # adaptive cutoff (theo từng tín hiệu)
+            cutoff = self.min_cutoff + self.beta * np.abs(dx_hat)
+            a = self.alpha(cutoff, te)
 
-        x_hat = a * x + (1 - a) * self.x_prev
+            x_hat = a * xi + (1 - a) * x_hat
 
         self.x_prev = x_hat
         self.dx_prev = dx_hat
+        self.raw_prev = x
         return x_hat
 
 
-class RehabDetector:
+class MovingAverage:
+    """
+    Trung bình trượt O(1) mỗi frame: ring buffer + tổng chạy (scalar hoặc
+    mảng). Tổng được cộng lại từ buffer mỗi vòng để không tích lũy sai số.
+    """
+    def __init__(self, window=5):
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        self._buf = None
+        self._sum = None
+        self._i = 0
+        self.count = 0
+
+    def resize(self, window):
+        """Đổi độ dài cửa sổ, giữ lại các giá trị mới nhất."""
+        window = max(int(window), 1)
+        if window == self.window:
+            return
+        if self._buf is None:
+            self.window = window
+            return
+        order = (self._i - self.count + np.arange(self.count)) % self.window
+        keep = self._buf[order][-window:]
+        self.window = window
+        self._buf = np.zeros((window,) + self._buf.shape[1:])
+        self.count = len(keep)
+        self._buf[: self.count] = keep
+        self._i = self.count % window
+        self._sum = keep.sum(axis=0)
+
+    def __call__(self, x):
+        x = np.asarray(x, dtype=np.float64)
+        if self._buf is None:
+            self._buf = np.zeros((self.window,) + x.shape)
+            self._sum = np.zeros(x.shape)
+
+        if self.count == self.window:
+            self._sum -= self._buf[self._i]
+        else:
+            self.count += 1
+        self._buf[self._i] = x
+        self._sum += x
+        self._i = (self._i + 1) % self.window
+        if self._i == 0:
+            self._sum = self._buf.sum(axis=0)
+        return self._sum / self.count
+
+
+# Chấm landmark màu đỏ như mặc định của MediaPipe, cho cả 2 thứ tự kênh
+_LANDMARK_SPEC_BGR = mp.solutions.drawing_utils.DrawingSpec(color=(0, 0, 255))
+_LANDMARK_SPEC_RGB = mp.solutions.drawing_utils.DrawingSpec(color=(255, 0, 0))
+
+
+_TRIPLETS = np.array(list(JOINT_TRIPLETS.values()), dtype=np.intp)
+
+MIN_VISIBILITY = 0.3  # <0.3 mới coi là mất
+SIDE_SWITCH_MARGIN = 0.15  # bên kia phải rõ hơn hẳn mới đổi bên
+
+
+def joint_angles(landmarks):
+    """
+    Tính mọi góc trong JOINT_TRIPLETS cùng lúc từ mảng (33, 4).
+    Trả về (angles, valid): góc (độ) và mask visibility của cả 3 điểm.
+    """
+    pts = np.empty((36, 3), dtype=np.float64)
+    np.clip(landmarks[:, :2], 0.0, 1.0, out=pts[:33, :2])
+    pts[:33, 2] = landmarks[:, 3]
+    pts[33] = 0.5 * (pts[11] + pts[12])
+    pts[34] = 0.5 * (pts[23] + pts[24])
+    pts[33, 2] = min(pts[11, 2], pts[12, 2])
+    pts[34, 2] = min(pts[23, 2], pts[24, 2])
+    pts[35] = pts[34]
+    pts[35, 1] += 0.1
+
+    a = pts[_TRIPLETS[:, 0]]
+    b = pts[_TRIPLETS[:, 1]]
+    c = pts[_TRIPLETS[:, 2]]
+    radians = np.arctan2(c[:, 1] - b[:, 1], c[:, 0] - b[:, 0]) - np.arctan2(
+        a[:, 1] - b[:, 1], a[:, 0] - b[:, 0]
+    )
+    angles = np.abs(radians * 180.0 / np.pi)
+    angles = np.where(angles > 180.0, 360.0 - angles, angles)
+
+    visibility = np.minimum(np.minimum(a[:, 2], b[:, 2]), c[:, 2])
+    return angles, visibility >= MIN_VISIBILITY
+
+
+def side_visibility(landmarks, spec):
+    """Visibility (nhỏ nhất của 3 điểm) của khớp chính ở bên trái, bên phải."""
+    vis = landmarks[:, 3]
+    return (
+        float(vis[list(spec.triplet["L"])].min()),
+        float(vis[list(spec.triplet["R"])].min()),
+    )
+
+
+def exercise_joints(exercise_type, side="L"):
+    """3 landmark (đầu, đỉnh, cuối) dùng để tính góc của bài tập."""
+    return list(get_exercise(exercise_type).triplet[side])
+
+
+def tracked_joints(exercise_type, side="L"):
+    """Landmark cần theo dõi giữa keyframe: khớp tính góc + khớp form rule."""
+    return get_exercise(exercise_type).tracked[side]
+
+
+def landmarks_to_array(pose_landmarks):
+    """MediaPipe landmark list -> mảng float32 (33, 4): x, y, z, visibility."""
+    return np.array(
+        [[lm.x, lm.y, lm.z, lm.visibility] for lm in pose_landmarks.landmark],
+        dtype=np.float32,
+    )
+
+
+class PoseModel:
+    """
+    MediaPipe Pose dùng chung (không chứa state của bệnh nhân).
+    static_image_mode=True khi 1 model phục vụ xen kẽ nhiều stream
+    (tracking giữa các frame liên tiếp không còn đúng).
+    """
+    def __init__(
+        self,
+        model_complexity=1,
+        min_detection_confidence=0.7,
+        min_tracking_confidence=0.7,
+        static_image_mode=False,
+    ):
+        self.pose = mp.solutions.pose.Pose(
+            static_image_mode=static_image_mode,
+            min_detection_confidence=min_detection_confidence,
+            min_tracking_confidence=min_tracking_confidence,
+            model_complexity=model_complexity,
+        )
+
+    def process(self, image_rgb):
+        return self.pose.process(image_rgb)
+
+    def estimate(self, frame):
+        """Chỉ chạy pose model trên frame BGR, trả về mảng (33, 4) hoặc None."""
+        image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        image.flags.writeable = False
+        results = self.pose.process(image)
+        if not results.pose_landmarks:
+            return None
+        return landmarks_to_array(results.pose_landmarks)
+
+    def reset(self):
+        """Xóa tracking state (khi chuyển sang video/stream khác)."""
+        self.pose.reset()
+
+    def close(self):
+        self.pose.close()
+
+
+class RehabSession:
+    """
+    State theo từng bệnh nhân / stream: session_data, series (chuỗi thời gian
+    theo frame), calib, counters, filter. Không giữ model -> 1 PoseModel có thể phục vụ
+    nhiều session (multi-station) hoặc không cần model (replay).
+    """
     def __init__(self):
         self.mp_drawing = mp.solutions.drawing_utils
         self.mp_pose = mp.solutions.pose
-        # Model pose
-        self.pose = self.mp_pose.Pose(
-            min_detection_confidence=0.7,
-            min_tracking_confidence=0.7,
-            model_complexity=1,
-        )
-
-        # Smoothing / filter
-        self.prev_angle = 0
-        self.smoothing_factor = 0.6
-        self.angle_window = deque(maxlen=5)
+        # Tắt âm báo khi chạy headless (batch)
+        self.sound_enabled = True
+        # Giới hạn chuỗi thời gian trong RAM (None = không giới hạn) + file spill
+        self.history_max_rows = None
+        self.history_spill_path = None
+        # LandmarkRecorder (replay.py) nếu đang ghi landmark cho replay
+        self.recorder = None
+        # SeriesJournal (journal.py) nếu đang lưu chuỗi theo frame vào DB
+        self.journal = None
+        # Histogram latency / bộ đếm (metrics.py); multi-stream gán instance riêng
+        self.metrics = METRICS
+
+        # Smoothing / filter. Cửa sổ tính theo giây, đổi ra số frame bằng dt
+        # thực (frame_dt) -> kết quả như nhau ở 15/30/60 FPS
+        self.smoothing_window_s = 5 / 30.0
+        self.frame_dt = 1.0 / 30.0  # dt trung bình (EMA) giữa các frame
+        self.angle_window = MovingAverage(window=self._frames(self.smoothing_window_s))
         self.angle_filter = OneEuroFilter(freq=30.0, min_cutoff=1.0, beta=0.005, dcutoff=1.0)
         self.last_speed = 0.0
+        self.angle_speed = None  # tốc độ góc (độ/s) của mọi khớp
         self._prev_for_speed = None
 
         # Stage counters
@@ -71,26 +272,20 @@ class RehabDetector:
 
         # === AUTO-CALIB DATA ===
         # Lưu max/min ước lượng theo từng bài để suy ra threshold
-        self.calib_data = {
-            "Bicep Curl": {"max": None, "min": None},
-            "Squat": {"max": None, "min": None},
-            "Lunges": {"max": None, "min": None},
-        }
+        self.calib_data = {}
         # Ngưỡng hiện tại (sau auto-calib)
         self.thresholds = {}  # {exercise: {"DOWN_TH": x, "UP_TH": y}}
         # Đánh dấu đã auto-calibrate trong session này chưa
-        self.auto_calibrated = {
-            "Bicep Curl": False,
-            "Squat": False,
-            "Lunges": False,
-        }
-
-        # Ngưỡng mặc định (fallback trước khi auto-calib đủ dữ liệu)
-        self.default_thresholds = {
-            "Bicep Curl": {"DOWN_TH": 150, "UP_TH": 40},
-            "Squat": {"DOWN_TH": 90, "UP_TH": 165},
-            "Lunges": {"DOWN_TH": 95, "UP_TH": 165},
-        }
+        self.auto_calibrated = {}
+        # Percentile 5/95 theo luồng (P²) cho auto-calib liên tục
+        self.calib_quantiles = {}
+        for ex in exercise_names():
+            self._ensure_calib(ex)
+        self._calib_reps = {}  # số rep ở lần calib gần nhất
+        self.recalib_min_s = 2.0  # tối thiểu giữa 2 lần calib
+        self.threshold_hysteresis = 3  # ngưỡng mới lệch < 3 độ thì giữ ngưỡng cũ
+        self.threshold_max_step = 10  # mỗi lần calib ngưỡng dịch tối đa 10 độ
+        self.threshold_margin = 0.15  # vùng đệm = 15% biên độ đã calib
 
         self.reset_session()
 
@@ -103,15 +298,30 @@ class RehabDetector:
             "color": (255, 255, 255),
             "min_angle": 180,
             "max_angle": 0,
+            "fatigue": None,
         }
-        self.angle_history = []
-        self.prev_angle = 0
-        self.angle_window.clear()
+        # Bản ghi từng rep + xu hướng mệt mỏi (cập nhật mỗi rep)
+        self.rep_segmenter = RepSegmenter()
+        self.rep_records = []
+        self.fatigue = FatigueTrend()
+        # Tạo mới (không clear) để view của session trước vẫn hợp lệ
+        self.series = SessionSeries(
+            n_joints=len(JOINT_NAMES),
+            max_rows=self.history_max_rows,
+            spill_path=self.history_spill_path,
+        )
+        self.frame_dt = 1.0 / 30.0
+        self._dt_measured = False
+        self.angle_window.reset()
         self.down_counter = 0
         self.up_counter = 0
         self.lost_counter = 0
         self.last_speed = 0.0
+        self.angle_speed = None
         self._prev_for_speed = None
+        self.active_side = None
+        self.joint_angles = None
+        self.joint_valid = None
         self.angle_filter = OneEuroFilter(freq=30.0, min_cutoff=1.0, beta=0.005, dcutoff=1.0)
 
         # Reset auto-calib cho session mới
@@ -119,10 +329,26 @@ class RehabDetector:
             self.calib_data[ex]["max"] = None
             self.calib_data[ex]["min"] = None
             self.auto_calibrated[ex] = False
+        for q_lo, q_hi in self.calib_quantiles.values():
+            q_lo.reset()
+            q_hi.reset()
+        self._calib_reps.clear()
         self.thresholds.clear()
 
+    @property
+    def angle_history(self):
+        """Góc khớp chính theo frame (view NumPy, không copy)."""
+        return self.series.angle
+
     # ===================== AUTO-CALIB =====================
 
+    def _ensure_calib(self, exercise_type):
+        """Tạo state calib cho bài tập (kể cả bài đăng ký sau khi tạo session)."""
+        if exercise_type not in self.calib_data:
+            self.calib_data[exercise_type] = {"max": None, "min": None}
+            self.auto_calibrated[exercise_type] = False
+            self.calib_quantiles[exercise_type] = (P2Quantile(0.05), P2Quantile(0.95))
+
     def _recalc_thresholds(self, exercise_type: str):
         """Tính DOWN/UP threshold dựa trên max/min đã calibrate."""
         data = self.calib_data.get(exercise_type)
@@ -138,50 +364,72 @@ class RehabDetector:
         if delta <= 0:
             return
 
-        margin = 0.15 * delta  # 15% biên độ làm vùng đệm
+        margin = self.threshold_margin * delta  # vùng đệm theo % biên độ
 
-        if exercise_type == "Bicep Curl":
-            # Góc lớn = tay duỗi, góc nhỏ = tay gập
+        spec = get_exercise(exercise_type)
+        if spec is not None and spec.sign < 0:
+            # Down ở góc lớn (Bicep Curl: góc lớn = tay duỗi, nhỏ = tay gập)
             down_th = max_a - margin   # > down_th = tay duỗi đủ
             up_th = min_a + margin     # < up_th = gập đủ
         else:
-            # Squat/Lunges: góc lớn = đứng thẳng, góc nhỏ = xuống sâu
+            # Down ở góc nhỏ (Squat/Lunges: góc lớn = đứng thẳng, nhỏ = xuống sâu)
             down_th = min_a + margin   # < down_th = xuống đủ sâu
             up_th = max_a - margin     # > up_th = đứng thẳng đủ
 
-        self.thresholds[exercise_type] = {
-            "DOWN_TH": int(down_th),
-            "UP_TH": int(up_th),
-        }
+        new = {"DOWN_TH": int(down_th), "UP_TH": int(up_th)}
 
-    def _get_thresholds(self, exercise_type: str):
-        """Lấy ngưỡng hiện tại (ưu tiên auto-calib, nếu chưa thì dùng default)."""
+        # Hysteresis: bỏ qua dao động nhỏ, giới hạn bước dịch mỗi lần
+        old = self.thresholds.get(exercise_type)
+        if old is not None:
+            step = self.threshold_max_step
+            for key, value in new.items():
+                change = value - old[key]
+                if abs(change) < self.threshold_hysteresis:
+                    new[key] = old[key]
+                else:
+                    new[key] = old[key] + max(-step, min(step, change))
+
+        self.thresholds[exercise_type] = new
+
+    def _get_thresholds(self, exercise_type: str, spec=None):
+        """
+        Lấy ngưỡng hiện tại (ưu tiên auto-calib, nếu chưa thì dùng default
+        của `spec`, mặc định là bài tập đã đăng ký).
+        """
         if exercise_type in self.thresholds:
             return (
                 self.thresholds[exercise_type]["DOWN_TH"],
                 self.thresholds[exercise_type]["UP_TH"],
             )
-        base = self.default_thresholds.get(exercise_type, {"DOWN_TH": 150, "UP_TH": 40})
+        spec = spec or get_exercise(exercise_type)
+        base = spec.default_thresholds if spec else {"DOWN_TH": 150, "UP_TH": 40}
         return base["DOWN_TH"], base["UP_TH"]
 
-    def _auto_calibrate_if_needed(self, exercise_type: str):
+    def _auto_calibrate_if_needed(self, exercise_type: str, angle):
         """
-        Tự động calibrate sau 3+ reps đầu:
-        - Dùng percentile 95/5 của angle_history để ước lượng max/min
-        - Dùng EMA (giống loss L2 mượt) để cập nhật max/min, giảm nhiễu
+        Auto-calibrate liên tục:
+        - P² ước lượng percentile 95/5 của góc theo luồng (O(1) mỗi frame)
+        - Lần đầu sau 3+ reps; sau đó mỗi khi có rep mới và đủ
+          recalib_min_s giây từ lần trước -> theo kịp ROM thay đổi
+        - Dùng EMA (giống loss L2 mượt) để cập nhật max/min, giảm nhiễu;
+          quantile bắt đầu cửa sổ mới sau mỗi lần calib (bám drift)
         """
-        if self.auto_calibrated.get(exercise_type, False):
+        quantiles = self.calib_quantiles.get(exercise_type)
+        if quantiles is None:
             return
+        q_lo, q_hi = quantiles
+        q_lo.add(angle)
+        q_hi.add(angle)
 
         # Cần ít nhất 3 reps & đủ frame để ước lượng tin cậy
-        if self.session_data["reps"] < 3:
+        reps = self.session_data["reps"]
+        if reps < 3 or q_hi.count < self._frames(self.recalib_min_s):
             return
-        if len(self.angle_history) < 60:  # ~2s @30fps
+        if reps <= self._calib_reps.get(exercise_type, 0):
             return
 
-        history = np.array(self.angle_history, dtype=np.float32)
-        max_est = np.percentile(history, 95)
-        min_est = np.percentile(history, 5)
+        max_est = q_hi.value()
+        min_est = q_lo.value()
 
         # Smoothing như loss: threshold mới = 0.7*old + 0.3*estimate
         prev = self.calib_data[exercise_type]
@@ -204,300 +452,315 @@ class RehabDetector:
         # Tính threshold từ calib_data
         self._recalc_thresholds(exercise_type)
         self.auto_calibrated[exercise_type] = True
+        self._calib_reps[exercise_type] = reps
+        q_lo.reset()
+        q_hi.reset()
 
     # ===================== CORE POSE PROCESSING =====================
 
-    def calculate_angle(self, a, b, c):
-        """Tính góc hình học giữa 3 điểm a-b-c (b là đỉnh)."""
-        a = np.array(a)
-        b = np.array(b)
-        c = np.array(c)
+    def _frames(self, seconds):
+        """Số frame tương ứng `seconds` theo dt thực hiện tại (tối thiểu 1)."""
+        return max(1, int(seconds / self.frame_dt + 0.5))
 
-        radians = np.arctan2(c[1] - b[1], c[0] - b[0]) - np.arctan2(
-            a[1] - b[1], a[0] - b[0]
-        )
-        angle = np.abs(radians * 180.0 / np.pi)
-
-        if angle > 180.0:
-            angle = 360 - angle
-
-        return angle
+    def _update_frame_dt(self, timestamp):
+        """EMA của dt thực; dt đầu tiên đo được thay luôn giá trị mặc định."""
+        if timestamp is None:
+            return
+        dt = self.angle_filter.dt
+        if self._dt_measured:
+            self.frame_dt += 0.1 * (dt - self.frame_dt)
+        else:
+            self.frame_dt = dt
+            self._dt_measured = True
+        self.angle_window.resize(self._frames(self.smoothing_window_s))
 
-    def _smooth_angle(self, raw_angle: float) -> int:
+    def _smooth_angles(self, angles, valid, timestamp=None):
         """
-        Lọc nhiễu: One-Euro + Moving Average,
-        và tính tốc độ góc để anti-cheat.
+        Lọc nhiễu cả vector góc khớp: One-Euro + Moving Average,
+        và tính tốc độ góc (độ/s, theo dt thực) để anti-cheat.
+        Khớp không đủ visibility giữ giá trị đã lọc trước đó.
         """
-        filtered = self.angle_filter(raw_angle)
+        if self.angle_filter.x_prev is not None:
+            angles = np.where(valid, angles, self.angle_filter.x_prev)
+        measured = self.angle_filter.x_prev is not None
+        filtered = self.angle_filter(angles, timestamp)
+        if measured:
+            self._update_frame_dt(timestamp)
 
-        self.angle_window.append(filtered)
-        smoothed_angle = float(np.mean(self.angle_window))
+        smoothed = self.angle_window(filtered)
 
         if self._prev_for_speed is not None:
-            self.last_speed = abs(smoothed_angle - self._prev_for_speed) * 30.0
-        self._prev_for_speed = smoothed_angle
+            self.angle_speed = np.abs(smoothed - self._prev_for_speed) / self.angle_filter.dt
+        self._prev_for_speed = smoothed
 
-        return int(smoothed_angle)
-
-    def process_frame(self, frame, exercise_type):
-        """Xử lý 1 frame, trả về frame vẽ + session_data + current_angle."""
-        image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        image.flags.writeable = False
-        results = self.pose.process(image)
-        image.flags.writeable = True
-        image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+        return smoothed
 
+    def analyze(self, image, results, exercise_type, draw=True, rgb=False,
+                timestamp=None):
+        """
+        Cập nhật session từ kết quả pose của 1 frame và vẽ HUD lên `image`
+        (BGR, hoặc RGB nếu rgb=True). Trả về current_angle.
+        timestamp: thời điểm capture (giây) -> dt thực cho filter / tốc độ góc.
+        """
         current_angle = 0
         h, w, _ = image.shape
 
-        if results.pose_landmarks:
-            landmarks = results.pose_landmarks.landmark
-
-            def get_landmark(idx):
-                lm = landmarks[idx]
-                # Nới visibility: <0.3 mới coi là mất
-                if lm.visibility is not None and lm.visibility < 0.3:
-                    raise ValueError("Low visibility")
-                x = min(max(lm.x, 0.0), 1.0)
-                y = min(max(lm.y, 0.0), 1.0)
-                return [x, y]
-
-            try:
-                # Chọn khớp tùy bài tập
-                if exercise_type == "Bicep Curl":
-                    indices = [11, 13, 15]  # Vai, Khuỷu, Cổ tay (trái)
-                elif exercise_type in ["Squat", "Lunges"]:
-                    indices = [23, 25, 27]  # Hông, Gối, Cổ chân (trái)
-                else:
-                    indices = [11, 13, 15]
-
-                p1 = get_landmark(indices[0])
-                p2 = get_landmark(indices[1])
-                p3 = get_landmark(indices[2])
-                self.lost_counter = 0
-
-                raw_angle = self.calculate_angle(p1, p2, p3)
-                current_angle = self._smooth_angle(raw_angle)
-
-                # Anti-cheat: tốc độ góc quá cao
-                if self.last_speed > 1200:
-                    self.session_data["feedback"] = "Too fast! Control your movement"
-                    self.session_data["color"] = (0, 165, 255)
-
-                # Threshold (mặc định hoặc đã auto-calib)
-                DOWN_TH, UP_TH = self._get_thresholds(exercise_type)
-                MIN_FRAMES_STAGE = 3
-
-                # Tọa độ vẽ góc
-                joint_pos = (int(p2[0] * w), int(p2[1] * h))
-
-                # Extra landmarks cho form Squat/Lunge
-                shoulder_L = None
-                if exercise_type in ["Squat", "Lunges"]:
-                    try:
-                        shoulder_L = get_landmark(11)
-                    except ValueError:
-                        shoulder_L = None
-
-                # === LOGIC THEO BÀI TẬP ===
-
-                # BICEP CURL
-                if exercise_type == "Bicep Curl":
-                    if current_angle > DOWN_TH:
-                        self.down_counter += 1
-                        self.up_counter = 0
-                    elif current_angle < UP_TH:
-                        self.up_counter += 1
-                        self.down_counter = 0
-                    else:
-                        self.down_counter = 0
-                        self.up_counter = 0
-
-                    if (
-                        self.down_counter >= MIN_FRAMES_STAGE
-                        and self.session_data["stage"] != "down"
-                    ):
-                        self.session_data["stage"] = "down"
-                        if "Too fast" not in self.session_data["feedback"]:
-                            self.session_data["feedback"] = "Curl Up"
-                        self.session_data["color"] = (255, 255, 255)
-
-                    if (
-                        self.up_counter >= MIN_FRAMES_STAGE
-                        and self.session_data["stage"] == "down"
-                    ):
-                        self.session_data["stage"] = "up"
-                        self.session_data["reps"] += 1
-                        if "Too fast" not in self.session_data["feedback"]:
-                            self.session_data["feedback"] = "Good Rep!"
-                        self.session_data["color"] = (0, 255, 0)
-                        utils.play_success()
-                        self.up_counter = 0
-                        self.down_counter = 0
-
-                # SQUAT
-                elif exercise_type == "Squat":
-                    if current_angle < DOWN_TH:
-                        self.down_counter += 1
-                        self.up_counter = 0
-                    elif current_angle > UP_TH:
-                        self.up_counter += 1
-                        self.down_counter = 0
-                    else:
-                        if self.session_data["stage"] != "down":
-                            if "Too fast" not in self.session_data["feedback"]:
-                                self.session_data["feedback"] = "Lower! (Go deeper)"
-                            self.session_data["color"] = (0, 165, 255)
-                        self.down_counter = 0
-                        self.up_counter = 0
-
-                    if (
-                        self.down_counter >= MIN_FRAMES_STAGE
-                        and self.session_data["stage"] != "down"
-                    ):
-                        self.session_data["stage"] = "down"
-                        if "Too fast" not in self.session_data["feedback"]:
-                            self.session_data["feedback"] = "Stand Up"
-                        self.session_data["color"] = (0, 0, 255)
-
-                    if (
-                        self.up_counter >= MIN_FRAMES_STAGE
-                        and self.session_data["stage"] == "down"
-                    ):
-                        self.session_data["stage"] = "up"
-                        self.session_data["reps"] += 1
-                        if "Too fast" not in self.session_data["feedback"]:
-                            self.session_data["feedback"] = "Perfect Squat!"
-                        self.session_data["color"] = (0, 255, 0)
-                        utils.play_success()
-                        self.up_counter = 0
-                        self.down_counter = 0
-
-                    # FORM CHECK SQUAT
-                    if self.session_data["stage"] == "down":
-                        knee_x = p2[0]
-                        ankle_x = p3[0]
-                        if knee_x - ankle_x > 0.12:
-                            self.session_data["feedback"] = "Knee too far forward"
-                            self.session_data["color"] = (0, 0, 255)
-
-                        if shoulder_L is not None:
-                            trunk_angle = self.calculate_angle(shoulder_L, p1, p2)
-                            if trunk_angle < 150:
-                                self.session_data["feedback"] = "Keep your back more upright"
-                                self.session_data["color"] = (0, 0, 255)
-
-                # LUNGES
-                elif exercise_type == "Lunges":
-                    if current_angle < DOWN_TH:
-                        self.down_counter += 1
-                        self.up_counter = 0
-                    elif current_angle > UP_TH:
-                        self.up_counter += 1
-                        self.down_counter = 0
-                    else:
-                        self.down_counter = 0
-                        self.up_counter = 0
-
-                    if (
-                        self.down_counter >= MIN_FRAMES_STAGE
-                        and self.session_data["stage"] != "down"
-                    ):
-                        self.session_data["stage"] = "down"
-                        if "Too fast" not in self.session_data["feedback"]:
-                            self.session_data["feedback"] = "Push Up"
-                        self.session_data["color"] = (0, 0, 255)
-
-                    if (
-                        self.up_counter >= MIN_FRAMES_STAGE
-                        and self.session_data["stage"] == "down"
-                    ):
-                        self.session_data["stage"] = "up"
-                        self.session_data["reps"] += 1
-                        if "Too fast" not in self.session_data["feedback"]:
-                            self.session_data["feedback"] = "Good Lunge!"
-                        self.session_data["color"] = (0, 255, 0)
-                        utils.play_success()
-                        self.up_counter = 0
-                        self.down_counter = 0
-
-                    # FORM CHECK LUNGES
-                    if self.session_data["stage"] == "down":
-                        knee_x = p2[0]
-                        ankle_x = p3[0]
-                        if knee_x - ankle_x > 0.12:
-                            self.session_data["feedback"] = "Front knee too far forward"
-                            self.session_data["color"] = (0, 0, 255)
-
-                # Cập nhật thống kê session
-                self.angle_history.append(current_angle)
-                self.session_data["min_angle"] = min(
-                    self.session_data["min_angle"], current_angle
-                )
-                self.session_data["max_angle"] = max(
-                    self.session_data["max_angle"], current_angle
-                )
-
-                # Sau khi có đủ rep/frame -> auto-calib
-                self._auto_calibrate_if_needed(exercise_type)
+        if not results.pose_landmarks:
+            self.metrics.count("no_pose")
+            if self.recorder is not None:
+                self.recorder.add(timestamp, None)
 
-                # HUD
-                cv2.circle(image, joint_pos, 28, (255, 255, 255), -1)
-                status_color = (
-                    (0, 255, 0)
-                    if "Good" in self.session_data["feedback"]
-                    or "Perfect" in self.session_data["feedback"]
-                    else (0, 0, 0)
+        if results.pose_landmarks:
+            landmarks = landmarks_to_array(results.pose_landmarks)
+            if self.recorder is not None:
+                self.recorder.add(timestamp, landmarks)
+            current_angle, joint = self.update(landmarks, exercise_type, timestamp)
+
+            if draw and joint is not None:
+                joint_pos = (int(joint[0] * w), int(joint[1] * h))
+                self._draw_hud(
+                    image, joint_pos, current_angle, results.pose_landmarks, rgb=rgb
                 )
-                cv2.circle(image, joint_pos, 28, status_color, 3)
-
-                text = str(int(current_angle))
-                text_size = cv2.getTextSize(
-                    text, cv2.FONT_HERSHEY_SIMPLEX, 0.8, 2
-                )[0]
-                text_x = joint_pos[0] - text_size[0] // 2
-                text_y = joint_pos[1] + text_size[1] // 2
+            elif draw and self.lost_counter >= 5:
                 cv2.putText(
                     image,
-                    text,
-                    (text_x, text_y),
+                    "LOST TRACKING",
+                    (50, h // 2),
                     cv2.FONT_HERSHEY_SIMPLEX,
-                    0.8,
-                    (0, 0, 0),
+                    1,
+                    (255, 0, 0) if rgb else (0, 0, 255),
                     2,
-                    cv2.LINE_AA,
                 )
 
-                self.mp_drawing.draw_landmarks(
-                    image, results.pose_landmarks, self.mp_pose.POSE_CONNECTIONS
+        return current_angle
+
+    def update(self, landmarks, exercise_type, timestamp=None):
+        """
+        Cập nhật state machine từ mảng landmark (33, 4) [x, y, z, visibility].
+        Không chạy model -> dùng được cho replay / ghép chunk.
+        Trả về (current_angle, joint) với joint = (x, y) chuẩn hóa của khớp giữa,
+        hoặc (0, None) nếu mất tracking.
+        """
+        current_angle = 0
+
+        spec = get_exercise(exercise_type)
+        if spec is None:
+            return current_angle, None
+        self._ensure_calib(exercise_type)
+
+        # Mọi góc khớp trong 1 phép tính; thiếu visibility -> mask, không raise
+        angles, valid = joint_angles(landmarks)
+        self.joint_angles = angles
+        self.joint_valid = valid
+        side = self._select_side(landmarks, spec)
+        joint = spec.angle_index[side]
+
+        if not valid[joint]:
+            self.lost_counter += 1
+            self.metrics.count("lost_tracking")
+            self.session_data["feedback"] = "Adjust Camera / Body"
+            self.session_data["color"] = (0, 0, 255)
+            return current_angle, None
+
+        try:
+            indices = spec.triplet[side]
+            p2 = np.clip(landmarks[indices[1], :2].astype(np.float64), 0.0, 1.0)
+            self.lost_counter = 0
+
+            smoothed = self._smooth_angles(angles, valid, timestamp)
+            current_angle = int(smoothed[joint])
+            if self.angle_speed is not None:
+                self.last_speed = float(self.angle_speed[joint])
+
+            # Anti-cheat: tốc độ góc quá cao
+            if self.last_speed > 1200:
+                self.session_data["feedback"] = "Too fast! Control your movement"
+                self.session_data["color"] = (0, 165, 255)
+
+            # Threshold (mặc định hoặc đã auto-calib)
+            DOWN_TH, UP_TH = self._get_thresholds(exercise_type)
+
+            self._step_stage(spec, current_angle, DOWN_TH, UP_TH)
+            self._check_form(spec, side, landmarks, angles, valid)
+
+            # Cập nhật thống kê session
+            if timestamp is None:
+                timestamp = (self.series.spilled + len(self.series)) / self.angle_filter.freq
+            self.series.append(
+                timestamp,
+                current_angle,
+                smoothed,
+                self.session_data["stage"],
+                float(landmarks[list(indices), 3].min()),
+                feedback_code(self.session_data["feedback"]),
+            )
+            if self.journal is not None:
+                self.journal.on_append(self.series)
+            self.rep_segmenter.turn_at_max = spec.turn_at_max
+            rep = self.rep_segmenter.update(
+                timestamp, current_angle, self.last_speed, self.session_data["reps"]
+            )
+            if rep is not None:
+                self.rep_records.append(rep)
+                if self.journal is not None:
+                    self.journal.add_rep(rep)
+                self.session_data["fatigue"] = self.fatigue.add(rep)
+            self.session_data["min_angle"] = min(
+                self.session_data["min_angle"], current_angle
+            )
+            self.session_data["max_angle"] = max(
+                self.session_data["max_angle"], current_angle
+            )
+
+            # Sau khi có đủ rep/frame -> auto-calib
+            self._auto_calibrate_if_needed(exercise_type, current_angle)
+
+            return current_angle, p2
+
+        except Exception as e:
+            # Frame lỗi không dừng session, nhưng phải thấy được (overlay / dump)
+            self.metrics.exception("update", e)
+
+        return current_angle, None
+
+    def step_angle(self, exercise_type, angle, spec=None):
+        """
+        Chỉ stage machine + auto-calib cho 1 góc đã lọc (int như current_angle),
+        giống hệt phần tương ứng trong update(). Dùng để chạy lại chuỗi góc
+        với tham số khác (sweep.py); `spec` thay cho bài tập đã đăng ký
+        (vd. bản sao đổi default_thresholds / min_stage_s); số frame của
+        min_stage_s theo frame_dt hiện tại.
+        """
+        spec = spec or get_exercise(exercise_type)
+        self._ensure_calib(exercise_type)
+        down_th, up_th = self._get_thresholds(exercise_type, spec)
+        self._step_stage(spec, angle, down_th, up_th)
+        self._auto_calibrate_if_needed(exercise_type, angle)
+
+    def _step_stage(self, spec, angle, down_th, up_th):
+        """
+        State machine down/up chung cho mọi bài tập. spec.sign = +1: down khi
+        góc < DOWN_TH, up khi góc > UP_TH; -1: ngược lại.
+        """
+        data = self.session_data
+        sign = spec.sign
+        if sign * angle < sign * down_th:
+            self.down_counter += 1
+            self.up_counter = 0
+        elif sign * angle > sign * up_th:
+            self.up_counter += 1
+            self.down_counter = 0
+        else:
+            if spec.between_feedback is not None and data["stage"] != "down":
+                if "Too fast" not in data["feedback"]:
+                    data["feedback"] = spec.between_feedback[0]
+                data["color"] = spec.between_feedback[1]
+            self.down_counter = 0
+            self.up_counter = 0
+
+        min_frames = self._frames(spec.min_stage_s)
+        if self.down_counter >= min_frames and data["stage"] != "down":
+            data["stage"] = "down"
+            if "Too fast" not in data["feedback"]:
+                data["feedback"] = spec.down_feedback[0]
+            data["color"] = spec.down_feedback[1]
+
+        if self.up_counter >= min_frames and data["stage"] == "down":
+            data["stage"] = "up"
+            data["reps"] += 1
+            if "Too fast" not in data["feedback"]:
+                data["feedback"] = spec.rep_feedback[0]
+            data["color"] = spec.rep_feedback[1]
+            if self.sound_enabled:
+                utils.play_success()
+            self.up_counter = 0
+            self.down_counter = 0
+
+    def _check_form(self, spec, side, landmarks, angles, valid):
+        """Đánh giá form rule của bài tập (đã biên dịch theo bên)."""
+        data = self.session_data
+        for stage, kind, a, b, op, value, feedback, color in spec.rules[side]:
+            if stage is not None and data["stage"] != stage:
+                continue
+            if kind == "angle":
+                if not valid[a] or not op(angles[a], value):
+                    continue
+            else:
+                if landmarks[a, 3] < MIN_VISIBILITY or landmarks[b, 3] < MIN_VISIBILITY:
+                    continue
+                delta = min(max(float(landmarks[a, kind]), 0.0), 1.0) - min(
+                    max(float(landmarks[b, kind]), 0.0), 1.0
                 )
+                if not op(delta, value):
+                    continue
+            data["feedback"] = feedback
+            data["color"] = color
 
-            except ValueError:
-                self.lost_counter += 1
-                self.session_data["feedback"] = "Adjust Camera / Body"
-                self.session_data["color"] = (0, 0, 255)
-
-                if self.lost_counter >= 5:
-                    cv2.putText(
-                        image,
-                        "LOST TRACKING",
-                        (50, h // 2),
-                        cv2.FONT_HERSHEY_SIMPLEX,
-                        1,
-                        (0, 0, 255),
-                        2,
-                    )
-
-            except Exception:
-                pass
+    def _select_side(self, landmarks, spec):
+        """
+        Chọn bên (L/R) có khớp chính rõ hơn. Chỉ đổi bên khi bên đang dùng mất
+        hẳn hoặc bên kia rõ hơn SIDE_SWITCH_MARGIN (tránh nhảy bên mỗi frame).
+        """
+        vis_l, vis_r = side_visibility(landmarks, spec)
+        if self.active_side is None:
+            self.active_side = "R" if vis_r > vis_l else "L"
+            return self.active_side
+
+        current, other = (vis_l, vis_r) if self.active_side == "L" else (vis_r, vis_l)
+        if (current < MIN_VISIBILITY <= other) or other > current + SIDE_SWITCH_MARGIN:
+            self.active_side = "R" if self.active_side == "L" else "L"
+        return self.active_side
+
+    def _draw_hud(self, image, joint_pos, current_angle, pose_landmarks, rgb=False):
+        """Vẽ góc tại khớp + skeleton lên frame (in-place, BGR hoặc RGB)."""
+        cv2.circle(image, joint_pos, 28, (255, 255, 255), -1)
+        status_color = (
+            (0, 255, 0)
+            if "Good" in self.session_data["feedback"]
+            or "Perfect" in self.session_data["feedback"]
+            else (0, 0, 0)
+        )
+        cv2.circle(image, joint_pos, 28, status_color, 3)
+
+        text = str(int(current_angle))
+        text_size = cv2.getTextSize(
+            text, cv2.FONT_HERSHEY_SIMPLEX, 0.8, 2
+        )[0]
+        text_x = joint_pos[0] - text_size[0] // 2
+        text_y = joint_pos[1] + text_size[1] // 2
+        cv2.putText(
+            image,
+            text,
+            (text_x, text_y),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            0.8,
+            (0, 0, 0),
+            2,
+            cv2.LINE_AA,
+        )
 
-        return image, self.session_data, current_angle
+        self.mp_drawing.draw_landmarks(
+            image,
+            pose_landmarks,
+            self.mp_pose.POSE_CONNECTIONS,
+            landmark_drawing_spec=_LANDMARK_SPEC_RGB if rgb else _LANDMARK_SPEC_BGR,
+        )
+
+    def current_thresholds(self, exercise_type: str):
+        """(DOWN_TH, UP_TH) đang dùng cho bài tập (sau auto-calib nếu đã calib)."""
+        return self._get_thresholds(exercise_type)
+
+    def calibrated_range(self, exercise_type: str):
+        """(min, max) góc đã auto-calib của bài tập, (None, None) nếu chưa calib."""
+        calib = self.calib_data.get(exercise_type, {})
+        return calib.get("min"), calib.get("max")
 
     def compute_rom_and_fatigue(self, exercise_type: str):
         """
         Tính:
         - rom_score (%): so sánh biên độ thực tế với biên độ auto-calib (max-min)
-        - fatigue_flag: 'Low', 'Moderate', 'High' dựa trên việc biên độ giảm dần
+        - fatigue_flag: 'Low', 'Moderate', 'High' theo xu hướng ROM / tempo
+          từng rep (FatigueTrend); session quá ít rep thì so biên độ đầu/cuối
         """
         calib = self.calib_data.get(exercise_type, {})
         max_a = calib.get("max")
@@ -512,29 +775,263 @@ class RehabDetector:
             if delta_expected > 0:
                 rom_score = max(0.0, min(120.0, 100.0 * delta_session / delta_expected))
 
-        fatigue_flag = None
-        history = self.angle_history
-        if len(history) >= 90:  # ~3s @30fps
-            n = len(history)
-            first = history[: n // 3]
-            last = history[-n // 3 :]
-            min_first = min(first)
-            min_last = min(last)
-
-            diff = min_last - min_first
-            if exercise_type in ["Squat", "Lunges"]:
-                if diff > 15:
-                    fatigue_flag = "High"
-                elif diff > 7:
-                    fatigue_flag = "Moderate"
-                else:
-                    fatigue_flag = "Low"
+        # Đủ rep -> dùng xu hướng đã tính online (không quét lại history)
+        fatigue_flag = self.fatigue.level
+        if fatigue_flag is None and self.series.total >= 90:  # ~3s @30fps
+            # Cả session, kể cả phần history đã spill khỏi RAM
+            min_first, min_last = self.series.angle_min_thirds()
+
+            diff = float(min_last - min_first)
+            spec = get_exercise(exercise_type)
+            high, moderate = spec.fatigue_diff if spec else (10, 5)
+            if diff > high:
+                fatigue_flag = "High"
+            elif diff > moderate:
+                fatigue_flag = "Moderate"
             else:
-                if diff > 10:
-                    fatigue_flag = "High"
-                elif diff > 5:
-                    fatigue_flag = "Moderate"
-                else:
-                    fatigue_flag = "Low"
+                fatigue_flag = "Low"
 
         return rom_score, fatigue_flag
+
+
+class RehabDetector(RehabSession):
+    """
+    Session + PoseModel riêng (chế độ 1 camera như GUI / batch).
+
+    roi_mode=True: crop quanh bbox landmark của frame trước (+ roi_margin),
+    thu nhỏ về inference_size (cạnh dài, px) rồi map landmark về tọa độ toàn
+    frame. inference_size chỉ áp dụng cho crop: frame đầy đủ (roi_mode tắt
+    hoặc đang detect lại) giữ nguyên độ phân giải như baseline. Quay lại
+    detect toàn frame khi mất tracking (lost_counter > 0 hoặc không thấy
+    người). ROI chỉ đổi khi người sắp ra khỏi vùng crop, và
+    mỗi lần đổi thì reset tracking của MediaPipe (tọa độ crop cũ không còn đúng).
+
+    keyframe_mode=True: chỉ chạy model trên keyframe, giữa các keyframe đẩy
+    khớp theo optical flow và giảm tần suất khi đứng yên (xem KeyframeScheduler).
+
+    adaptive_complexity=True: nạp sẵn model complexity 0/1/2 (mức nào nạp
+    lỗi thì bỏ) và để ComplexityGovernor đổi mức theo latency đo được so với
+    ngân sách 1 / target_fps. Các lần đổi nằm trong `model_switches`. Nạp
+    được < 2 mức thì không có gì để đổi -> chạy như adaptive_complexity=False
+    (không mức nào nạp được thì dùng pose_model / PoseModel() mặc định).
+    """
+    def __init__(self, pose_model=None, roi_mode=False, inference_size=None,
+                 roi_margin=0.25, keyframe_mode=False, adaptive_complexity=False,
+                 target_fps=30.0):
+        super().__init__()
+        self.governor = None
+        if adaptive_complexity:
+            self.models = {}
+            for level in (0, 1, 2):
+                try:
+                    self.models[level] = PoseModel(model_complexity=level)
+                except Exception as e:
+                    print(f"Model Error (complexity {level}): {e}")
+            if len(self.models) > 1:
+                self.governor = ComplexityGovernor(
+                    levels=tuple(self.models), start_level=1, target_fps=target_fps
+                )
+                self.pose_model = self.models[self.governor.level]
+            elif self.models:
+                self.pose_model = next(iter(self.models.values()))
+            else:
+                self.pose_model = pose_model or PoseModel()
+        else:
+            self.pose_model = pose_model or PoseModel()
+        self.roi_mode = roi_mode
+        self.inference_size = inference_size
+        self.roi_margin = roi_margin
+        self._roi = None  # (x0, y0, x1, y1) pixel, None = toàn frame
+        self.scheduler = KeyframeScheduler() if keyframe_mode else None
+        self._propagated = False  # frame hiện tại là landmark đẩy theo flow
+
+    def reset_session(self):
+        super().reset_session()
+        self._roi = None
+        self._propagated = False
+        if getattr(self, "scheduler", None) is not None:
+            self.scheduler.reset()
+        if getattr(self, "governor", None) is not None:
+            self.governor.reset()
+
+    @property
+    def model_switches(self):
+        """Các lần governor đổi model_complexity trong session hiện tại."""
+        return list(self.governor.events) if self.governor is not None else []
+
+    def _process(self, image):
+        """Pose.process + đo latency (metrics, governor nếu bật)."""
+        t0 = time.perf_counter()
+        results = self.pose_model.process(image)
+        latency = time.perf_counter() - t0
+        self.metrics.record("model", latency)
+        if self.governor is None:
+            return results
+
+        # Không đổi model giữa 1 rep (đã vào stage "down", chưa đếm rep)
+        between_reps = (
+            self.session_data["stage"] != "down"
+            and self.down_counter == 0
+            and self.up_counter == 0
+        )
+        new_level = self.governor.observe(
+            latency, can_switch=between_reps, reps=self.session_data["reps"]
+        )
+        if new_level is not None:
+            event = self.governor.events[-1]
+            print(f"Model complexity {event['from']} -> {event['to']} "
+                  f"({event['latency_ms']} ms vs {event['budget_ms']} ms budget)")
+            self.pose_model = self.models[new_level]
+            self.pose_model.reset()
+            self._roi = None
+        return results
+
+    def estimate(self, frame):
+        return self.pose_model.estimate(frame)
+
+    # ===================== ROI INFERENCE =====================
+
+    def _set_roi(self, roi):
+        if roi != self._roi:
+            self._roi = roi
+            self.pose_model.reset()
+
+    def _fit_inference_size(self, image):
+        h, w = image.shape[:2]
+        if self.inference_size and max(h, w) > self.inference_size:
+            scale = self.inference_size / max(h, w)
+            size = (max(1, int(w * scale)), max(1, int(h * scale)))
+            return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        return np.ascontiguousarray(image)
+
+    def _track_roi(self, pose_landmarks, w, h):
+        """Cập nhật ROI từ bbox landmark (pixel toàn frame)."""
+        pts = [
+            (lm.x * w, lm.y * h)
+            for lm in pose_landmarks.landmark
+            if lm.visibility >= 0.5
+        ]
+        if len(pts) < 4:
+            self._set_roi(None)
+            return
+        xs, ys = zip(*pts)
+        bx0, by0, bx1, by1 = min(xs), min(ys), max(xs), max(ys)
+        bw, bh = bx1 - bx0, by1 - by0
+
+        roi = self._roi
+        if roi is not None:
+            # Giữ ROI cũ nếu bbox vẫn nằm trong vùng an toàn và chưa quá nhỏ
+            rx0, ry0, rx1, ry1 = roi
+            pad_x = 0.5 * self.roi_margin * bw
+            pad_y = 0.5 * self.roi_margin * bh
+            inside = (
+                max(bx0 - pad_x, 0) >= rx0 and max(by0 - pad_y, 0) >= ry0
+                and min(bx1 + pad_x, w) <= rx1 and min(by1 + pad_y, h) <= ry1
+            )
+            big_enough = bw * bh >= 0.2 * (rx1 - rx0) * (ry1 - ry0)
+            if inside and big_enough:
+                return
+
+        mx = self.roi_margin * bw
+        my = self.roi_margin * bh
+        x0 = int(max(0, bx0 - mx))
+        y0 = int(max(0, by0 - my))
+        x1 = int(min(w, bx1 + mx))
+        y1 = int(min(h, by1 + my))
+        if x1 - x0 < 64 or y1 - y0 < 64:
+            self._set_roi(None)
+            return
+        self._set_roi((x0, y0, x1, y1))
+
+    def _infer(self, image, exercise_type):
+        """Keyframe scheduler (nếu bật) quyết định chạy model hay đẩy theo flow."""
+        if self.scheduler is None:
+            return self._run_model(image)
+        results = self.scheduler.step(
+            image,
+            tracked_joints(exercise_type, self.active_side or "L"),
+            self._run_model,
+            force=self.lost_counter > 0,
+        )
+        self._propagated = isinstance(results, PropagatedResults)
+        return results
+
+    def _select_side(self, landmarks, spec):
+        """
+        Giữa 2 keyframe chỉ khớp bên đang dùng được đẩy theo flow, visibility
+        là của keyframe -> giữ bên đã chọn ở keyframe tới keyframe sau.
+        """
+        if self._propagated and self.active_side is not None:
+            return self.active_side
+        return super()._select_side(landmarks, spec)
+
+    def _run_model(self, image):
+        """
+        Chạy pose trên toàn frame hoặc ROI, landmark trả về luôn theo tọa độ
+        chuẩn hóa của toàn frame (để vẽ HUD / state machine không đổi).
+        """
+        h, w = image.shape[:2]
+        if not self.roi_mode or self.lost_counter > 0:
+            self._set_roi(None)
+
+        roi = self._roi
+        if roi is None:
+            results = self._process(np.ascontiguousarray(image))
+        else:
+            x0, y0, x1, y1 = roi
+            crop = self._fit_inference_size(image[y0:y1, x0:x1])
+            results = self._process(crop)
+            if results.pose_landmarks:
+                cw, ch = x1 - x0, y1 - y0
+                for lm in results.pose_landmarks.landmark:
+                    lm.x = (x0 + lm.x * cw) / w
+                    lm.y = (y0 + lm.y * ch) / h
+
+        if self.roi_mode:
+            if results.pose_landmarks:
+                self._track_roi(results.pose_landmarks, w, h)
+            else:
+                self._set_roi(None)
+        return results
+
+    def process_frame(self, frame, exercise_type, draw=True, timestamp=None):
+        """
+        Xử lý 1 frame, trả về frame vẽ + session_data + current_angle.
+        draw=False: bỏ qua vẽ HUD (dùng cho batch/headless).
+        timestamp: thời điểm capture / vị trí trong video (giây).
+        """
+        t0 = time.perf_counter()
+        image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        image.flags.writeable = False
+        results = self._infer(image, exercise_type)
+        t1 = time.perf_counter()
+        self.metrics.record("inference", t1 - t0)
+        if draw:
+            image.flags.writeable = True
+            image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+        else:
+            image = frame
+
+        current_angle = self.analyze(
+            image, results, exercise_type, draw=draw, timestamp=timestamp
+        )
+        self.metrics.record("analysis", time.perf_counter() - t1)
+        return image, self.session_data, current_angle
+
+    def process_rgb(self, image, exercise_type, draw=True, timestamp=None):
+        """
+        Như process_frame nhưng frame vào đã là RGB (buffer từ pipeline):
+        model đọc thẳng buffer, HUD vẽ in-place -> không đổi màu, không copy.
+        """
+        t0 = time.perf_counter()
+        image.flags.writeable = False
+        results = self._infer(image, exercise_type)
+        image.flags.writeable = True
+        t1 = time.perf_counter()
+        self.metrics.record("inference", t1 - t0)
+
+        current_angle = self.analyze(
+            image, results, exercise_type, draw=draw, rgb=True, timestamp=timestamp
+        )
+        self.metrics.record("analysis", time.perf_counter() - t1)
+        return image, self.session_data, current_angle
@@ -0,0 +1,163 @@
+"""
+Truy vấn tiến độ theo bệnh nhân từ rollup ngày / tuần (db.ROLLUP_PERIODS).
+
+Rollup được cộng dồn trong cùng transaction với mỗi INSERT vào sessions
+(utils.insert_session -> db.add_to_rollups), nên báo cáo tiến độ chỉ đọc vài
+chục dòng theo khóa chính (patient, exercise, period) - không quét / parse
+bảng sessions dù có hàng trăm nghìn session.
+
+Ví dụ:
+    rows = progress("Patient_001", "Squat", period="week", since="2026-01-01")
+    trend(rows, "avg_rom")  # ROM % thay đổi mỗi tuần (hồi quy tuyến tính)
+
+    python progress.py Patient_001 --exercise Squat --period week
+"""
+import argparse
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+import db
+
+TREND_KEYS = ("avg_rom", "avg_reps", "avg_range", "avg_fatigue")
+
+
+def _period_key(value, period):
+    """date / datetime / 'YYYY-MM-DD...' -> khóa period (thứ Hai nếu theo tuần)."""
+    if isinstance(value, str):
+        value = date.fromisoformat(value[:10])
+    elif isinstance(value, datetime):
+        value = value.date()
+    if period == "week":
+        value -= timedelta(days=value.weekday())
+    return value.isoformat()
+
+
+def _ratio(total, n):
+    return total / n if n else None
+
+
+def progress(patient_name, exercise=None, period="week", since=None, until=None,
+             database=None):
+    """
+    Tiến độ theo ngày / tuần của 1 bệnh nhân (exercise=None: gộp mọi bài),
+    sắp theo thời gian. Mỗi dòng: period, sessions, reps, avg_reps, duration_s,
+    avg_range (max - min angle), avg_rom / best_rom (%), avg_fatigue (0 Low ..
+    2 High), high_fatigue (số session mệt nhiều). Không có dữ liệu -> None.
+    """
+    table = db.ROLLUP_PERIODS[period][0]
+    sql = (
+        "SELECT period, SUM(sessions), SUM(reps), SUM(duration_s), SUM(range_sum), "
+        "SUM(rom_n), SUM(rom_sum), MAX(rom_best), SUM(fatigue_n), SUM(fatigue_sum), "
+        f"SUM(fatigue_high) FROM {table} WHERE patient_name = ?"
+    )
+    args = [patient_name]
+    if exercise is not None:
+        sql += " AND exercise = ?"
+        args.append(exercise)
+    if since is not None:
+        sql += " AND period >= ?"
+        args.append(_period_key(since, period))
+    if until is not None:
+        sql += " AND period <= ?"
+        args.append(_period_key(until, period))
+    sql += " GROUP BY period ORDER BY period"
+
+    conn = (database or db.get_database()).connection()
+    rows = []
+    for (key, sessions, reps, duration, range_sum, rom_n, rom_sum, rom_best,
+         fatigue_n, fatigue_sum, fatigue_high) in conn.execute(sql, args):
+        rows.append(
+            {
+                "period": key,
+                "sessions": sessions,
+                "reps": reps,
+                "avg_reps": reps / sessions,
+                "duration_s": duration,
+                "avg_range": range_sum / sessions,
+                "avg_rom": _ratio(rom_sum, rom_n),
+                "best_rom": rom_best,
+                "avg_fatigue": _ratio(fatigue_sum, fatigue_n),
+                "high_fatigue": fatigue_high,
+            }
+        )
+    return rows
+
+
+def trend(rows, key="avg_rom"):
+    """Độ dốc (đơn vị của `key` mỗi tuần) qua các period có giá trị; None nếu < 2 điểm."""
+    points = [
+        (date.fromisoformat(r["period"]).toordinal(), r[key])
+        for r in rows
+        if r[key] is not None
+    ]
+    if len(points) < 2:
+        return None
+    x, y = np.array(points, dtype=np.float64).T
+    if np.ptp(x) == 0:
+        return None
+    slope = np.polyfit(x, y, 1)[0]
+    return float(slope * 7.0)
+
+
+def recent_sessions(patient_name, exercise=None, limit=20, database=None):
+    """Các session gần nhất (cột có kiểu, mới nhất trước) - dùng index (patient, exercise, ts)."""
+    sql = (
+        "SELECT id, ts, exercise, reps, min_angle, max_angle, rom_score, fatigue_level, "
+        "calib_min, calib_max, duration_s FROM sessions WHERE patient_name = ?"
+    )
+    args = [patient_name]
+    if exercise is not None:
+        sql += " AND exercise = ?"
+        args.append(exercise)
+    sql += " ORDER BY ts DESC LIMIT ?"
+    args.append(limit)
+
+    keys = ("id", "ts", "exercise", "reps", "min_angle", "max_angle", "rom_score",
+            "fatigue", "calib_min", "calib_max", "duration_s")
+    conn = (database or db.get_database()).connection()
+    out = []
+    for row in conn.execute(sql, args):
+        item = dict(zip(keys, row))
+        if item["fatigue"] is not None:
+            item["fatigue"] = db.FATIGUE_LEVELS[item["fatigue"]]
+        out.append(item)
+    return out
+
+
+def print_progress(rows):
+    def fmt(value, spec):
+        return "-" if value is None else format(value, spec)
+
+    print(f"{'period':10s} {'sess':>5s} {'reps':>6s} {'avg reps':>8s} {'range':>6s} "
+          f"{'ROM %':>6s} {'best':>6s} {'fatigue':>7s}")
+    for r in rows:
+        print(f"{r['period']:10s} {r['sessions']:5d} {r['reps']:6d} {r['avg_reps']:8.1f} "
+              f"{r['avg_range']:6.1f} {fmt(r['avg_rom'], '6.1f')} "
+              f"{fmt(r['best_rom'], '6.1f')} {fmt(r['avg_fatigue'], '7.2f')}")
+    for key in TREND_KEYS:
+        slope = trend(rows, key)
+        if slope is not None:
+            print(f"trend {key}: {slope:+.2f} / week")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Patient progress report")
+    parser.add_argument("patient")
+    parser.add_argument("--exercise", help="Only this exercise (default: all)")
+    parser.add_argument("--period", choices=tuple(db.ROLLUP_PERIODS), default="week")
+    parser.add_argument("--since", help="YYYY-MM-DD")
+    parser.add_argument("--until", help="YYYY-MM-DD")
+    parser.add_argument("--db", default=db.DB_PATH)
+    args = parser.parse_args()
+
+    rows = progress(args.patient, args.exercise, args.period, args.since, args.until,
+                    database=db.get_database(args.db))
+    if not rows:
+        print(f"No sessions for {args.patient}")
+        return
+    print_progress(rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import numpy as np
+
+
+class P2Quantile:
+    """
+    Ước lượng quantile p theo luồng bằng thuật toán P² (Jain & Chlamtac):
+    5 marker, O(1) bộ nhớ và thời gian mỗi mẫu, không giữ lại dữ liệu.
+    Dưới 5 mẫu thì trả về percentile chính xác của các mẫu đã có.
+    """
+    def __init__(self, p):
+        self.p = float(p)
+        self._dn = [0.0, self.p / 2, self.p, (1 + self.p) / 2, 1.0]
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self._first = []
+        self._q = None  # chiều cao marker
+        self._n = None  # vị trí thực
+        p = self.p
+        self._np = [1.0, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5.0]  # vị trí mong muốn
+
+    def add(self, x):
+        x = float(x)
+        self.count += 1
+        if self._q is None:
+            self._first.append(x)
+            if len(self._first) == 5:
+                self._q = sorted(self._first)
+                self._n = [1, 2, 3, 4, 5]
+            return
+
+        q, n = self._q, self._n
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self._np[i] += self._dn[i]
+
+        # Chỉnh 3 marker giữa về vị trí mong muốn
+        for i in range(1, 4):
+            d = self._np[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                qp = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+                )
+                if not q[i - 1] < qp < q[i + 1]:
+                    # Parabol vượt marker kề -> nội suy tuyến tính
+                    qp = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = qp
+                n[i] += d
+
+    def value(self):
+        if self._q is not None:
+            return self._q[2]
+        if not self._first:
+            return None
+        return float(np.percentile(self._first, 100 * self.p))
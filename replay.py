@@ -0,0 +1,228 @@
+"""
+Ghi / phát lại chuỗi landmark để kiểm thử state machine không cần webcam.
+
+Bản ghi (.npz nén): t (giây), landmarks (N, 33, 4) float32 (NaN = không có
+pose), exercise, reps (ground truth, -1 nếu chưa có). Replay đưa landmark qua
+đúng RehabSession.update (filter, stage machine, auto-calib, form rule) -
+không chạy model.
+
+Ví dụ:
+    python replay.py eval recordings/*.npz
+    python replay.py eval recordings/*.npz --truth truth.json --repeat 20
+    python replay.py label recordings/p1_20250101_101010.npz 12
+
+truth.json: {"p1_20250101_101010.npz": 12, ...} (ghi đè reps trong file).
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+# Ngưỡng tốc độ góc của anti-cheat (độ/s), giống RehabSession.update
+TOO_FAST_SPEED = 1200
+
+
+class LandmarkRecorder:
+    """Gom landmark theo frame vào mảng cấp phát trước (tăng gấp đôi khi đầy)."""
+    def __init__(self, path, exercise, capacity=1024):
+        self.path = path
+        self.exercise = exercise
+        self._t = np.empty(capacity, dtype=np.float64)
+        self._landmarks = np.empty((capacity, 33, 4), dtype=np.float32)
+        self._n = 0
+
+    def add(self, t, landmarks):
+        """landmarks: mảng (33, 4) hoặc None nếu frame không có pose."""
+        n = self._n
+        if n == len(self._t):
+            self._t = np.concatenate([self._t, np.empty_like(self._t)])
+            self._landmarks = np.concatenate(
+                [self._landmarks, np.empty_like(self._landmarks)]
+            )
+        self._t[n] = time.time() if t is None else t
+        if landmarks is None:
+            self._landmarks[n] = np.nan
+        else:
+            self._landmarks[n] = landmarks
+        self._n = n + 1
+
+    def __len__(self):
+        return self._n
+
+    @property
+    def timestamps(self):
+        return self._t[: self._n]
+
+    @property
+    def landmarks(self):
+        """View (n, 33, 4) các frame đã ghi (chỉ hợp lệ tới lần add kế tiếp)."""
+        return self._landmarks[: self._n]
+
+    def save(self, reps=None):
+        """Ghi file .npz; reps = ground truth nếu biết."""
+        if not self._n:
+            return None
+        save_recording(
+            self.path, self._t[: self._n], self._landmarks[: self._n],
+            self.exercise, reps,
+        )
+        return self.path
+
+
+def save_recording(path, t, landmarks, exercise, reps=None):
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    np.savez_compressed(
+        path,
+        t=np.asarray(t, dtype=np.float64),
+        landmarks=np.asarray(landmarks, dtype=np.float32),
+        exercise=np.array(exercise),
+        reps=np.array(-1 if reps is None else int(reps)),
+    )
+
+
+def load_recording(path):
+    with np.load(path) as f:
+        reps = int(f["reps"])
+        return {
+            "t": f["t"],
+            "landmarks": f["landmarks"],
+            "exercise": str(f["exercise"]),
+            "reps": None if reps < 0 else reps,
+        }
+
+
+def replay_landmarks(session, landmarks, timestamps, exercise):
+    """
+    Chạy tuần tự session.update trên chuỗi landmark (frame NaN bị bỏ qua).
+    Trả về số lần anti-cheat "Too fast" bật lên.
+    """
+    too_fast = 0
+    was_fast = False
+    for t, lm in zip(timestamps, landmarks):
+        if np.isnan(lm[0, 0]):
+            continue
+        session.update(lm, exercise, timestamp=float(t))
+        fast = session.last_speed > TOO_FAST_SPEED
+        if fast and not was_fast:
+            too_fast += 1
+        was_fast = fast
+    return too_fast
+
+
+def evaluate(paths, truth=None, repeat=1, session_factory=None):
+    """
+    Replay từng bản ghi, so số rep với ground truth.
+    Bản ghi ground truth coi như tập đúng -> mọi lần anti-cheat bật là
+    false positive. Trả về (kết quả từng file, tổng hợp).
+    """
+    if repeat < 1:
+        raise ValueError(f"repeat must be >= 1, got {repeat}")
+    if session_factory is None:
+        from pose_module import RehabSession
+
+        def session_factory():
+            session = RehabSession()
+            session.sound_enabled = False
+            return session
+
+    truth = truth or {}
+    rows = []
+    total_frames = 0
+    total_time = 0.0
+    for path in paths:
+        rec = load_recording(path)
+        expected = truth.get(os.path.basename(path), rec["reps"])
+
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            session = session_factory()
+            too_fast = replay_landmarks(
+                session, rec["landmarks"], rec["t"], rec["exercise"]
+            )
+        elapsed = time.perf_counter() - t0
+
+        frames = len(rec["t"]) * repeat
+        total_frames += frames
+        total_time += elapsed
+        duration = float(rec["t"][-1] - rec["t"][0]) if len(rec["t"]) > 1 else 0.0
+        rows.append(
+            {
+                "file": os.path.basename(path),
+                "exercise": rec["exercise"],
+                "frames": len(rec["t"]),
+                "expected": expected,
+                "counted": session.session_data["reps"],
+                "too_fast": too_fast,
+                "fps": frames / elapsed if elapsed > 0 else float("inf"),
+                "realtime_x": duration * repeat / elapsed if elapsed > 0 else float("inf"),
+            }
+        )
+
+    labelled = [r for r in rows if r["expected"] is not None]
+    expected_total = sum(r["expected"] for r in labelled)
+    abs_error = sum(abs(r["counted"] - r["expected"]) for r in labelled)
+    summary = {
+        "files": len(rows),
+        "labelled": len(labelled),
+        "exact": sum(r["counted"] == r["expected"] for r in labelled),
+        "accuracy": 1.0 - abs_error / expected_total if expected_total else None,
+        "false_positive_too_fast": sum(r["too_fast"] for r in labelled),
+        "fps": total_frames / total_time if total_time > 0 else float("inf"),
+    }
+    return rows, summary
+
+
+def print_report(rows, summary):
+    for r in rows:
+        expected = "-" if r["expected"] is None else r["expected"]
+        print(f"{r['file']:40s} {r['exercise']:12s} reps {r['counted']:3d} / {expected!s:>3s}"
+              f" | too fast {r['too_fast']:2d} | {r['fps']:9.0f} fps"
+              f" ({r['realtime_x']:.0f}x realtime)")
+    if summary["accuracy"] is not None:
+        print(f"Rep accuracy: {100 * summary['accuracy']:.1f}% "
+              f"({summary['exact']}/{summary['labelled']} exact), "
+              f"anti-cheat false positives: {summary['false_positive_too_fast']}")
+    print(f"Throughput: {summary['fps']:.0f} frames/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Landmark recording replay / evaluation")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_eval = sub.add_parser("eval", help="Replay recordings and check rep counts")
+    p_eval.add_argument("recordings", nargs="+")
+    p_eval.add_argument("--truth", help="JSON {file name: reps} overriding stored reps")
+    p_eval.add_argument("--repeat", type=int, default=1, help="Replays per file (throughput)")
+    p_eval.add_argument("--json", help="Also write the report to this JSON file")
+
+    p_label = sub.add_parser("label", help="Store the ground-truth rep count in a recording")
+    p_label.add_argument("recording")
+    p_label.add_argument("reps", type=int)
+
+    args = parser.parse_args()
+    if args.cmd == "eval" and args.repeat < 1:
+        parser.error("--repeat must be >= 1")
+
+    if args.cmd == "label":
+        rec = load_recording(args.recording)
+        save_recording(args.recording, rec["t"], rec["landmarks"], rec["exercise"], args.reps)
+        print(f"{args.recording}: {args.reps} reps")
+        return
+
+    truth = None
+    if args.truth:
+        with open(args.truth, encoding="utf-8") as f:
+            truth = json.load(f)
+    rows, summary = evaluate(args.recordings, truth, repeat=args.repeat)
+    print_report(rows, summary)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"files": rows, "summary": summary}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
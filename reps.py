@@ -0,0 +1,231 @@
+from collections import deque
+
+import numpy as np
+
+from timeseries import STAGE_CODES
+
+
+class RollingTrend:
+    """
+    Hồi quy tuyến tính y theo chỉ số mẫu trên `window` mẫu gần nhất.
+    Giữ các tổng chạy -> thêm mẫu và lấy slope đều O(1).
+    """
+    def __init__(self, window=8):
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        self._values = deque()
+        self._sy = 0.0
+        self._sxy = 0.0
+
+    def add(self, y):
+        self._values.append(float(y))
+        n = len(self._values)
+        self._sy += y
+        self._sxy += (n - 1) * y
+        if n > self.window:
+            # Bỏ mẫu cũ nhất rồi dời gốc x: sxy -= sy (sau khi bỏ)
+            old = self._values.popleft()
+            self._sy -= old
+            self._sxy -= self._sy
+
+    def __len__(self):
+        return len(self._values)
+
+    def mean(self):
+        return self._sy / len(self._values) if self._values else None
+
+    def slope(self):
+        """Độ dốc y / mẫu (None nếu < 2 mẫu)."""
+        n = len(self._values)
+        if n < 2:
+            return None
+        sx = n * (n - 1) / 2.0
+        sxx = (n - 1) * n * (2 * n - 1) / 6.0
+        return (n * self._sxy - sx * self._sy) / (n * sxx - sx * sx)
+
+
+class FatigueTrend:
+    """
+    Xu hướng mệt mỏi theo rep: ROM giảm dần và/hoặc rep chậm dần.
+    Tính theo % thay đổi mỗi rep so với trung bình cửa sổ.
+    """
+    LEVELS = (("High", 2.0, 4.0), ("Moderate", 1.0, 2.0))  # (mức, %ROM giảm, %tempo tăng)
+
+    def __init__(self, window=8, min_reps=4):
+        self.min_reps = min_reps
+        self.rom = RollingTrend(window)
+        self.duration = RollingTrend(window)
+        self.level = None
+
+    def reset(self):
+        self.rom.reset()
+        self.duration.reset()
+        self.level = None
+
+    def add(self, rep):
+        self.rom.add(rep["rom"])
+        self.duration.add(rep["duration"])
+        if len(self.rom) < self.min_reps:
+            return self.level
+
+        rom_drop = -100.0 * self.rom.slope() / max(self.rom.mean(), 1e-6)
+        slow_down = 100.0 * self.duration.slope() / max(self.duration.mean(), 1e-6)
+        self.level = "Low"
+        for level, rom_th, tempo_th in self.LEVELS:
+            if rom_drop > rom_th or slow_down > tempo_th:
+                self.level = level
+                break
+        return self.level
+
+    def summary(self):
+        """Slope hiện tại (để lưu cùng session)."""
+        return {
+            "level": self.level,
+            "rom_slope": self.rom.slope(),
+            "duration_slope": self.duration.slope(),
+        }
+
+
+class RepSegmenter:
+    """
+    Tách rep online từ chuỗi góc đã lọc. Mỗi khi số rep tăng, trả về 1 bản
+    ghi: thời lượng, tempo eccentric (rời tư thế nghỉ -> tới điểm đổi chiều)
+    và concentric (rời điểm đổi chiều -> hoàn thành rep; thời gian giữ ở
+    điểm đổi chiều không tính vào 2 pha), tốc độ góc đỉnh, min/max, ROM.
+
+    turn_at_max=False: điểm gập là góc nhỏ nhất (Squat/Lunges);
+    True: góc lớn nhất (Bicep Curl - rep kết thúc ở tư thế gập).
+    rest_tolerance: góc (độ) quanh tư thế nghỉ / điểm đổi chiều vẫn coi là
+    đang đứng yên ở đó.
+    """
+    def __init__(self, turn_at_max=False, rest_tolerance=5.0):
+        self.turn_at_max = turn_at_max
+        self.rest_tolerance = rest_tolerance
+        self.reset()
+
+    def reset(self):
+        self.reps = 0
+        self._t_start = None
+
+    def _begin(self, t, angle):
+        y = -angle if self.turn_at_max else angle
+        self._t_start = t
+        self._min = self._max = angle
+        self._peak_speed = 0.0
+        self._y_turn = y
+        self._t_turn = t
+        self._t_turn_last = t
+        self._y_rest = y
+        self._t_leave = t
+        self._t_leave_turn = t
+
+    def update(self, t, angle, speed, reps):
+        """Gọi mỗi frame có góc; trả về bản ghi rep khi `reps` tăng, ngược lại None."""
+        if self._t_start is None:
+            self.reps = reps
+            self._begin(t, angle)
+            return None
+
+        y = -angle if self.turn_at_max else angle
+        self._min = min(self._min, angle)
+        self._max = max(self._max, angle)
+        self._peak_speed = max(self._peak_speed, speed)
+
+        # Tư thế nghỉ: lần cuối còn gần đỉnh y trước khi bắt đầu gập
+        if y > self._y_rest:
+            self._y_rest = y
+        if y >= self._y_rest - self.rest_tolerance:
+            self._t_leave = t
+        if y < self._y_turn:
+            self._y_turn = y
+            self._t_turn = t
+            self._t_leave_turn = self._t_leave
+        if y <= self._y_turn + self.rest_tolerance:
+            self._t_turn_last = t
+
+        if reps <= self.reps:
+            return None
+
+        self.reps = reps
+        start = self._t_leave_turn
+        rep = {
+            "rep": reps,
+            "start": start,
+            "end": t,
+            "duration": t - start,
+            "eccentric_s": self._t_turn - start,
+            "concentric_s": t - self._t_turn_last,
+            "peak_velocity": self._peak_speed,
+            "min_angle": self._min,
+            "max_angle": self._max,
+            "rom": self._max - self._min,
+        }
+        self._begin(t, angle)
+        return rep
+
+
+def _run_length(mask):
+    """Độ dài đoạn True liên tiếp kết thúc tại mỗi phần tử (0 nếu False)."""
+    idx = np.arange(len(mask))
+    last_break = np.maximum.accumulate(np.where(mask, -1, idx))
+    return np.where(mask, idx - last_break, 0)
+
+
+def count_reps(angles, down_th, up_th, sign=1, min_frames=3):
+    """
+    Stage machine down/up của RehabSession._step_stage chạy trên cả chuỗi góc
+    bằng NumPy (không vòng lặp Python), kết quả giống hệt bản online.
+
+    angles: góc của các frame có gọi _step_stage (vd. SessionSeries.angle).
+    down_th / up_th: scalar hoặc mảng theo frame; sign, min_frames như
+    CompiledExercise.sign; min_frames = min_stage_s đổi ra số frame theo dt.
+
+    Đủ min_frames frame liên tiếp bên kia ngưỡng thì đổi stage, nên stage chỉ
+    đổi tại frame thứ min_frames của mỗi đoạn "down" / "up" (sự kiện D / U).
+    D luôn đưa stage về "down"; U chỉ đếm rep khi sự kiện ngay trước là D.
+
+    Trả về dict:
+        reps, stage (int8 theo frame, mã timeseries.STAGE_CODES),
+        down_frames (frame vào "down"), rep_frames (frame đếm rep),
+        rep_start (frame vào "down" của từng rep).
+    """
+    a = sign * np.asarray(angles, dtype=np.float64)
+    n = len(a)
+    min_frames = max(int(min_frames), 1)
+    is_down = a < sign * np.asarray(down_th, dtype=np.float64)
+    is_up = ~is_down & (a > sign * np.asarray(up_th, dtype=np.float64))
+
+    d_ev = np.flatnonzero(_run_length(is_down) == min_frames)
+    u_ev = np.flatnonzero(_run_length(is_up) == min_frames)
+    frames = np.concatenate([d_ev, u_ev])
+    ev_up = np.concatenate([np.zeros(len(d_ev), bool), np.ones(len(u_ev), bool)])
+    order = np.argsort(frames, kind="stable")
+    frames, ev_up = frames[order], ev_up[order]
+
+    prev_down = np.concatenate([[False], ~ev_up[:-1]])
+    is_rep = ev_up & prev_down
+    enters_down = ~ev_up & ~prev_down  # D ngay sau D: đã ở "down"
+
+    # Stage theo frame = sự kiện có hiệu lực gần nhất (forward fill)
+    effective = np.flatnonzero(is_rep | enters_down)
+    codes = np.where(ev_up, STAGE_CODES["up"], STAGE_CODES["down"]).astype(np.int8)
+    stage = np.full(n, STAGE_CODES[None], dtype=np.int8)
+    if len(effective):
+        last = np.full(n, -1)
+        last[frames[effective]] = effective
+        last = np.maximum.accumulate(last)
+        seen = last >= 0
+        stage[seen] = codes[last[seen]]
+
+    down_frames = frames[enters_down]
+    rep_frames = frames[is_rep]
+    rep_start = down_frames[np.searchsorted(down_frames, rep_frames) - 1]
+    return {
+        "reps": int(len(rep_frames)),
+        "stage": stage,
+        "down_frames": down_frames,
+        "rep_frames": rep_frames,
+        "rep_start": rep_start,
+    }
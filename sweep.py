@@ -0,0 +1,238 @@
+"""
+Dò tham số stage machine trên các bản ghi landmark có ground truth (replay.py).
+
+Ví dụ:
+    python sweep.py recordings/*.npz --exercise Squat
+    python sweep.py recordings/*.npz --exercise Squat --down 80:100:5 --up 150:170:5 \\
+        --min-stage 0.067,0.1,0.133 --margin 0.1,0.15,0.2 --workers 4 --json sweep.json
+
+Mỗi bản ghi chỉ replay qua RehabSession.update 1 lần để lấy chuỗi góc đã lọc
+(không phụ thuộc ngưỡng). Sau đó với từng bộ tham số:
+- fixed: ngưỡng cố định, không auto-calib -> reps.count_reps (NumPy) trên cả
+  chuỗi, rất nhanh; lưới (DOWN_TH, UP_TH, min_stage_s - đổi ra số frame
+  theo dt của bản ghi).
+- calib: (DOWN_TH, UP_TH) là default ban đầu, auto-calib bật với margin
+  factor -> RehabSession.step_angle từng frame (giống hệt online, chỉ bỏ
+  phần tính góc / filter); lưới thêm margin.
+Các bản ghi và các phần của lưới chạy song song (multiprocessing).
+"""
+import argparse
+import copy
+import json
+import multiprocessing as mp
+import os
+import time
+
+import numpy as np
+
+from exercises import exercise_names, get_exercise
+from replay import load_recording, replay_landmarks
+from reps import count_reps
+
+MODES = ("fixed", "calib")
+CONFIG_KEYS = {
+    "fixed": ("down_th", "up_th", "min_stage_s"),
+    "calib": ("down_th", "up_th", "margin", "min_stage_s"),
+}
+
+
+def parse_grid(text, cast=float):
+    """'80:100:5' -> [80, 85, ..., 100] (gồm cả đầu cuối); '2,3,4' -> [2, 3, 4]."""
+    if ":" in text:
+        start, stop, step = (float(x) for x in text.split(":"))
+        n = int(round((stop - start) / step)) + 1
+        return [cast(round(start + i * step, 6)) for i in range(max(n, 0))]
+    return [cast(x) for x in text.split(",") if x.strip()]
+
+
+def _session():
+    from pose_module import RehabSession
+
+    session = RehabSession()
+    session.sound_enabled = False
+    return session
+
+
+def load_angles(job):
+    """
+    Replay 1 bản ghi -> (file, expected, số rep online, chuỗi góc int, dt
+    trung bình giữa các frame).
+    expected: ground truth truyền vào, không có thì lấy reps lưu trong bản ghi.
+    """
+    path, exercise, expected = job
+    rec = load_recording(path)
+    if rec["exercise"] != exercise:
+        return os.path.basename(path), None, None, None, None
+    if expected is None:
+        expected = rec["reps"]
+    session = _session()
+    replay_landmarks(session, rec["landmarks"], rec["t"], exercise)
+    angles = np.asarray(session.series.angle, dtype=np.int64)
+    return (os.path.basename(path), expected, session.session_data["reps"], angles,
+            session.frame_dt)
+
+
+def exercise_variant(exercise, down_th, up_th, min_stage_s):
+    """Bản sao CompiledExercise với default thresholds / min_stage_s khác."""
+    spec = copy.copy(get_exercise(exercise))
+    spec.default_thresholds = {"DOWN_TH": down_th, "UP_TH": up_th}
+    spec.min_stage_s = min_stage_s
+    return spec
+
+
+def simulate_calibrated(angles, dt, exercise, down_th, up_th, margin, min_stage_s):
+    """Số rep khi chạy online (có auto-calib) trên chuỗi góc đã lọc, dt như bản ghi."""
+    spec = exercise_variant(exercise, down_th, up_th, min_stage_s)
+    session = _session()
+    session.threshold_margin = margin
+    session.frame_dt = dt
+    for angle in angles.tolist():
+        session.step_angle(exercise, angle, spec)
+    return session.session_data["reps"]
+
+
+def _eval_task(task):
+    index, angles, dt, exercise, mode, configs = task
+    if mode == "fixed":
+        sign = get_exercise(exercise).sign
+        counts = [
+            count_reps(angles, d, u, sign, max(1, int(m / dt + 0.5)))["reps"]
+            for d, u, m in configs
+        ]
+    else:
+        counts = [simulate_calibrated(angles, dt, exercise, *cfg) for cfg in configs]
+    return index, mode, configs, counts
+
+
+def _chunks(items, n):
+    size = max(1, -(-len(items) // n))
+    return [items[i : i + size] for i in range(0, len(items), size)]
+
+
+def run_sweep(paths, exercise, downs, ups, min_stages, margins, modes=MODES,
+              truth=None, workers=None):
+    truth = truth or {}
+    workers = workers or max(1, (os.cpu_count() or 2) - 1)
+    grids = {
+        "fixed": [(d, u, m) for d in downs for u in ups for m in min_stages],
+        "calib": [(d, u, g, m) for d in downs for u in ups for g in margins
+                  for m in min_stages],
+    }
+    t0 = time.perf_counter()
+    with mp.Pool(processes=workers) as pool:
+        jobs = [(p, exercise, truth.get(os.path.basename(p))) for p in paths]
+        recordings = []
+        for name, expected, counted, angles, dt in pool.map(load_angles, jobs):
+            if angles is None:
+                print(f"Skip (other exercise): {name}")
+                continue
+            if expected is None:
+                print(f"Skip (no ground truth): {name}")
+                continue
+            recordings.append(
+                {"file": name, "expected": expected, "online": counted, "angles": angles,
+                 "dt": dt}
+            )
+
+        # fixed: 1 task / bản ghi (vectorized); calib: chia lưới theo số worker
+        tasks = []
+        for i, rec in enumerate(recordings):
+            for mode in modes:
+                parts = 1 if mode == "fixed" else workers
+                for configs in _chunks(grids[mode], parts):
+                    tasks.append((i, rec["angles"], rec["dt"], exercise, mode, configs))
+        counts = {mode: {cfg: [None] * len(recordings) for cfg in grids[mode]}
+                  for mode in modes}
+        for i, mode, configs, result in pool.imap_unordered(_eval_task, tasks):
+            for cfg, n in zip(configs, result):
+                counts[mode][cfg][i] = n
+
+    expected = [r["expected"] for r in recordings]
+    expected_total = sum(expected)
+    report = {
+        "exercise": exercise,
+        "recordings": [
+            {"file": r["file"], "expected": r["expected"], "online": r["online"],
+             "frames": int(len(r["angles"]))}
+            for r in recordings
+        ],
+        "elapsed_s": time.perf_counter() - t0,
+        "modes": {},
+    }
+    for mode in modes:
+        rows = []
+        for cfg, got in counts[mode].items():
+            abs_error = sum(abs(g - e) for g, e in zip(got, expected))
+            row = dict(zip(CONFIG_KEYS[mode], cfg))
+            row.update(
+                abs_error=abs_error,
+                exact=sum(g == e for g, e in zip(got, expected)),
+                accuracy=1.0 - abs_error / expected_total if expected_total else None,
+            )
+            rows.append(row)
+        rows.sort(key=lambda r: (r["abs_error"], -r["exact"]))
+        report["modes"][mode] = rows
+    return report
+
+
+def print_sweep(report, top=10):
+    recs = report["recordings"]
+    frames = sum(r["frames"] for r in recs)
+    print(f"{report['exercise']}: {len(recs)} recordings, {frames} frames, "
+          f"{report['elapsed_s']:.1f}s")
+    for mode, rows in report["modes"].items():
+        configs = len(rows)
+        print(f"\n[{mode}] {configs} configs, best {min(top, configs)}:")
+        keys = CONFIG_KEYS[mode]
+        for row in rows[:top]:
+            params = " ".join(f"{k}={row[k]:g}" for k in keys)
+            acc = "-" if row["accuracy"] is None else f"{100 * row['accuracy']:.1f}%"
+            print(f"  {params:48s} abs err {row['abs_error']:4d} | "
+                  f"exact {row['exact']}/{len(recs)} | accuracy {acc}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stage machine parameter sweep")
+    parser.add_argument("recordings", nargs="+", help="Landmark recordings (.npz)")
+    parser.add_argument("--exercise", required=True, choices=exercise_names())
+    parser.add_argument("--down", help="DOWN_TH grid, 'start:stop:step' or 'a,b,c' "
+                                       "(default: registered value +-15 step 5)")
+    parser.add_argument("--up", help="UP_TH grid (default: registered value +-15 step 5)")
+    parser.add_argument("--min-stage", default="0.067,0.1,0.133",
+                        help="Seconds past a threshold before the stage changes (grid)")
+    parser.add_argument("--margin", default="0.1,0.15,0.2",
+                        help="Auto-calibration margin factor grid (calib mode)")
+    parser.add_argument("--mode", choices=MODES + ("both",), default="both")
+    parser.add_argument("--truth", help="JSON {file name: reps} overriding stored reps")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--json", help="Write the full report to this JSON file")
+    args = parser.parse_args()
+
+    defaults = get_exercise(args.exercise).default_thresholds
+    down = args.down or f"{defaults['DOWN_TH'] - 15}:{defaults['DOWN_TH'] + 15}:5"
+    up = args.up or f"{defaults['UP_TH'] - 15}:{defaults['UP_TH'] + 15}:5"
+    truth = None
+    if args.truth:
+        with open(args.truth, encoding="utf-8") as f:
+            truth = json.load(f)
+
+    report = run_sweep(
+        args.recordings,
+        args.exercise,
+        parse_grid(down, int),
+        parse_grid(up, int),
+        parse_grid(args.min_stage, float),
+        parse_grid(args.margin, float),
+        modes=MODES if args.mode == "both" else (args.mode,),
+        truth=truth,
+        workers=args.workers,
+    )
+    print_sweep(report, args.top)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
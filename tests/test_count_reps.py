@@ -0,0 +1,86 @@
+"""reps.count_reps (NumPy) phải đếm giống hệt RehabSession._step_stage (online)."""
+import numpy as np
+import pytest
+
+from exercises import get_exercise
+from pose_module import RehabSession
+from reps import count_reps
+from timeseries import STAGE_CODES
+
+
+def _online(spec, angles, down_th, up_th, min_frames):
+    session = RehabSession()
+    session.sound_enabled = False
+    # _frames(min_stage_s) == min_frames
+    session.frame_dt = spec.min_stage_s / min_frames
+    down = np.broadcast_to(down_th, angles.shape)
+    up = np.broadcast_to(up_th, angles.shape)
+    stage = []
+    for angle, d, u in zip(angles, down, up):
+        session._step_stage(spec, angle, d, u)
+        stage.append(STAGE_CODES[session.session_data["stage"]])
+    return session.session_data["reps"], np.array(stage, dtype=np.int8)
+
+
+def _check(spec, angles, down_th, up_th, min_frames):
+    reps, stage = _online(spec, angles, down_th, up_th, min_frames)
+    out = count_reps(angles, down_th, up_th, spec.sign, min_frames)
+    assert out["reps"] == reps
+    np.testing.assert_array_equal(out["stage"], stage)
+    return reps
+
+
+@pytest.mark.parametrize("exercise", ["Squat", "Bicep Curl"])
+@pytest.mark.parametrize("min_frames", [1, 2, 3, 5])
+def test_random_traces_match_online(exercise, min_frames):
+    spec = get_exercise(exercise)
+    down_th = spec.default_thresholds["DOWN_TH"]
+    up_th = spec.default_thresholds["UP_TH"]
+    lo, hi = sorted((down_th, up_th))
+    rng = np.random.default_rng(min_frames)
+    total = 0
+    for _ in range(20):
+        # Random walk quanh 2 ngưỡng + nhảy ngẫu nhiên -> nhiều đoạn ngắn sát min_frames
+        n = int(rng.integers(50, 400))
+        steps = rng.normal(0, 12, n) + rng.choice([0, 60, -60], n, p=[0.9, 0.05, 0.05])
+        angles = np.clip((lo + hi) / 2 + np.cumsum(steps), lo - 40, hi + 40)
+        angles = np.round(angles)  # góc nguyên như _step_stage nhận, hay chạm đúng ngưỡng
+        total += _check(spec, angles, down_th, up_th, min_frames)
+    assert total > 0
+
+
+@pytest.mark.parametrize("min_frames", [1, 2, 3])
+def test_min_stage_debounce_edges(min_frames):
+    spec = get_exercise("Squat")
+    down_th, up_th = 90, 160
+    m = min_frames
+    mid = 120
+    cases = [
+        # Đoạn down / up dài đúng m frame: đủ đổi stage -> 1 rep
+        [mid] * 3 + [80] * m + [mid] * 2 + [170] * m + [mid] * 2,
+        # Ngắn hơn m 1 frame: không đổi stage (m = 1 thì đoạn rỗng)
+        [mid] * 3 + [80] * (m - 1) + [mid] * 2 + [170] * m + [mid] * 2,
+        [mid] * 3 + [80] * m + [mid] * 2 + [170] * (m - 1) + [mid] * 2,
+        # Đúng bằng ngưỡng không tính là bên kia ngưỡng (so sánh chặt)
+        [mid] + [down_th] * (m + 2) + [up_th] * (m + 2) + [80] * m + [170] * m,
+        # Up trước khi từng down: không đếm
+        [170] * (m + 3) + [80] * m + [170] * (2 * m + 3),
+        # Down bị ngắt bởi frame giữa 2 ngưỡng: đếm lại từ đầu
+        ([80] * (m - 1) + [mid]) * 3 + [170] * m,
+        # Down -> up -> down -> up liền nhau
+        ([80] * m + [170] * m) * 4,
+    ]
+    for case in cases:
+        _check(spec, np.array(case, dtype=np.float64), down_th, up_th, m)
+
+
+def test_per_frame_thresholds_match_online():
+    spec = get_exercise("Squat")
+    rng = np.random.default_rng(7)
+    n = 600
+    t = np.arange(n) / 30.0
+    angles = np.round(125 + 50 * np.sin(2 * np.pi * t / 2.0) + rng.normal(0, 4, n))
+    # Ngưỡng đổi dần như sau auto-calib
+    down_th = np.round(np.linspace(85, 100, n))
+    up_th = np.round(np.linspace(170, 160, n))
+    assert _check(spec, angles, down_th, up_th, 3) > 0
@@ -0,0 +1,187 @@
+"""DB baseline (chỉ bảng sessions gốc) -> migrate v1..v3; rollup cộng dồn == tính lại."""
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+import db
+import utils
+
+# Schema sessions trước khi có db.py (utils tạo bảng trực tiếp)
+BASELINE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS sessions
+    (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp TEXT,
+        patient_name TEXT,
+        exercise TEXT,
+        reps INTEGER,
+        min_angle REAL,
+        max_angle REAL,
+        assessment TEXT
+    )
+"""
+
+# (timestamp, patient, exercise, reps, min, max, assessment, rom, fatigue level)
+LEGACY_ROWS = [
+    ("2026-03-02 08:15:00", "P1", "Squat", 12, 85.0, 168.0,
+     "Excellent | ROM 87.3% | Fatigue Low", 87.3, 0),
+    ("2026-03-02 18:40:10", "P1", "Squat", 6, 92.0, 160.0,
+     "Good | ROM 61.0% | Fatigue High", 61.0, 2),
+    ("2026-03-04 09:00:00", "P1", "Squat", 3, 100.0, 150.0, "Keep Trying", None, None),
+    ("2026-03-09 10:30:00", "P1", "Lunges", 8, 95.0, 165.0,
+     "Good | Fatigue Moderate", None, 1),
+    ("2026-03-10 07:05:00", "P2", "Bicep Curl", 15, 40.0, 155.0,
+     "Excellent | ROM 102.5%", 102.5, None),
+]
+
+
+def _rows(conn, table):
+    cur = conn.execute(f"SELECT * FROM {table} ORDER BY patient_name, exercise, period")
+    return [tuple(round(v, 6) if isinstance(v, float) else v for v in row) for row in cur]
+
+
+@pytest.fixture
+def legacy_db(tmp_path):
+    path = str(tmp_path / "rehab_data.db")
+    conn = sqlite3.connect(path)
+    conn.execute(BASELINE_SCHEMA)
+    conn.executemany(
+        "INSERT INTO sessions (timestamp, patient_name, exercise, reps, min_angle, "
+        "max_angle, assessment) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [row[:7] for row in LEGACY_ROWS],
+    )
+    conn.commit()
+    conn.close()
+    return path
+
+
+def test_migrate_backfills_typed_columns(legacy_db):
+    database = db.Database(legacy_db)
+    conn = database.connection()
+    assert db.schema_version(conn) == db.SCHEMA_VERSION
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert {"model_switches", "rep_metrics", "session_metrics", "session_series",
+            "series_chunks", "series_reps", "feedback_texts", "session_daily",
+            "session_weekly"} <= tables
+
+    rows = conn.execute(
+        "SELECT timestamp, ts, rom_score, fatigue_level, calib_min, calib_max, duration_s "
+        "FROM sessions ORDER BY id"
+    ).fetchall()
+    assert len(rows) == len(LEGACY_ROWS)
+    for (timestamp, ts, rom, fatigue, calib_min, calib_max, duration), legacy in zip(
+        rows, LEGACY_ROWS
+    ):
+        # timestamp text là giờ local, như session_record
+        assert ts == int(datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S").timestamp())
+        if legacy[7] is None:
+            assert rom is None
+        else:
+            assert rom == pytest.approx(legacy[7])
+        assert fatigue == legacy[8]
+        assert (calib_min, calib_max, duration) == (None, None, None)
+
+    indexes = {row[1] for row in conn.execute("PRAGMA index_list(sessions)")}
+    assert "idx_sessions_patient" in indexes
+    plan = " ".join(
+        row[-1] for row in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT id FROM sessions WHERE patient_name = ? "
+            "AND exercise = ? ORDER BY ts DESC LIMIT 5", ("P1", "Squat")
+        )
+    )
+    assert "idx_sessions_patient" in plan
+
+    # Mở lại không migrate / backfill lần 2
+    database.close()
+    conn = db.Database(legacy_db).connection()
+    assert db.schema_version(conn) == db.SCHEMA_VERSION
+    assert conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0] == len(LEGACY_ROWS)
+
+
+def test_incremental_rollups_match_rebuild(legacy_db):
+    database = db.Database(legacy_db)
+    conn = database.connection()
+    migrated = {table: _rows(conn, table) for table, _ in db.ROLLUP_PERIODS.values()}
+    assert migrated["session_daily"] and migrated["session_weekly"]
+
+    # Session mới qua utils.insert_session: cùng ngày / tuần với dữ liệu cũ,
+    # ngày / tuần mới, bệnh nhân mới, rom / fatigue có và không
+    start = datetime(2026, 3, 2, 12, 0, 0)
+    fatigue = [None, "Low", "Moderate", "High"]
+    with database.transaction() as tx:
+        for i in range(40):
+            when = start + timedelta(hours=7 * i)
+            record = utils.session_record(
+                f"P{1 + i % 3}", ("Squat", "Lunges")[i % 2], 4 + i % 9,
+                80.0 + i % 7, 150.0 + i % 11,
+                rom_score=None if i % 5 == 0 else 50.0 + 1.7 * i,
+                fatigue_flag=fatigue[i % 4],
+                duration_s=30.0 + i,
+            )
+            record["timestamp"] = when.strftime("%Y-%m-%d %H:%M:%S")
+            record["ts"] = int(when.timestamp())
+            utils.insert_session(tx, record)
+
+    incremental = {table: _rows(conn, table) for table, _ in db.ROLLUP_PERIODS.values()}
+    with database.transaction() as tx:
+        db.rebuild_rollups(tx)
+    rebuilt = {table: _rows(conn, table) for table, _ in db.ROLLUP_PERIODS.values()}
+    assert incremental == rebuilt
+    for table, rows in migrated.items():
+        assert len(incremental[table]) > len(rows)
+
+
+REP = {"rep": 1, "start": 0.5, "duration": 2.0, "eccentric_s": 1.1, "concentric_s": 0.9,
+       "peak_velocity": 80.0, "min_angle": 85.0, "max_angle": 165.0, "rom": 80.0}
+
+
+def _journal_rep(conn, series_id):
+    conn.execute(
+        "INSERT INTO session_series (id, patient_name, exercise, n_joints, status) "
+        "VALUES (?, 'P1', 'Squat', 0, 'closed')",
+        (series_id,),
+    )
+    conn.execute(
+        "INSERT INTO series_reps (series_id, rep, start_s, duration_s, eccentric_s, "
+        "concentric_s, peak_velocity, min_angle, max_angle, rom) "
+        "VALUES (?, 1, 0.5, 2.0, 1.1, 0.9, 80.0, 85.0, 165.0, 80.0)",
+        (series_id,),
+    )
+
+
+def test_reps_stored_once_and_read_through_session_reps(tmp_path):
+    database = db.Database(str(tmp_path / "rehab_data.db"))
+    with database.transaction() as tx:
+        _journal_rep(tx, "s1")
+        journaled = utils.insert_session(
+            tx, utils.session_record("P1", "Squat", 1, 85.0, 165.0),
+            rep_records=[REP], series_id="s1",
+        )
+        plain = utils.insert_session(
+            tx, utils.session_record("P2", "Squat", 1, 85.0, 165.0), rep_records=[REP]
+        )
+    conn = database.connection()
+    assert conn.execute("SELECT session_id FROM rep_metrics").fetchall() == [(plain,)]
+    rows = conn.execute("SELECT session_id, rep, rom FROM session_reps ORDER BY session_id")
+    assert rows.fetchall() == [(journaled, 1, 80.0), (plain, 1, 80.0)]
+
+
+def test_v4_drops_reps_duplicated_by_journal(tmp_path):
+    path = str(tmp_path / "rehab_data.db")
+    conn = sqlite3.connect(path, isolation_level=None)
+    db.migrate(conn, db.MIGRATIONS[:3])
+    # Bản v3 ghi rep của session có journal vào cả rep_metrics
+    for session_id, series_id in ((1, "s1"), (2, None)):
+        if series_id:
+            _journal_rep(conn, series_id)
+            conn.execute("UPDATE session_series SET session_id = ? WHERE id = ?",
+                         (session_id, series_id))
+        conn.execute("INSERT INTO rep_metrics (session_id, rep, rom) VALUES (?, 1, 80.0)",
+                     (session_id,))
+    conn.close()
+
+    conn = db.Database(path).connection()
+    assert conn.execute("SELECT session_id FROM rep_metrics").fetchall() == [(2,)]
+    rows = conn.execute("SELECT session_id, rep FROM session_reps ORDER BY session_id")
+    assert rows.fetchall() == [(1, 1), (2, 1)]
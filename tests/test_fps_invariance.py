@@ -0,0 +1,24 @@
+"""Cùng 1 chuyển động squat, replay ở 15 / 30 / 60 FPS phải đếm cùng số rep."""
+import numpy as np
+import pytest
+
+from benchmark import synthetic_landmarks
+from pose_module import RehabSession
+from replay import replay_landmarks
+
+REPS = 10
+
+
+def _count_reps(fps, period):
+    n = int(fps * period * REPS) + int(fps)  # thêm 1 s để rep cuối kịp đứng lên
+    landmarks = synthetic_landmarks(n, fps=fps, period=period)
+    session = RehabSession()
+    session.sound_enabled = False
+    replay_landmarks(session, landmarks, np.arange(n) / fps, "Squat")
+    return session.session_data["reps"]
+
+
+@pytest.mark.parametrize("period", [3.0, 2.0])
+def test_rep_count_same_at_15_30_60_fps(period):
+    counts = {fps: _count_reps(fps, period) for fps in (15, 30, 60)}
+    assert set(counts.values()) == {REPS}, counts
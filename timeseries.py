@@ -0,0 +1,207 @@
+import os
+
+import numpy as np
+
+# Mã hóa stage thành int8 (0 = chưa có stage)
+STAGE_CODES = {None: 0, "down": 1, "up": 2}
+STAGE_NAMES = {code: name for name, code in STAGE_CODES.items()}
+
+# Feedback text -> mã int16 trong process (0 = không có); cấp dần khi gặp text mới
+FEEDBACK_TEXTS = [""]
+_FEEDBACK_CODES = {"": 0, None: 0}
+
+
+def feedback_code(text):
+    code = _FEEDBACK_CODES.get(text)
+    if code is None:
+        code = _FEEDBACK_CODES[text] = len(FEEDBACK_TEXTS)
+        FEEDBACK_TEXTS.append(text)
+    return code
+
+
+class SessionSeries:
+    """
+    Chuỗi thời gian theo frame của 1 session, lưu theo cột trong mảng NumPy
+    cấp phát trước (tăng gấp đôi khi đầy):
+        t (float64, giây), angle (float32, góc khớp chính),
+        angles (float32, n_joints góc đã lọc), stage (int8), visibility (float32),
+        feedback (int16, mã feedback_code).
+
+    ~55 byte/frame với 9 góc -> ~5.9 MB mỗi giờ @30 FPS.
+
+    max_rows: giới hạn số dòng giữ trong RAM. Khi chạm giới hạn, nửa cũ nhất
+    được ghi nối vào `spill_path` (nếu có, nhiều khối np.save liên tiếp) rồi
+    bỏ khỏi bộ nhớ; nửa còn lại dời về đầu mảng nên các view vẫn liên tục.
+    Các thuộc tính t / angle / ... là view (không copy) của phần đang giữ.
+    Min góc theo khối MIN_BLOCK dòng được giữ cho cả session (kể cả phần đã
+    spill) -> angle_min_thirds() vẫn đúng cho cả session sau khi spill.
+    """
+    MIN_BLOCK = 32
+
+    def __init__(self, n_joints=0, capacity=1024, max_rows=None, spill_path=None):
+        self.n_joints = n_joints
+        self.max_rows = max_rows
+        self.spill_path = spill_path
+        if max_rows is not None:
+            capacity = min(capacity, max_rows)
+        self._alloc(max(capacity, 16))
+        self._n = 0
+        self.spilled = 0  # số dòng đã ghi ra đĩa / bỏ khỏi RAM
+        self.t_first = None  # timestamp dòng đầu tiên (giữ lại cả khi đã spill)
+        self._block_min = []  # min góc của từng khối MIN_BLOCK dòng đã đủ
+        self._cur_min = np.inf
+
+    def _alloc(self, capacity):
+        self._t = np.empty(capacity, dtype=np.float64)
+        self._angle = np.empty(capacity, dtype=np.float32)
+        self._angles = np.empty((capacity, self.n_joints), dtype=np.float32)
+        self._stage = np.empty(capacity, dtype=np.int8)
+        self._visibility = np.empty(capacity, dtype=np.float32)
+        self._feedback = np.empty(capacity, dtype=np.int16)
+
+    def _columns(self):
+        return (self._t, self._angle, self._angles, self._stage, self._visibility,
+                self._feedback)
+
+    def _grow(self):
+        capacity = len(self._t) * 2
+        if self.max_rows is not None:
+            capacity = min(capacity, self.max_rows)
+        old = self._columns()
+        self._alloc(capacity)
+        for dst, src in zip(self._columns(), old):
+            dst[: self._n] = src[: self._n]
+
+    def _spill(self):
+        """Đẩy nửa cũ nhất ra đĩa (nếu có spill_path) và dời phần còn lại."""
+        k = self._n // 2
+        if self.spill_path:
+            with open(self.spill_path, "ab") as f:
+                np.save(f, self.to_records(0, k))
+        for col in self._columns():
+            col[: self._n - k] = col[k : self._n]
+        self._n -= k
+        self.spilled += k
+
+    def append(self, t, angle, angles=None, stage=None, visibility=1.0, feedback=0):
+        n = self._n
+        if n == len(self._t):
+            if self.max_rows is not None and n >= self.max_rows:
+                self._spill()
+                n = self._n
+            else:
+                self._grow()
+        if self.t_first is None:
+            self.t_first = t
+        self._t[n] = t
+        self._angle[n] = angle
+        if self.n_joints and angles is not None:
+            self._angles[n] = angles
+        self._stage[n] = STAGE_CODES.get(stage, 0)
+        self._visibility[n] = visibility
+        self._feedback[n] = feedback
+        self._n = n + 1
+        if angle < self._cur_min:
+            self._cur_min = float(angle)
+        if (self.spilled + self._n) % self.MIN_BLOCK == 0:
+            self._block_min.append(self._cur_min)
+            self._cur_min = np.inf
+
+    def clear(self):
+        self._n = 0
+        self.spilled = 0
+        self.t_first = None
+        self._block_min = []
+        self._cur_min = np.inf
+
+    def angle_min_thirds(self):
+        """
+        (min góc 1/3 đầu, min góc 1/3 cuối) của cả session. Chưa spill: tính
+        đúng trên từng dòng; đã spill: trên min theo khối MIN_BLOCK dòng.
+        """
+        if not self.spilled:
+            angle = self.angle
+            n = len(angle)
+            return angle[: n // 3].min(), angle[-n // 3 :].min()
+        blocks = self._block_min
+        if self.total % self.MIN_BLOCK:
+            blocks = blocks + [self._cur_min]
+        k = max(len(blocks) // 3, 1)
+        return min(blocks[:k]), min(blocks[-k:])
+
+    def __len__(self):
+        return self._n
+
+    # --- View không copy (chỉ hợp lệ tới lần append / spill kế tiếp) ---
+
+    @property
+    def t(self):
+        return self._t[: self._n]
+
+    @property
+    def angle(self):
+        return self._angle[: self._n]
+
+    @property
+    def angles(self):
+        return self._angles[: self._n]
+
+    @property
+    def stage(self):
+        return self._stage[: self._n]
+
+    @property
+    def visibility(self):
+        return self._visibility[: self._n]
+
+    @property
+    def feedback(self):
+        return self._feedback[: self._n]
+
+    @property
+    def duration(self):
+        """Giây từ dòng đầu tiên tới dòng cuối (0 nếu chưa có dữ liệu)."""
+        if not self._n:
+            return 0.0
+        return float(self._t[self._n - 1] - self.t_first)
+
+    @property
+    def total(self):
+        """Số dòng đã append từ đầu session (kể cả phần đã spill)."""
+        return self.spilled + self._n
+
+    @property
+    def nbytes(self):
+        return sum(col.nbytes for col in self._columns())
+
+    def to_records(self, start=0, stop=None):
+        """Copy các dòng [start, stop) thành structured array (để lưu / spill)."""
+        stop = self._n if stop is None else stop
+        dtype = [
+            ("t", "f8"),
+            ("angle", "f4"),
+            ("angles", "f4", (self.n_joints,)),
+            ("stage", "i1"),
+            ("visibility", "f4"),
+            ("feedback", "i2"),
+        ]
+        out = np.empty(stop - start, dtype=dtype)
+        out["t"] = self._t[start:stop]
+        out["angle"] = self._angle[start:stop]
+        out["angles"] = self._angles[start:stop]
+        out["stage"] = self._stage[start:stop]
+        out["visibility"] = self._visibility[start:stop]
+        out["feedback"] = self._feedback[start:stop]
+        return out
+
+
+def load_spilled(path):
+    """Đọc lại toàn bộ các khối đã spill ra `path` (structured array)."""
+    if not path or not os.path.exists(path):
+        return None
+    blocks = []
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        while f.tell() < size:
+            blocks.append(np.load(f))
+    return np.concatenate(blocks) if blocks else None
@@ -0,0 +1,116 @@
+import cv2
+import numpy as np
+from mediapipe.framework.formats import landmark_pb2
+
+
+class PropagatedResults:
+    """Giả lập kết quả Pose.process (chỉ có pose_landmarks) cho frame không chạy model."""
+    def __init__(self, pose_landmarks):
+        self.pose_landmarks = pose_landmarks
+
+
+class KeyframeScheduler:
+    """
+    Chỉ chạy Pose.process trên keyframe; giữa các keyframe, các khớp đang
+    theo dõi được đẩy theo optical flow (Lucas-Kanade thưa).
+
+    - Keyframe bắt buộc khi: chưa có landmark, mất tracking (force), quá
+      max_interval frame, flow lỗi (status / forward-backward > fb_error_px)
+      hoặc chuyển động lớn (> max_motion_px) - lúc đó flow kém tin cậy.
+    - Idle: ảnh thu nhỏ gần như không đổi trong idle_frames frame -> chỉ chạy
+      model mỗi idle_interval frame, các frame còn lại chỉ chạy flow.
+    """
+    def __init__(self, max_interval=4, fb_error_px=1.5, max_motion_px=20.0,
+                 idle_diff=1.5, idle_frames=15, idle_interval=15):
+        self.max_interval = max_interval
+        self.fb_error_px = fb_error_px
+        self.max_motion_px = max_motion_px
+        self.idle_diff = idle_diff
+        self.idle_frames = idle_frames
+        self.idle_interval = idle_interval
+        self.lk_params = dict(
+            winSize=(21, 21),
+            maxLevel=3,
+            criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03),
+        )
+        self.stats = {"keyframes": 0, "propagated": 0, "idle": 0}
+        self.reset()
+
+    def reset(self):
+        self._landmarks = None
+        self._prev_gray = None
+        self._prev_thumb = None
+        self.frames_since_key = 0
+        self.still_frames = 0
+
+    @property
+    def idle(self):
+        return self.still_frames >= self.idle_frames
+
+    def step(self, image_rgb, tracked, run_model, force=False):
+        """
+        Trả về results (có .pose_landmarks, tọa độ chuẩn hóa toàn frame).
+        tracked: index landmark cần đẩy theo flow; run_model(image) -> results.
+        """
+        gray = cv2.cvtColor(image_rgb, cv2.COLOR_RGB2GRAY)
+        thumb = cv2.resize(gray, (80, 60), interpolation=cv2.INTER_AREA)
+        if self._prev_thumb is not None:
+            diff = float(cv2.absdiff(thumb, self._prev_thumb).mean())
+            self.still_frames = self.still_frames + 1 if diff < self.idle_diff else 0
+        self._prev_thumb = thumb
+
+        self.frames_since_key += 1
+        interval = self.idle_interval if self.idle else self.max_interval
+        results = None
+        if not (force or self._landmarks is None or self.frames_since_key >= interval):
+            # Flow trên vài điểm rẻ hơn model rất nhiều -> vẫn chạy cả khi idle
+            # để chuyển động chậm không bị trôi giữa 2 keyframe
+            results = self._propagate(gray, tracked)
+            if results is not None and self.idle:
+                self.stats["idle"] += 1
+
+        if results is None:
+            results = run_model(image_rgb)
+            self._landmarks = results.pose_landmarks
+            self.frames_since_key = 0
+            self.stats["keyframes"] += 1
+
+        self._prev_gray = gray
+        return results
+
+    def _propagate(self, gray, tracked):
+        """Đẩy các khớp tracked theo LK flow; None nếu cần keyframe."""
+        h, w = gray.shape
+        src = self._landmarks.landmark
+        idx = [i for i in tracked if src[i].visibility >= 0.3]
+        if not idx:
+            return None
+
+        p0 = np.array(
+            [[src[i].x * w, src[i].y * h] for i in idx], dtype=np.float32
+        ).reshape(-1, 1, 2)
+        p1, st1, _ = cv2.calcOpticalFlowPyrLK(
+            self._prev_gray, gray, p0, None, **self.lk_params
+        )
+        if p1 is None or not st1.all():
+            return None
+        p0_back, st2, _ = cv2.calcOpticalFlowPyrLK(
+            gray, self._prev_gray, p1, None, **self.lk_params
+        )
+        if p0_back is None or not st2.all():
+            return None
+
+        fb_error = np.linalg.norm(p0 - p0_back, axis=2).max()
+        motion = np.linalg.norm(p1 - p0, axis=2).max()
+        if fb_error > self.fb_error_px or motion > self.max_motion_px:
+            return None
+
+        landmarks = landmark_pb2.NormalizedLandmarkList()
+        landmarks.CopyFrom(self._landmarks)
+        for i, (x, y) in zip(idx, p1.reshape(-1, 2)):
+            landmarks.landmark[i].x = float(x) / w
+            landmarks.landmark[i].y = float(y) / h
+
+        self._landmarks = landmarks
+        self.stats["propagated"] += 1
+        return PropagatedResults(landmarks)
@@ -1,10 +1,13 @@
 import pygame
 import numpy as np
 import csv
+import json
 import os
+import tkinter as tk
 from datetime import datetime
-import matplotlib.pyplot as plt
-import sqlite3
+from PIL import ImageTk
+import chart
+import db
 
 
 # --- 1. AUDIO SETUP ---
@@ -49,33 +52,32 @@ def play_error():
 
 # --- 2. DATABASE SETUP ---
 def init_db():
-    """Khởi tạo Database nếu chưa tồn tại"""
+    """
+    Mở DB và chạy migration schema (db.MIGRATIONS) - gọi 1 lần lúc khởi động.
+    Các lần ghi sau dùng connection sống lâu của db.DatabaseWriter.
+    """
     try:
-        conn = sqlite3.connect("rehab_data.db")
-        c = conn.cursor()
-        c.execute(
-            """
-            CREATE TABLE IF NOT EXISTS sessions
-            (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TEXT,
-                patient_name TEXT,
-                exercise TEXT,
-                reps INTEGER,
-                min_angle REAL,
-                max_angle REAL,
-                assessment TEXT
-            )
-        """
-        )
-        conn.commit()
-        conn.close()
+        db.get_database().connection()
+        return True
     except Exception as e:
         print(f"DB Init Error: {e}")
+        return False
 
 
 # --- 3. Lưu dữ liệu phiên tập ---
-def log_session(
+CSV_FILE = "rehab_log.csv"
+CSV_HEADER = [
+    "Timestamp",
+    "Patient ID",
+    "Exercise",
+    "Reps",
+    "Min_Angle",
+    "Max_Angle",
+    "Assessment",
+]
+
+
+def session_record(
     patient_name,
     exercise_name,
     reps,
@@ -83,15 +85,14 @@ def log_session(
     max_rom_ext,
     rom_score=None,
     fatigue_flag=None,
+    calib_min=None,
+    calib_max=None,
+    duration_s=None,
 ):
     """
-    Lưu dữ liệu vào cả CSV (để xem nhanh) và SQLite (để quản lý hệ thống)
-    rom_score (%), fatigue_flag ('Low'/'Moderate'/'High') được thêm vào assessment.
+    Dòng tóm tắt 1 session: assessment dạng text như cũ (CSV) + các cột có
+    kiểu cho truy vấn tiến độ (ts, rom_score, fatigue_level, calib, thời lượng).
     """
-    init_db()
-
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
     if reps >= 10:
         base_assess = "Excellent"
     elif reps >= 5:
@@ -110,85 +111,227 @@ def log_session(
     else:
         assessment = base_assess
 
-    try:
-        # CSV
-        filename = "rehab_log.csv"
-        file_exists = os.path.isfile(filename)
-
-        with open(filename, mode="a", newline="") as file:
-            writer = csv.writer(file)
-            if not file_exists:
-                writer.writerow(
-                    [
-                        "Timestamp",
-                        "Patient ID",
-                        "Exercise",
-                        "Reps",
-                        "Min_Angle",
-                        "Max_Angle",
-                        "Assessment",
-                    ]
-                )
-            writer.writerow(
-                [
-                    timestamp,
-                    patient_name,
-                    exercise_name,
-                    reps,
-                    max_rom_flex,
-                    max_rom_ext,
-                    assessment,
-                ]
-            )
-
-        # SQLite
-        conn = sqlite3.connect("rehab_data.db")
-        c = conn.cursor()
-        c.execute(
+    now = datetime.now()
+    return {
+        "timestamp": now.strftime("%Y-%m-%d %H:%M:%S"),
+        "ts": int(now.timestamp()),
+        "patient_name": patient_name,
+        "exercise": exercise_name,
+        "reps": reps,
+        "min_angle": max_rom_flex,
+        "max_angle": max_rom_ext,
+        "assessment": assessment,
+        "rom_score": rom_score,
+        "fatigue_level": (
+            db.FATIGUE_LEVELS.index(fatigue_flag)
+            if fatigue_flag in db.FATIGUE_LEVELS else None
+        ),
+        "calib_min": calib_min,
+        "calib_max": calib_max,
+        "duration_s": duration_s,
+    }
+
+
+def insert_session(conn, record, model_switches=None, rep_records=None, metrics=None,
+                   series_id=None):
+    """
+    Ghi 1 session + bảng phụ (trong transaction của caller), cộng vào rollup
+    ngày / tuần, trả về session id.
+    """
+    c = conn.execute(
+        """
+        INSERT INTO sessions
+        (timestamp, patient_name, exercise, reps, min_angle, max_angle, assessment,
+         ts, rom_score, fatigue_level, calib_min, calib_max, duration_s)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """,
+        (
+            record["timestamp"],
+            record["patient_name"],
+            record["exercise"],
+            record["reps"],
+            record["min_angle"],
+            record["max_angle"],
+            record["assessment"],
+            record["ts"],
+            record["rom_score"],
+            record["fatigue_level"],
+            record["calib_min"],
+            record["calib_max"],
+            record["duration_s"],
+        ),
+    )
+    session_id = c.lastrowid
+    db.add_to_rollups(conn, session_id)
+    if model_switches:
+        conn.executemany(
             """
-            INSERT INTO sessions
-            (timestamp, patient_name, exercise, reps, min_angle, max_angle, assessment)
+            INSERT INTO model_switches
+            (session_id, time, from_complexity, to_complexity, latency_ms, budget_ms, reps)
             VALUES (?, ?, ?, ?, ?, ?, ?)
         """,
-            (
-                timestamp,
-                patient_name,
-                exercise_name,
-                reps,
-                max_rom_flex,
-                max_rom_ext,
-                assessment,
-            ),
+            [
+                (
+                    session_id,
+                    e["time"],
+                    e["from"],
+                    e["to"],
+                    e["latency_ms"],
+                    e["budget_ms"],
+                    e["reps"],
+                )
+                for e in model_switches
+            ],
         )
-        conn.commit()
-        conn.close()
+    if rep_records and series_id is None:
+        # Có journal: rep đã nằm trong series_reps (đọc chung qua view session_reps)
+        conn.executemany(
+            """
+            INSERT INTO rep_metrics
+            (session_id, rep, start_s, duration_s, eccentric_s, concentric_s,
+             peak_velocity, min_angle, max_angle, rom)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+            [
+                (
+                    session_id,
+                    r["rep"],
+                    r["start"],
+                    r["duration"],
+                    r["eccentric_s"],
+                    r["concentric_s"],
+                    r["peak_velocity"],
+                    r["min_angle"],
+                    r["max_angle"],
+                    r["rom"],
+                )
+                for r in rep_records
+            ],
+        )
+    if metrics is not None:
+        conn.execute(
+            "INSERT INTO session_metrics (session_id, metrics) VALUES (?, ?)",
+            (session_id, json.dumps(metrics)),
+        )
+    if series_id is not None:
+        conn.execute(
+            "UPDATE session_series SET session_id = ? WHERE id = ?",
+            (session_id, series_id),
+        )
+    return session_id
 
-        print(f"Data saved: {reps} reps, {assessment}")
-        return True
 
-    except Exception as e:
-        print(f"Log Error: {e}")
-        return False
+def append_csv(record, filename=CSV_FILE):
+    file_exists = os.path.isfile(filename)
+    with open(filename, mode="a", newline="") as file:
+        writer = csv.writer(file)
+        if not file_exists:
+            writer.writerow(CSV_HEADER)
+        writer.writerow(
+            [
+                record["timestamp"],
+                record["patient_name"],
+                record["exercise"],
+                record["reps"],
+                record["min_angle"],
+                record["max_angle"],
+                record["assessment"],
+            ]
+        )
+
+
+def log_session(
+    patient_name,
+    exercise_name,
+    reps,
+    max_rom_flex,
+    max_rom_ext,
+    rom_score=None,
+    fatigue_flag=None,
+    model_switches=None,
+    rep_records=None,
+    metrics=None,
+    series_id=None,
+    calib_min=None,
+    calib_max=None,
+    duration_s=None,
+):
+    """
+    Lưu dữ liệu vào cả CSV (để xem nhanh) và SQLite (để quản lý hệ thống)
+    rom_score (%), fatigue_flag ('Low'/'Moderate'/'High') được thêm vào assessment
+    và lưu thành cột riêng cùng calib_min / calib_max (ngưỡng auto-calib) và
+    duration_s; rollup ngày / tuần (đọc qua progress.py) cập nhật trong cùng
+    transaction.
+    model_switches: các lần đổi model_complexity (ComplexityGovernor.events).
+    rep_records: bản ghi từng rep (RepSegmenter) -> bảng rep_metrics; bỏ qua
+                 khi có series_id (journal đã ghi rep vào series_reps).
+    metrics: Metrics.snapshot() của session (latency, frame bỏ, exception)
+             -> bảng session_metrics (JSON).
+    series_id: SeriesJournal của session (chuỗi theo frame) -> gắn session id.
+
+    Không chặn thread gọi (Tk): việc ghi chạy ở db.DatabaseWriter, CSV ghi
+    sau khi commit. Trả về Future (session id); lỗi được in ra ở thread ghi.
+    """
+    record = session_record(
+        patient_name, exercise_name, reps, max_rom_flex, max_rom_ext,
+        rom_score=rom_score, fatigue_flag=fatigue_flag,
+        calib_min=calib_min, calib_max=calib_max, duration_s=duration_s,
+    )
+
+    def saved(session_id):
+        append_csv(record)
+        print(f"Data saved: {reps} reps, {record['assessment']}")
+
+    return db.get_writer().submit(
+        insert_session, record, model_switches, rep_records, metrics, series_id,
+        after=saved,
+    )
 
 
 # --- 4. VISUALIZATION ---
-def show_performance_chart(angle_history, exercise_name, patient_name):
-    """Vẽ biểu đồ dao động góc khớp"""
-    if not angle_history:
-        return
-
-    plt.figure(figsize=(10, 5))
-    plt.plot(angle_history, label="Joint Angle", color="#20bf6b", linewidth=2)
-
-    plt.axhline(y=160, color="r", linestyle="--", label="Extension (Straight)")
-
-    target = 30 if exercise_name == "Bicep Curl" else 90
-    plt.axhline(y=target, color="b", linestyle="--", label="Flexion (Bent)")
-
-    plt.title(f"Analysis: {exercise_name} - Patient: {patient_name}")
-    plt.xlabel("Frames (Time)")
-    plt.ylabel("Angle (Degrees)")
-    plt.legend()
-    plt.grid(True, alpha=0.3)
-    plt.tight_layout()
-    plt.show()
+def show_performance_chart(
+    parent,
+    session_id,
+    t,
+    angle,
+    exercise_name,
+    patient_name,
+    thresholds=None,
+    calib=None,
+):
+    """
+    Mở cửa sổ biểu đồ góc khớp (Toplevel của `parent`), trả về cửa sổ.
+    t: giây từ đầu session; thresholds: (DOWN_TH, UP_TH) sau auto-calib;
+    calib: (min, max) góc đã calib. Ảnh vẽ ở thread nền (chart.render_cached)
+    nên Tk không bị đứng; xem lại cùng session_id lấy ngay từ cache.
+    """
+    if len(angle) == 0:
+        return None
+
+    future = chart.render_cached(
+        session_id, t, angle, exercise_name, patient_name,
+        thresholds=thresholds, calib=calib,
+    )
+    win = tk.Toplevel(parent)
+    win.title(f"Analysis: {exercise_name} - {patient_name}")
+    win.configure(bg="white")
+    label = tk.Label(win, text="Rendering chart...", bg="white", font=("Segoe UI", 12))
+    label.pack(padx=10, pady=10)
+
+    def show():
+        if not win.winfo_exists():
+            return
+        if not future.done():
+            win.after(30, show)
+            return
+        try:
+            image = future.result()
+        except Exception as e:
+            label.config(text=f"Chart Error: {e}")
+            return
+        photo = ImageTk.PhotoImage(image)
+        label.config(image=photo, text="")
+        label.image = photo  # giữ tham chiếu, tránh bị GC
+
+    show()
+    return win